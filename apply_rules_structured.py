@@ -1,66 +1,73 @@
 import argparse
-import ast
 import json
-import re
 from pathlib import Path
 
+from progress_events import Progress
+from rule_compiler import apply_sequential, compile_rules, load_bundle
+from rule_lexicon import lexicon_path, load_lexicon
+from rule_profiler import print_summary, profile_rules, report_path
+from stage_profile import add_profile_args, profiled_main
 
-def load_rules_from_py(file_path: Path):
-    src = file_path.read_text(encoding="utf-8", errors="replace")
-    tree = ast.parse(src, str(file_path))
-    rules: list[tuple[str, str]] = []
 
-    class V(ast.NodeVisitor):
-        def visit_Assign(self, node: ast.Assign):
-            val = node.value
-            if not isinstance(val, ast.Call):
-                return
-            func = val.func
-            is_resub = (
-                isinstance(func, ast.Attribute)
-                and isinstance(func.value, ast.Name)
-                and func.value.id == "re"
-                and func.attr == "sub"
-            )
-            if not is_resub:
-                return
-            args = val.args
-            if len(args) >= 3:
-                pat, repl, sarg = args[0], args[1], args[2]
-                if isinstance(pat, (ast.Str, ast.Constant)) and isinstance(repl, (ast.Str, ast.Constant)):
-                    p = pat.s if isinstance(pat, ast.Str) else pat.value
-                    r = repl.s if isinstance(repl, ast.Str) else repl.value
-                    if isinstance(p, str) and isinstance(r, str):
-                        rules.append((p, r))
-            self.generic_visit(node)
+def apply_rules(blocks, rules, sequential: bool = False, plan=None, lexicon=None) -> int:
+    """Apply rules to the text of every block in place; returns the number of replacements.
 
-    V().visit(tree)
-    return rules
+    By default the rules run as a fused plan (rule_compiler.py) that produces the
+    same text in far fewer passes; pass a precompiled plan to skip compilation.
+    With a lexicon (rule_lexicon.py) every word is looked up instead.
+    """
+    if sequential:
+        apply = lambda txt: apply_sequential(txt, rules)
+    elif lexicon is not None:
+        apply = lexicon.apply
+    else:
+        apply = (plan or compile_rules(rules)).apply
+    applied_total = 0
+    with Progress("oldspelling", len(blocks), "blocks") as progress:
+        for b in blocks:
+            txt, n = apply(b.get("text") or "")
+            applied_total += n
+            b["text"] = txt
+            progress.advance()
+    return applied_total
 
 
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(description="Apply oldspelling re.sub rules to structured blocks JSON.")
     ap.add_argument("--rules", default="oldspelling.py", help="Path to rules file")
     ap.add_argument("--in", dest="inp", default="output_vol2/structured.json", help="Structured JSON input")
     ap.add_argument("--out", default="output_vol2/structured_rules.json", help="Structured JSON output")
+    ap.add_argument("--sequential", action="store_true",
+                    help="Apply the rules one re.subn pass at a time instead of the compiled plan")
+    ap.add_argument("--rebuild-bundle", action="store_true",
+                    help="Rebuild the precompiled rule bundle (<rules>.rules.pickle) even if it is up to date")
+    ap.add_argument("--lexicon", action="store_true",
+                    help="Look every word up in a modernization dictionary (<rules>.lexicon.tsv, if present, "
+                         "plus words learned on the fly) instead of running the plan over the text")
+    ap.add_argument("--rule-report", action="store_true",
+                    help="Time every rule separately and write a per-rule report (hits, blocks, time, samples) "
+                         "next to --out as <out>.rule_report.json")
+    add_profile_args(ap)
     args = ap.parse_args()
 
-    rules = load_rules_from_py(Path(args.rules))
+    bundle = load_bundle(Path(args.rules), rebuild=args.rebuild_bundle)
     data = json.loads(Path(args.inp).read_text(encoding="utf-8"))
     blocks = data.get("blocks", [])
-    applied_total = 0
-
-    for b in blocks:
-        txt = b.get("text") or ""
-        for pat, repl in rules:
-            try:
-                new_txt, n = re.subn(pat, repl, txt)
-            except re.error:
-                continue
-            if n:
-                applied_total += n
-                txt = new_txt
-        b["text"] = txt
+    if args.rule_report:
+        applied_total, report = profile_rules(blocks, bundle)
+        out = report_path(Path(args.out))
+        out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print_summary(report)
+        print(f"Rule report: {out}")
+    elif args.lexicon:
+        lexicon = load_lexicon(Path(args.rules), bundle)
+        known = len(lexicon.words)
+        applied_total = apply_rules(blocks, bundle.rules, lexicon=lexicon)
+        print(f"Lexicon: {known} words from {lexicon_path(Path(args.rules)).name}, "
+              f"{len(lexicon.words) - known + len(lexicon.dependent)} learned, {lexicon.fallbacks} blocks via the plan")
+    else:
+        applied_total = apply_rules(blocks, bundle.rules, sequential=args.sequential, plan=bundle.plan)
 
     data["rules_applied"] = applied_total
     Path(args.out).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
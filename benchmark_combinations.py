@@ -0,0 +1,300 @@
+"""
+Бенчмарк комбинаций необязательных этапов пайплайна для дашборда (docs/index.html).
+
+Запускает pdf_to_epub.py для базовой конфигурации (только модернизация) и всех
+63 непустых комбинаций шести необязательных инструментов, сравнивает итоговый
+текст с эталоном (text_scorer.py, с атрибуцией оставшихся ошибок по этапам) и
+пишет docs/dashboard_data_extended.json:
+
+    python benchmark_combinations.py --pdf docs/karp.pdf --reference docs/karp.txt
+
+Все комбинации выполняются в одной рабочей папке с общим кэшем этапов
+(stage_cache.py): перед каждой комбинацией папка очищается, и этапы общего
+префикса (извлечение, oldspelling, модернизация, LanguageTool на том же входе и т.д.)
+восстанавливаются из кэша, а не выполняются заново. Время комбинации — сумма
+времени её этапов; для этапа из кэша берётся время его первого выполнения
+(stage_runs.json в рабочей папке), поэтому оно сопоставимо с полным запуском.
+
+После прогона метрики этапов и качество дописываются в историю производительности
+(perf_history.py, docs/perf_history.jsonl).
+"""
+import argparse
+import itertools
+import json
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import perf_history
+import text_scorer
+from generate_epub import looks_like_section_heading
+
+# (ключ, название на дашборде, флаги pdf_to_epub.py)
+TOOLS = [
+    ("lt-cloud", "LanguageTool", ["--lt-cloud"]),
+    ("local-spell", "pyspellchecker", ["--local-spell", "--local-spell-type", "pyspellchecker"]),
+    ("context-check", "Context-check", ["--context-check"]),
+    ("natasha-check", "Natasha-check", ["--natasha-check"]),
+    ("natasha-sync", "Natasha-sync", ["--natasha-sync"]),
+    ("stanza-tokenize", "Stanza", ["--stanza-tokenize", "--stanza-model", "stanza_rubicdata_tokenizer.pt"]),
+]
+CATEGORIES = {
+    "spell_check": ["LanguageTool", "pyspellchecker", "Context-check"],
+    "ner": ["Natasha-check", "Natasha-sync"],
+    "tokenization": ["Stanza"],
+}
+BASE_NAME = "Базовый (только модернизация)"
+# Итоговый текст пайплайна — первый существующий файл (как источник EPUB в pdf_to_epub.py)
+RESULT_FILES = ["final_clean.txt", "final.txt"]
+# Метрики выполнения этапа из pipeline_metrics.json, которые запоминаются по ключу кэша
+STAGE_METRICS = ("wall_s", "cpu_s", "peak_rss_mb")
+
+
+def paragraphs(text: str) -> list[str]:
+    return [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+
+def structure_preservation(result: str, reference: str) -> dict:
+    """Сохранность абзацев и заголовков относительно эталона."""
+    ref_pars, res_pars = paragraphs(reference), paragraphs(result)
+    ref_heads = [p for p in ref_pars if looks_like_section_heading(p)]
+    res_heads = {" ".join(p.split()) for p in res_pars if looks_like_section_heading(p)}
+    preserved = sum(1 for h in ref_heads if " ".join(h.split()) in res_heads)
+    total = len(ref_pars) + len(res_pars)
+    return {
+        "paragraph_count_ratio": len(res_pars) / len(ref_pars) if ref_pars else 0.0,
+        "heading_preservation": preserved / len(ref_heads) if ref_heads else 0.0,
+        "structure_similarity": 1 - abs(len(ref_pars) - len(res_pars)) / total if total else 1.0,
+        "reference_paragraphs": len(ref_pars),
+        "result_paragraphs": len(res_pars),
+        "reference_headings": len(ref_heads),
+        "result_headings": len(res_heads),
+        "preserved_headings": preserved,
+    }
+
+
+def combinations(keys: list[str]) -> list[tuple]:
+    """Базовая конфигурация и все непустые комбинации в порядке: по числу инструментов, затем по TOOLS."""
+    combos = [()]
+    for size in range(1, len(keys) + 1):
+        combos.extend(itertools.combinations(keys, size))
+    return combos
+
+
+def combo_flags(combo: tuple) -> list[str]:
+    flags = {key: f for key, _, f in TOOLS}
+    return [flag for key in combo for flag in flags[key]]
+
+
+def combo_names(combo: tuple) -> list[str]:
+    names = {key: name for key, name, _ in TOOLS}
+    return [names[key] for key in combo]
+
+
+def clean_workdir(workdir: Path):
+    """Удалить результаты предыдущей комбинации, оставив кэш этапов и время этапов."""
+    for path in workdir.iterdir():
+        if path.name in (".stage_cache", "stage_runs.json", "logs"):
+            continue
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+
+
+def run_combination(combo: tuple, args, here: Path, workdir: Path, stage_runs: dict, measured: dict) -> dict | None:
+    """Выполнить пайплайн для комбинации; None, если обязательный этап упал.
+
+    stage_runs — метрики выполнений этапов по ключу кэша, measured — ключи этапов, которые в этом прогоне
+    действительно выполнялись (взятые из кэша сюда не попадают: их время измерено на другом коммите).
+    """
+    clean_workdir(workdir)
+    cmd = [
+        sys.executable, str(here / "pdf_to_epub.py"),
+        "--pdf", str(Path(args.pdf).resolve()),
+        "--outdir", str(workdir.resolve()),
+        "--title", args.title,
+        "--stage-workers", "1",
+        "--progress-interval", "0",
+    ] + combo_flags(combo)
+    if args.no_cache:
+        cmd.append("--no-stage-cache")
+    log = workdir / "logs" / f"{'_'.join(combo) or 'base'}.log"
+    started = time.perf_counter()
+    with open(log, "w", encoding="utf-8") as f:
+        code = subprocess.run(cmd, cwd=here, stdout=f, stderr=subprocess.STDOUT).returncode
+    wall = time.perf_counter() - started
+
+    try:
+        metrics = json.loads((workdir / "pipeline_metrics.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        metrics = {"stages": []}
+    total, cached = 0.0, []
+    for stage in metrics["stages"]:
+        key = stage.get("cache_key")
+        if stage["status"] == "cached" and key in stage_runs:
+            cached.append(stage["name"])
+        elif stage["status"] == "ok":
+            # без кэша этапов (--no-cache) ключа нет: выполнение запоминается под ключом комбинации
+            key = key or f"{'+'.join(combo) or 'base'}:{stage['name']}"
+            stage_runs[key] = {"stage": stage["name"], **{m: stage.get(m) for m in STAGE_METRICS}}
+            measured.setdefault(key)
+        else:
+            total += stage["wall_s"]
+            continue
+        total += stage_runs[key]["wall_s"]
+
+    result_file = next((workdir / name for name in RESULT_FILES if (workdir / name).exists()), None)
+    if code != 0 or result_file is None:
+        print(f"❌ {' + '.join(combo_names(combo)) or 'база'}: ошибка пайплайна, см. {log}")
+        return None
+    reference = Path(args.reference).read_text(encoding="utf-8")
+    result = result_file.read_text(encoding="utf-8")
+    entry = text_scorer.score(result, reference)
+    attribution = text_scorer.attribute_outdir(reference, workdir)
+    entry.update({
+        "time": total,
+        "wall_s": round(wall, 3),
+        "cached_stages": cached,
+        "failed_stages": [s["name"] for s in metrics["stages"] if s["status"] == "error"],
+        "result_file": result_file.name,
+        "structure_preservation": structure_preservation(result, reference),
+        "error_attribution": {s["stage"]: s["remaining"] for s in attribution["stages"]},
+    })
+    return entry
+
+
+def combo_entry(combo: tuple, metrics: dict) -> dict:
+    names = combo_names(combo)
+    return {
+        "combo_name": " + ".join(["Модернизация"] + names),
+        "flags": " ".join(combo_flags(combo)),
+        "tools": list(combo),
+        **metrics,
+    }
+
+
+def dependency_tree(combo: tuple, results: dict, keys: list[str]) -> dict:
+    """Дерево комбинаций: потомки узла — комбинации с ещё одним инструментом правее последнего."""
+    metrics = results.get(combo)
+    node = {
+        "id": "_".join(("base",) + combo),
+        "name": " + ".join([BASE_NAME] + combo_names(combo)),
+        "tools": list(combo),
+        "similarity": metrics["similarity"] if metrics else None,
+        "accuracy": metrics["accuracy"] if metrics else None,
+        "time": metrics["time"] if metrics else None,
+        "children": [],
+    }
+    if combo:
+        entry = combo_entry(combo, {})
+        node["combo_name"], node["flags"] = entry["combo_name"], entry["flags"]
+    start = keys.index(combo[-1]) + 1 if combo else 0
+    node["children"] = [dependency_tree(combo + (key,), results, keys) for key in keys[start:]]
+    return node
+
+
+def tool_impact(results: dict, keys: list[str]) -> dict:
+    """Влияние инструмента: комбинация из одного инструмента против базовой конфигурации."""
+    base = results.get(())
+    impact = {}
+    for key, name, _ in TOOLS:
+        if key not in keys:
+            continue
+        single = results.get((key,))
+        if base is None or single is None:
+            continue
+        impact[name] = {
+            "impact": {f"{metric}_delta": single[metric] - base[metric] for metric in ("similarity", "accuracy", "time")},
+            "count": sum(1 for combo in results if key in combo),
+        }
+    return impact
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Прогнать все комбинации необязательных этапов и записать данные дашборда.")
+    ap.add_argument("--pdf", default="docs/karp.pdf", help="PDF для бенчмарка")
+    ap.add_argument("--reference", default="docs/karp.txt", help="Эталонный текст")
+    ap.add_argument("--out", default="docs/dashboard_data_extended.json", help="JSON для дашборда")
+    ap.add_argument("--workdir", default="benchmark_runs", help="Рабочая папка с кэшем этапов (переиспользуется между запусками)")
+    ap.add_argument("--title", default="Бенчмарк", help="Название книги для пайплайна")
+    ap.add_argument("--tools", default=",".join(key for key, _, _ in TOOLS),
+                    help="Инструменты, из которых строятся комбинации (через запятую)")
+    ap.add_argument("--no-cache", action="store_true", help="Выполнять каждую комбинацию полностью, без кэша этапов")
+    ap.add_argument("--history", type=Path, default=perf_history.DEFAULT_HISTORY,
+                    help="Файл истории производительности (JSON lines)")
+    ap.add_argument("--no-history", action="store_true", help="Не дописывать прогон в историю производительности")
+    args = ap.parse_args()
+
+    here = Path(__file__).parent
+    known = [key for key, _, _ in TOOLS]
+    keys = [key for key in known if key in {k.strip() for k in args.tools.split(",")}]
+    unknown = {k.strip() for k in args.tools.split(",") if k.strip()} - set(known)
+    if unknown:
+        ap.error(f"неизвестные инструменты: {', '.join(sorted(unknown))}; доступны: {', '.join(known)}")
+
+    workdir = Path(args.workdir)
+    (workdir / "logs").mkdir(parents=True, exist_ok=True)
+    runs_path = workdir / "stage_runs.json"
+    stage_runs = {} if args.no_cache or not runs_path.exists() else json.loads(runs_path.read_text(encoding="utf-8"))
+    measured = {}  # ключи выполненных в этом прогоне этапов в порядке первого появления
+
+    combos = combinations(keys)
+    results = {}
+    started = time.perf_counter()
+    for i, combo in enumerate(combos, 1):
+        metrics = run_combination(combo, args, here, workdir, stage_runs, measured)
+        runs_path.write_text(json.dumps(stage_runs, indent=2), encoding="utf-8")
+        if metrics is None:
+            continue
+        results[combo] = metrics
+        label = " + ".join(combo_names(combo)) or "база"
+        print(f"[{i}/{len(combos)}] {label}: схожесть {metrics['similarity']:.2f}%, точность {metrics['accuracy']:.2f}%, "
+              f"время {metrics['time']:.2f}s (фактически {metrics['wall_s']:.2f}s, из кэша: {len(metrics['cached_stages'])})")
+    wall = time.perf_counter() - started
+
+    base = results.get(())
+    data = {
+        "metadata": {
+            "total_combinations": sum(1 for combo in results if combo),
+            "tools": {key: name for key, name, _ in TOOLS if key in keys},
+            "categories": CATEGORIES,
+            "base_metrics": {k: base[k] for k in ("similarity", "accuracy", "time")} if base else None,
+            "has_extended_metrics": True,
+            "pdf": Path(args.pdf).name,
+            "reference": Path(args.reference).name,
+            "failed_combinations": [list(combo) for combo in combos if combo not in results],
+            "benchmark_wall_s": round(wall, 3),
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "dependency_tree": dependency_tree((), results, keys),
+        "all_combinations": [combo_entry(combo, results[combo]) for combo in combos if combo and combo in results],
+        "tool_impact": tool_impact(results, keys),
+    }
+    Path(args.out).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    full = sum(m["time"] for m in results.values())
+    print(f"\nКомбинаций: {len(results)}/{len(combos)}, время бенчмарка {wall:.1f}s "
+          f"(без кэша было бы ~{full:.1f}s). Данные дашборда: {args.out}")
+
+    if results and not args.no_history:
+        best = max((c for c in results if c), key=lambda c: results[c]["accuracy"], default=None)
+        record = perf_history.make_record(
+            here,
+            [stage_runs[key] for key in measured],
+            base,
+            (combo_entry(best, {})["combo_name"], results[best]) if best else None,
+            pdf=Path(args.pdf).name,
+            tools=keys,
+            combinations=len(results),
+            benchmark_wall_s=round(wall, 3),
+        )
+        perf_history.append_record(args.history, record)
+        print(f"Прогон добавлен в историю производительности: {args.history} (коммит {(record['commit'] or '?')[:10]})")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+Микробенчмарки горячих функций обработки текста.
+
+Для каждой функции строится реалистичный вход — русский текст docs/karp.txt с
+типичными артефактами OCR (переносы на концах строк, ѣ/і, латинские буквы внутри
+кириллических слов, р а з р я д к а, мягкие переносы, прямые кавычки) — нескольких
+размеров: от абзаца до целой книги. Печатается пропускная способность в символах
+в секунду и показатель масштабирования: наклон log(время) по log(размер) между
+соседними размерами. Наклон около 1 — линейная функция; заметно больше 1 —
+сверхлинейное место, которое станет узким на длинных книгах.
+
+    python benchmark_hotpaths.py
+    python benchmark_hotpaths.py --functions normalize_punct,merge_paragraph_blocks --json hotpaths.json
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+from extract_structured_text import collect_block_text
+from generate_epub import split_into_chapters
+from lt_cloud import apply_matches
+from modernize_structured import apply_letter_flags, merge_paragraph_blocks, normalize_linebreaks, normalize_punct
+from post_cleanup import cleanup_text
+
+SOURCE = Path(__file__).parent / "docs" / "karp.txt"
+SIZES = {"paragraph": 500, "page": 2_000, "chapter": 50_000, "book": 1_000_000}
+# Наклон выше этого считается сверхлинейным; на замерах короче SLOPE_MIN_SECONDS
+# он не отмечается — там время определяют постоянные накладные расходы вызова
+SUPERLINEAR_SLOPE = 1.2
+SLOPE_MIN_SECONDS = 0.001
+
+HOMOGLYPHS = {"о": "o", "а": "a", "е": "e", "р": "p", "с": "c", "х": "x", "у": "y"}
+WORD_RE = re.compile(r"[А-Яа-яЁё]+")
+
+
+def _damage_word(word: str, rng: random.Random) -> str:
+    """Один из артефактов OCR в слове (или слово без изменений)."""
+    roll = rng.random()
+    if roll < 0.03 and "е" in word:
+        return word.replace("е", "ѣ", 1)
+    if roll < 0.05 and re.search(r"и[аеиоуыэюя]", word):
+        return re.sub(r"и(?=[аеиоуыэюя])", "і", word, count=1)
+    if roll < 0.07:
+        chars = list(word)
+        for i, ch in enumerate(chars):
+            if ch in HOMOGLYPHS:
+                chars[i] = HOMOGLYPHS[ch]
+                break
+        return "".join(chars)
+    if roll < 0.075 and len(word) > 3:
+        return " ".join(word)  # разрядка
+    if roll < 0.085 and len(word) > 6:
+        cut = len(word) // 2
+        return word[:cut] + "­" + word[cut:]
+    return word
+
+
+def ocr_paragraphs(size: int, seed: int = 0) -> list[str]:
+    """Абзацы «распознанного» текста общей длиной не меньше size символов."""
+    rng = random.Random(seed)
+    source = [p.strip() for p in SOURCE.read_text(encoding="utf-8").split("\n\n") if p.strip()]
+    paragraphs, total, i = [], 0, 0
+    while total < size:
+        text = WORD_RE.sub(lambda m: _damage_word(m.group(0), rng), source[i % len(source)])
+        text = text.replace("«", '"').replace("»", '"').replace("…", "...")
+        paragraphs.append(text)
+        total += len(text) + 2
+        i += 1
+    return paragraphs
+
+
+def wrap_lines(paragraph: str, rng: random.Random, width: int = 60) -> list[str]:
+    """Строки, как на странице: перенос по ширине, иногда с дефисом внутри слова."""
+    lines, line = [], ""
+    for word in paragraph.split(" "):
+        if line and len(line) + 1 + len(word) > width:
+            if len(word) > 5 and rng.random() < 0.3:
+                cut = len(word) // 2
+                lines.append(f"{line} {word[:cut]}-")
+                line = word[cut:]
+                continue
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def ocr_text(size: int, seed: int = 0) -> str:
+    """Текст с переносами строк внутри абзацев, абзацы через пустую строку."""
+    rng = random.Random(seed)
+    return "\n\n".join("\n".join(wrap_lines(p, rng)) for p in ocr_paragraphs(size, seed))[:size]
+
+
+def ocr_blocks(size: int, seed: int = 0) -> list[dict]:
+    """Блоки после извлечения: абзацы, часть которых разорвана границей страницы, и заголовки."""
+    rng = random.Random(seed)
+    blocks = []
+    for i, paragraph in enumerate(ocr_paragraphs(size, seed)):
+        if i % 30 == 0:
+            blocks.append({"role": "heading", "text": f"Глава {i // 30 + 1}", "page": i // 4 + 1})
+        text = "\n".join(wrap_lines(paragraph, rng))
+        if rng.random() < 0.25 and " " in text[len(text) // 2:]:
+            cut = text.index(" ", len(text) // 2)
+            blocks.append({"role": "paragraph", "text": text[:cut], "page": i // 4 + 1})
+            text = text[cut + 1:]
+        blocks.append({"role": "paragraph", "text": text, "page": i // 4 + 1})
+    return blocks
+
+
+def pdf_block(size: int, seed: int = 0) -> dict:
+    """Блок в формате page.get_text("dict"): строки из одного-двух спанов."""
+    rng = random.Random(seed)
+    lines = []
+    for line in ocr_text(size, seed).split("\n"):
+        cut = rng.randrange(len(line) + 1)
+        lines.append({"spans": [{"text": line[:cut]}, {"text": line[cut:]}]})
+    return {"type": 0, "lines": lines}
+
+
+def lt_matches(text: str, seed: int = 0) -> list[dict]:
+    """Ответ LanguageTool: исправление примерно каждого десятого слова."""
+    rng = random.Random(seed)
+    matches = []
+    for m in WORD_RE.finditer(text):
+        if rng.random() < 0.1:
+            word = m.group(0)
+            matches.append({"offset": m.start(), "length": len(word), "replacements": [{"value": word.lower()}]})
+    return matches
+
+
+def _chars(blocks) -> int:
+    return sum(len(b.get("text") or "") for b in blocks)
+
+
+def _text_case(func):
+    def prepare(size, seed):
+        text = ocr_text(size, seed)
+        return (lambda: func(text)), len(text)
+    return prepare
+
+
+def _collect_block_text(size, seed):
+    block = pdf_block(size, seed)
+    chars = sum(len(sp["text"]) for ln in block["lines"] for sp in ln["spans"])
+    return (lambda: collect_block_text(block)), chars
+
+
+def _merge_paragraph_blocks(size, seed):
+    blocks = ocr_blocks(size, seed)
+    return (lambda: merge_paragraph_blocks(blocks)), _chars(blocks)
+
+
+def _apply_matches(size, seed):
+    text = ocr_text(size, seed)
+    matches = lt_matches(text, seed)
+    return (lambda: apply_matches(text, matches)), len(text)
+
+
+def _split_into_chapters(size, seed):
+    blocks = ocr_blocks(size, seed)
+    return (lambda: split_into_chapters(blocks)), _chars(blocks)
+
+
+# Имя → подготовка входа: (размер, seed) → (вызов без аргументов, число символов входа)
+CASES = {
+    "collect_block_text": _collect_block_text,
+    "normalize_linebreaks": _text_case(normalize_linebreaks),
+    "normalize_punct": _text_case(normalize_punct),
+    "apply_letter_flags": _text_case(apply_letter_flags),
+    "merge_paragraph_blocks": _merge_paragraph_blocks,
+    "post_cleanup.cleanup_text": _text_case(cleanup_text),
+    "lt_cloud.apply_matches": _apply_matches,
+    "generate_epub.split_into_chapters": _split_into_chapters,
+}
+
+
+def time_call(call, repeat: int) -> float:
+    """Лучшее время одного вызова: число вызовов подбирается так, чтобы замер длился ≥0.2 с."""
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def slope(a: dict, b: dict) -> float | None:
+    """Показатель масштабирования между двумя замерами: d log(время) / d log(размер)."""
+    if a["chars"] == b["chars"] or a["seconds"] <= 0 or b["seconds"] <= 0:
+        return None
+    return math.log(b["seconds"] / a["seconds"]) / math.log(b["chars"] / a["chars"])
+
+
+def run_case(name: str, sizes: dict, repeat: int, seed: int) -> list[dict]:
+    rows = []
+    for label, size in sizes.items():
+        call, chars = CASES[name](size, seed)
+        seconds = time_call(call, repeat)
+        row = {"function": name, "size": label, "chars": chars, "seconds": seconds,
+               "chars_per_s": chars / seconds if seconds > 0 else None, "slope": None}
+        if rows:
+            row["slope"] = slope(rows[-1], row)
+        row["superlinear"] = (row["slope"] is not None and row["slope"] > SUPERLINEAR_SLOPE
+                              and seconds >= SLOPE_MIN_SECONDS)
+        rows.append(row)
+    return rows
+
+
+HEADER = f"{'функция':<36} {'размер':<10} {'символов':>10} {'время':>12} {'символов/с':>14} {'наклон':>7}"
+
+
+def print_rows(rows: list[dict]):
+    for row in rows:
+        s = row["slope"]
+        flag = "  ⚠️ сверхлинейно" if row["superlinear"] else ""
+        print(f"{row['function']:<36} {row['size']:<10} {row['chars']:>10} {row['seconds'] * 1000:>10.3f}ms "
+              f"{row['chars_per_s']:>14,.0f} {'' if s is None else f'{s:.2f}':>7}{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Микробенчмарки горячих функций обработки текста.")
+    ap.add_argument("--functions", default="", help=f"Функции через запятую (по умолчанию все): {', '.join(CASES)}")
+    ap.add_argument("--sizes", default=",".join(SIZES),
+                    help="Размеры через запятую: paragraph, page, chapter, book или число символов")
+    ap.add_argument("--repeat", type=int, default=3, help="Сколько замеров брать для минимума (по умолчанию: 3)")
+    ap.add_argument("--seed", type=int, default=0, help="Seed генератора артефактов OCR")
+    ap.add_argument("--json", help="Сохранить результаты в JSON")
+    args = ap.parse_args()
+
+    names = [n.strip() for n in args.functions.split(",") if n.strip()] or list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        ap.error(f"неизвестные функции: {', '.join(unknown)}")
+    sizes = {}
+    for token in (t.strip() for t in args.sizes.split(",") if t.strip()):
+        if token in SIZES:
+            sizes[token] = SIZES[token]
+        elif token.isdigit():
+            sizes[token] = int(token)
+        else:
+            ap.error(f"неизвестный размер: {token}")
+
+    rows = []
+    print(HEADER)
+    for name in names:
+        case_rows = run_case(name, sizes, args.repeat, args.seed)
+        print_rows(case_rows)
+        rows.extend(case_rows)
+
+    hot = [r for r in rows if r["superlinear"]]
+    if hot:
+        print("\nСверхлинейный рост времени:")
+        for r in hot:
+            print(f"  {r['function']} до {r['size']} ({r['chars']} символов): наклон {r['slope']:.2f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"sizes": sizes, "seed": args.seed, "results": rows},
+                                              ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Результаты сохранены в {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
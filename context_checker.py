@@ -11,6 +11,8 @@ if not hasattr(inspect, "getargspec"):
     inspect.getargspec = _getargspec  # type: ignore[attr-defined]
 
 from pymorphy2 import MorphAnalyzer
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
 
 WORD_RE = re.compile(r"\b[\w']+\b", re.UNICODE)
 DEFAULT_PRONOUNS = {"я", "ты", "он", "она", "оно", "мы", "вы", "они"}
@@ -40,7 +42,9 @@ def has_verb_form(word: str, morph: MorphAnalyzer) -> bool:
 def analyze_text(text: str, pronouns: set[str], morph: MorphAnalyzer) -> list[str]:
     sentences = re.split(r"(?<=[.!?])\s+", text)
     warnings = []
+    progress = Progress("context", len(sentences), "sentences")
     for sentence in sentences:
+        progress.advance()
         tokens = list(iter_words(sentence))
         for idx in range(len(tokens) - 1):
             prev_word = tokens[idx]
@@ -53,6 +57,7 @@ def analyze_text(text: str, pronouns: set[str], morph: MorphAnalyzer) -> list[st
                     f"Пара {prev_word} + {curr_word} в предложении «{sentence.strip()}» ({snippet}) выглядит неправильно: {curr_word} не распознан как глагол."
                 )
         warnings.extend(check_split_words(tokens, morph, sentence.strip()))
+    progress.close()
     return warnings
 
 
@@ -83,6 +88,17 @@ def check_split_words(tokens: list[str], morph: MorphAnalyzer, sentence: str) ->
     return warnings
 
 
+def write_warnings(warnings: list[str], out_path: Path) -> None:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if warnings:
+        out_path.write_text("\n".join(warnings), encoding="utf-8")
+        print(f"Найдено {len(warnings)} потенциальных контекстных ошибок, сохранено в {out_path}")
+    else:
+        out_path.write_text("Ошибок не найдено.\n", encoding="utf-8")
+        print(f"Ошибок не найдено, создал пустой отчёт {out_path}")
+
+
+@profiled_main
 def main():
     parser = argparse.ArgumentParser(
         description="Контекстная проверка: ищет конструкции «местоимение + глагол» с неправильно распознанной формой."
@@ -94,6 +110,7 @@ def main():
         default=",".join(sorted(DEFAULT_PRONOUNS)),
         help="Через запятую разделённый список местоимений (по умолчанию: %(default)s)",
     )
+    add_profile_args(parser)
     args = parser.parse_args()
 
     pronouns = set(tok.strip().lower() for tok in args.pronouns.split(",") if tok.strip())
@@ -102,15 +119,7 @@ def main():
     morph = MorphAnalyzer()
 
     warnings = analyze_text(text, pronouns, morph)
-    out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    if warnings:
-        out_path.write_text("\n".join(warnings), encoding="utf-8")
-        print(f"Найдено {len(warnings)} потенциальных контекстных ошибок, сохранено в {out_path}")
-    else:
-        out_path.write_text("Ошибок не найдено.\n", encoding="utf-8")
-        print(f"Ошибок не найдено, создал пустой отчёт {out_path}")
+    write_warnings(warnings, Path(args.out))
 
 
 if __name__ == "__main__":
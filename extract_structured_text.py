@@ -1,9 +1,56 @@
 import argparse
+import hashlib
 import json
+import os
 import re
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
 
 import fitz  # PyMuPDF
+from stage_profile import add_profile_args, profiled_main
+from progress_events import Progress
+from trace_events import flush as flush_trace, span
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+# Bump when page_blocks_with_roles changes its output, to invalidate page caches.
+EXTRACT_VERSION = 2
+
+
+@dataclass(frozen=True)
+class ExtractOptions:
+    # "auto" = per-page column detection, "1" = top-to-bottom, "2" = split at the page center
+    columns: str = "auto"
+    # Document-wide heading threshold (--font-stats document); None = per-page median
+    heading_threshold: float | None = None
+    # Emit illustrations as image blocks (--images)
+    images: bool = False
+    # OCR fallback for pages without a text layer (--ocr); None = off
+    ocr_lang: str | None = None
+    ocr_dpi: int = 300
+    tesseract: str = "tesseract"
+    cache_dir: str | None = None
+
+    def cache_params(self) -> dict:
+        """Parameters that affect page output (everything except where the cache lives)."""
+        params = asdict(self)
+        params.pop("cache_dir")
+        params.pop("tesseract")
+        params["version"] = EXTRACT_VERSION
+        return params
 
 
 def collect_block_text(block) -> str:
@@ -26,49 +73,63 @@ def collect_block_text(block) -> str:
     return text.strip()
 
 
-def page_blocks_with_roles(page, two_columns=False):
-    d = page.get_text("dict")
+def _text_blocks(d):
+    """Text blocks of a page dict with per-span font sizes and char counts."""
     blocks = []
-    sizes = []
     for b in d.get("blocks", []):
         if b.get("type", 0) != 0:
             continue
         text = collect_block_text(b)
         if not text:
             continue
-        # Weighted average font size by span char count
         lines = b.get("lines", [])
-        total_chars = 0
-        wsum = 0.0
+        sizes = []
+        counts = []
         for ln in lines:
             for sp in ln.get("spans", []):
-                s = sp.get("size", 0)
-                t = sp.get("text", "") or ""
-                n = len(t)
-                if n and s:
-                    wsum += s * n
-                    total_chars += n
-        if total_chars == 0:
-            continue
-        wsize = wsum / total_chars
-        sizes.append(wsize)
+                sizes.append(sp.get("size", 0))
+                counts.append(len(sp.get("text", "") or ""))
         blocks.append({
             "bbox": b.get("bbox", [0, 0, 0, 0]),
             "text": text,
-            "wsize": wsize,
             "line_count": len(lines),
-            "chars": total_chars,
+            "span_sizes": sizes,
+            "span_chars": counts,
         })
-    # Determine heading threshold per page
-    if blocks:
-        sizes_sorted = sorted(b["wsize"] for b in blocks)
-        med = sizes_sorted[len(sizes_sorted)//2]
-        thr = med * 1.35 + 0.5
-    else:
-        thr = 0
+    return blocks
 
-    pw = page.rect.width
-    # Classify roles
+
+def _block_font_stats(cands):
+    """Weighted average font size (by span char count) and char count per block."""
+    stats = []
+    for b in cands:
+        total_chars = 0
+        wsum = 0.0
+        for s, n in zip(b["span_sizes"], b["span_chars"]):
+            if n and s:
+                wsum += s * n
+                total_chars += n
+        stats.append((wsum / total_chars if total_chars else 0.0, total_chars))
+    return stats
+
+
+def _block_font_stats_np(cands):
+    """Columnar variant of _block_font_stats: all spans of the page in flat arrays."""
+    per_block = np.fromiter((len(b["span_sizes"]) for b in cands), dtype=np.int64, count=len(cands))
+    n_spans = int(per_block.sum())
+    sizes = np.fromiter((s for b in cands for s in b["span_sizes"]), dtype=np.float64, count=n_spans)
+    chars = np.fromiter((n for b in cands for n in b["span_chars"]), dtype=np.int64, count=n_spans)
+    owner = np.repeat(np.arange(len(cands)), per_block)
+    valid = (chars > 0) & (sizes != 0)
+    owner = owner[valid]
+    # bincount accumulates in input order, so sums match the scalar loop exactly
+    wsum = np.bincount(owner, weights=sizes[valid] * chars[valid], minlength=len(cands))
+    total = np.bincount(owner, weights=chars[valid], minlength=len(cands)).astype(np.int64)
+    wsize = np.divide(wsum, total, out=np.zeros_like(wsum), where=total > 0)
+    return list(zip(wsize.tolist(), total.tolist()))
+
+
+def _classify_roles(blocks, pw: float, thr: float):
     for b in blocks:
         x0, y0, x1, y1 = b["bbox"]
         cx = (x0 + x1) / 2
@@ -82,9 +143,294 @@ def page_blocks_with_roles(page, two_columns=False):
         elif centered and short and not wide:
             is_heading = True
         b["role"] = "heading" if is_heading else "paragraph"
-    
+
+
+def _classify_roles_np(blocks, pw: float, thr: float):
+    bbox = np.array([b["bbox"] for b in blocks], dtype=np.float64).reshape(-1, 4)
+    wsize = np.array([b["wsize"] for b in blocks], dtype=np.float64)
+    line_count = np.array([b["line_count"] for b in blocks], dtype=np.int64)
+    chars = np.array([b["chars"] for b in blocks], dtype=np.int64)
+    cx = (bbox[:, 0] + bbox[:, 2]) / 2
+    centered = np.abs(cx - pw / 2) < pw * 0.12
+    wide = (bbox[:, 2] - bbox[:, 0]) > pw * 0.45
+    short = (line_count <= 3) & (chars <= 200)
+    big_font = wsize >= thr
+    heading = (big_font & short) | (centered & short & ~wide)
+    for b, h in zip(blocks, heading.tolist()):
+        b["role"] = "heading" if h else "paragraph"
+
+
+def heading_threshold_from_sizes(sizes) -> float:
+    """Per-page threshold: upper median of block font sizes.
+
+    Only used without a document-wide threshold (--font-stats page, or a book
+    whose histogram came out empty, e.g. scanned pages handled by --ocr).
+    """
+    if HAS_NUMPY:
+        k = len(sizes) // 2
+        med = float(np.partition(np.asarray(sizes, dtype=np.float64), k)[k])
+    else:
+        med = sorted(sizes)[len(sizes) // 2]
+    return med * 1.35 + 0.5
+
+
+# Font-size histogram resolution for --font-stats document (bins per point)
+HIST_BINS_PER_PT = 10
+
+
+def page_font_histogram(page) -> dict[int, int]:
+    """Char-weighted histogram of span font sizes on a page: {size bin: chars}."""
+    cands = _text_blocks(page.get_text("dict"))
+    sizes = [s for b in cands for s in b["span_sizes"]]
+    chars = [n for b in cands for n in b["span_chars"]]
+    if not sizes:
+        return {}
+    if HAS_NUMPY:
+        sizes_a = np.asarray(sizes, dtype=np.float64)
+        chars_a = np.asarray(chars, dtype=np.int64)
+        valid = (chars_a > 0) & (sizes_a > 0)
+        bins = np.rint(sizes_a[valid] * HIST_BINS_PER_PT).astype(np.int64)
+        counts = np.bincount(bins, weights=chars_a[valid]).astype(np.int64)
+        nz = np.nonzero(counts)[0]
+        return dict(zip(nz.tolist(), counts[nz].tolist()))
+    hist: dict[int, int] = {}
+    for s, n in zip(sizes, chars):
+        if n and s > 0:
+            k = int(round(s * HIST_BINS_PER_PT))
+            hist[k] = hist.get(k, 0) + n
+    return hist
+
+
+def heading_threshold_from_histogram(hist: dict[int, int]) -> float | None:
+    """Document-wide threshold from the char-weighted median font size."""
+    total = sum(hist.values())
+    if not total:
+        return None
+    acc = 0
+    for k in sorted(hist):
+        acc += hist[k]
+        if acc * 2 >= total:
+            return (k / HIST_BINS_PER_PT) * 1.35 + 0.5
+    return None
+
+
+# Column detection: blocks wider than this share of the text area are treated as
+# spanning (titles, full-width paragraphs) and do not take part in the projection
+SPANNING_WIDTH = 0.6
+MIN_GUTTER_SHARE = 0.015
+MIN_GUTTER_PT = 8.0
+MIN_COLUMN_BLOCKS = 2
+
+
+def _x_coverage(extents, left: int, right: int):
+    """Number of blocks covering each 1pt bin of [left, right)."""
+    n = right - left
+    if HAS_NUMPY:
+        ext = np.asarray(extents, dtype=np.float64).reshape(-1, 2)
+        starts = np.clip(np.floor(ext[:, 0]).astype(np.int64) - left, 0, n)
+        ends = np.clip(np.ceil(ext[:, 1]).astype(np.int64) - left, 0, n)
+        diff = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(diff, starts, 1)
+        np.add.at(diff, ends, -1)
+        return np.cumsum(diff[:-1]).tolist()
+    diff = [0] * (n + 1)
+    for x0, x1 in extents:
+        diff[min(max(int(x0 // 1) - left, 0), n)] += 1
+        diff[min(max(-int(-x1 // 1) - left, 0), n)] -= 1
+    cov = []
+    acc = 0
+    for v in diff[:-1]:
+        acc += v
+        cov.append(acc)
+    return cov
+
+
+def detect_columns(bboxes, pw: float, max_columns: int = 4) -> list[float]:
+    """Detect column gutters on a page; returns their x positions (empty for one column).
+
+    Block x-extents are projected into a 1pt histogram; empty runs inside the text
+    area are gutter candidates. A gutter is kept only if the columns on both sides
+    hold at least MIN_COLUMN_BLOCKS blocks and overlap vertically.
+    """
+    if len(bboxes) < 2 * MIN_COLUMN_BLOCKS:
+        return []
+    area_x0 = min(b[0] for b in bboxes)
+    area_x1 = max(b[2] for b in bboxes)
+    narrow = [b for b in bboxes if (b[2] - b[0]) <= (area_x1 - area_x0) * SPANNING_WIDTH]
+    if len(narrow) < 2 * MIN_COLUMN_BLOCKS:
+        return []
+    left = int(area_x0 // 1)
+    right = -int(-area_x1 // 1)
+    cov = _x_coverage([(b[0], b[2]) for b in narrow], left, right)
+    min_gap = max(MIN_GUTTER_PT, pw * MIN_GUTTER_SHARE)
+    gaps = []  # (width, center)
+    run_start = None
+    for i, c in enumerate(cov + [1]):
+        if c == 0 and run_start is None:
+            run_start = i
+        elif c != 0 and run_start is not None:
+            if run_start > 0 and i < len(cov) and i - run_start >= min_gap:
+                gaps.append((i - run_start, left + (run_start + i) / 2))
+            run_start = None
+    # Widest gutters first, at most max_columns - 1
+    gaps.sort(reverse=True)
+    gutters = sorted(g for _, g in gaps[:max_columns - 1])
+
+    def columns_of(gs):
+        cols = [[] for _ in range(len(gs) + 1)]
+        for b in narrow:
+            cx = (b[0] + b[2]) / 2
+            cols[sum(1 for g in gs if cx > g)].append(b)
+        return cols
+
+    # Drop gutters that leave a column too sparse or beside a column it never overlaps
+    while gutters:
+        cols = columns_of(gutters)
+        bad = None
+        for k, g in enumerate(gutters):
+            lcol, rcol = cols[k], cols[k + 1]
+            if len(lcol) < MIN_COLUMN_BLOCKS or len(rcol) < MIN_COLUMN_BLOCKS:
+                bad = k
+                break
+            top = max(min(b[1] for b in lcol), min(b[1] for b in rcol))
+            bottom = min(max(b[3] for b in lcol), max(b[3] for b in rcol))
+            if bottom <= top:
+                bad = k
+                break
+        if bad is None:
+            break
+        gutters.pop(bad)
+    return gutters
+
+
+def order_by_columns(blocks, gutters):
+    """Reading order for a region with column gutters.
+
+    Blocks that cross a gutter split the region into bands; inside each band
+    blocks are read column by column, top to bottom.
+    """
+    spanning = []
+    columned = []
+    for b in blocks:
+        x0, y0, x1, y1 = b["bbox"]
+        if any(x0 < g < x1 for g in gutters):
+            spanning.append(b)
+        else:
+            columned.append(b)
+    spanning.sort(key=lambda x: (x["bbox"][1], x["bbox"][0]))
+    span_tops = [b["bbox"][1] for b in spanning]
+    bands = [[] for _ in range(len(spanning) + 1)]
+    for b in columned:
+        x0, y0, x1, y1 = b["bbox"]
+        band = sum(1 for t in span_tops if t <= y0)
+        col = sum(1 for g in gutters if (x0 + x1) / 2 > g)
+        bands[band].append((col, y0, x0, b))
+    ordered = []
+    for k, band in enumerate(bands):
+        band.sort(key=lambda item: item[:3])
+        ordered.extend(item[3] for item in band)
+        if k < len(spanning):
+            ordered.append(spanning[k])
+    return ordered
+
+
+def order_page_auto(blocks, pw: float, max_columns: int = 4):
+    """Detect columns and order blocks; a page may mix layouts (e.g. 2 columns above 3).
+
+    Wide blocks cut the page into horizontal bands and every band gets its own
+    column detection. Pages without columns keep the plain (top, left) order.
+    """
+    key = lambda x: (x["bbox"][1], x["bbox"][0])
+    if not blocks:
+        return blocks
+    area_x0 = min(b["bbox"][0] for b in blocks)
+    area_x1 = max(b["bbox"][2] for b in blocks)
+    limit = (area_x1 - area_x0) * SPANNING_WIDTH
+    wide = sorted((b for b in blocks if b["bbox"][2] - b["bbox"][0] > limit), key=key)
+    wide_tops = [b["bbox"][1] for b in wide]
+    bands = [[] for _ in range(len(wide) + 1)]
+    for b in blocks:
+        if b["bbox"][2] - b["bbox"][0] <= limit:
+            bands[sum(1 for t in wide_tops if t <= b["bbox"][1])].append(b)
+    band_gutters = [detect_columns([b["bbox"] for b in band], pw, max_columns) for band in bands]
+    if not any(band_gutters):
+        return sorted(blocks, key=key)
+    ordered = []
+    for k, (band, gutters) in enumerate(zip(bands, band_gutters)):
+        ordered.extend(order_by_columns(band, gutters) if gutters else sorted(band, key=key))
+        if k < len(wide):
+            ordered.append(wide[k])
+    return ordered
+
+
+# Images covering this share of the page are the scan behind the OCR layer, not illustrations
+BACKGROUND_IMAGE_AREA = 0.85
+
+
+def page_image_blocks(page):
+    """Illustration placements on a page: bbox and xref of every non-background image."""
+    page_area = abs(page.rect) or 1.0
+    blocks = []
+    for info in page.get_image_info(xrefs=True):
+        xref = info.get("xref", 0)
+        if not xref:
+            continue  # inline image without an xref
+        bbox = fitz.Rect(info["bbox"]) & page.rect
+        if bbox.is_empty or abs(bbox) >= page_area * BACKGROUND_IMAGE_AREA:
+            continue
+        blocks.append({
+            "bbox": tuple(bbox),
+            "text": "",
+            "wsize": 0.0,
+            "role": "image",
+            "xref": xref,
+        })
+    return blocks
+
+
+def page_blocks_with_roles(page, two_columns=False, heading_threshold=None, columns=None, images=False, d=None):
+    """Text blocks of a page with roles, in reading order.
+
+    d is a page dict in the get_text("dict") layout; OCR results are passed this way.
+    """
+    if d is None:
+        d = page.get_text("dict")
+    cands = _text_blocks(d)
+    stats = _block_font_stats_np(cands) if HAS_NUMPY and cands else _block_font_stats(cands)
+    blocks = []
+    for b, (wsize, total_chars) in zip(cands, stats):
+        if total_chars == 0:
+            continue
+        blocks.append({
+            "bbox": b["bbox"],
+            "text": b["text"],
+            "wsize": wsize,
+            "line_count": b["line_count"],
+            "chars": total_chars,
+        })
+    # Determine heading threshold: document-wide if given, otherwise per page
+    if heading_threshold is not None:
+        thr = heading_threshold
+    elif blocks:
+        thr = heading_threshold_from_sizes([b["wsize"] for b in blocks])
+    else:
+        thr = 0
+
+    pw = page.rect.width
+    # Classify roles
+    if HAS_NUMPY and blocks:
+        _classify_roles_np(blocks, pw, thr)
+    else:
+        _classify_roles(blocks, pw, thr)
+
+    if images:
+        blocks.extend(page_image_blocks(page))
+    if columns is None:
+        columns = "2" if two_columns else "1"
     # Sort by reading order
-    if two_columns:
+    if columns == "auto":
+        blocks = order_page_auto(blocks, pw)
+    elif columns == "2":
         # For two-column layout: first all left column blocks (sorted by Y), then all right column blocks (sorted by Y)
         page_center_x = pw / 2
         left_blocks = []
@@ -102,19 +448,15 @@ def page_blocks_with_roles(page, two_columns=False):
         blocks = left_blocks + right_blocks
     else:
         # Default: sort by reading order (top, then left)
-    blocks.sort(key=lambda x: (x["bbox"][1], x["bbox"][0]))
+        blocks.sort(key=lambda x: (x["bbox"][1], x["bbox"][0]))
     return blocks
 
 
-def to_html(blocks, title: str) -> str:
+HTML_TAIL = "\n</body>\n</html>\n"
+
+
+def html_head(title: str) -> str:
     from html import escape as esc
-    body = []
-    for blk in blocks:
-        text = esc(blk["text"]) if blk["text"] else ""
-        if blk["role"] == "heading":
-            body.append(f"<h2>{text}</h2>")
-        else:
-            body.append(f"<p>{text}</p>")
     return (
         "<!doctype html>\n<html lang=\"ru\">\n<head>\n"
         "<meta charset=\"utf-8\"/>\n"
@@ -122,42 +464,518 @@ def to_html(blocks, title: str) -> str:
         "<meta name=\"viewport\" content=\"width=device-width,initial-scale=1\"/>\n"
         "<style>body{font:18px/1.6 Georgia,Times,\"Times New Roman\",serif;margin:2rem;max-width:48rem;color:#111;background:#fff} h2{font-size:1.15em;margin:1.2rem 0 .6rem} p{margin:0 0 1rem}</style>\n"
         "</head>\n<body contenteditable=\"true\" spellcheck=\"true\">\n"
-        + "\n".join(body)
-        + "\n</body>\n</html>\n"
     )
 
 
+def block_to_html(blk) -> str:
+    from html import escape as esc
+    if blk["role"] == "image":
+        return f"<p><img src=\"{esc(blk.get('src', ''))}\" alt=\"\"/></p>"
+    text = esc(blk["text"]) if blk["text"] else ""
+    if blk["role"] == "heading":
+        return f"<h2>{text}</h2>"
+    return f"<p>{text}</p>"
+
+
+def to_html(blocks, title: str) -> str:
+    return html_head(title) + "\n".join(block_to_html(blk) for blk in blocks) + HTML_TAIL
+
+
+class StructuredWriter:
+    """Write structured.json/.html/.txt incrementally, one page of blocks at a time.
+
+    The files are byte-identical to what main() writes from a full block list,
+    but only the current page is kept in memory.
+    """
+
+    def __init__(self, outdir: Path, file_name: str):
+        self.paths = {ext: outdir / f"structured.{ext}" for ext in ("json", "html", "txt")}
+        self._json = self.paths["json"].open("w", encoding="utf-8")
+        self._html = self.paths["html"].open("w", encoding="utf-8")
+        self._txt = self.paths["txt"].open("w", encoding="utf-8")
+        self.count = 0
+        self.text_count = 0
+        head = json.dumps({"file": file_name}, ensure_ascii=False, indent=2)
+        # '{\n  "file": "..."\n}' -> open the "blocks" array after the last key
+        self._json.write(head[:-2] + ',\n  "blocks": [')
+        self._html.write(html_head(file_name))
+
+    def write_blocks(self, blocks):
+        for b in blocks:
+            sep = "," if self.count else ""
+            item = json.dumps(b, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+            self._json.write(f"{sep}\n    {item}")
+            self._html.write(("\n" if self.count else "") + block_to_html(b))
+            if b["role"] != "image":
+                self._txt.write(("\n\n" if self.text_count else "") + b["text"])
+                self.text_count += 1
+            self.count += 1
+
+    def close(self):
+        self._json.write("\n  ]\n}" if self.count else "]\n}")
+        self._html.write(HTML_TAIL)
+        for f in (self._json, self._html, self._txt):
+            f.close()
+
+
+def has_text_layer(page) -> bool:
+    if not page.get_fonts():
+        return False
+    return bool(page.get_text("text").strip())
+
+
+def tsv_to_page_dict(tsv: str, scale: float) -> dict:
+    """Convert Tesseract TSV output to the get_text("dict") layout (pixel coords * scale -> pt).
+
+    Every OCR line becomes one span; its font size is estimated from the word heights.
+    """
+    blocks: dict[int, dict[tuple, list]] = {}
+    for row in tsv.splitlines()[1:]:
+        cols = row.split("\t")
+        if len(cols) < 12 or cols[0] != "5":
+            continue
+        text = cols[11].strip()
+        if not text:
+            continue
+        block_num, par_num, line_num = int(cols[2]), int(cols[3]), int(cols[4])
+        left, top, width, height = (int(v) for v in cols[6:10])
+        word = (left * scale, top * scale, (left + width) * scale, (top + height) * scale, text)
+        blocks.setdefault(block_num, {}).setdefault((par_num, line_num), []).append(word)
+    out = []
+    for block_num in sorted(blocks):
+        lines = []
+        bx0 = by0 = float("inf")
+        bx1 = by1 = float("-inf")
+        for key in sorted(blocks[block_num]):
+            words = blocks[block_num][key]
+            x0 = min(w[0] for w in words)
+            y0 = min(w[1] for w in words)
+            x1 = max(w[2] for w in words)
+            y1 = max(w[3] for w in words)
+            heights = sorted(w[3] - w[1] for w in words)
+            lines.append({
+                "bbox": (x0, y0, x1, y1),
+                "spans": [{"text": " ".join(w[4] for w in words), "size": heights[len(heights) // 2]}],
+            })
+            bx0, by0, bx1, by1 = min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1)
+        out.append({"type": 0, "bbox": (bx0, by0, bx1, by1), "lines": lines})
+    return {"blocks": out}
+
+
+def ocr_page(pdf_path, index: int, lang: str, dpi: int, tesseract: str = "tesseract") -> dict:
+    """Render one page and recognize it with Tesseract (runs in a worker process)."""
+    with span("ocr page", page=index + 1):
+        with span("render"), fitz.open(pdf_path) as doc:
+            png = doc.load_page(index).get_pixmap(dpi=dpi).tobytes("png")
+        with span("tesseract", cat="wait"):
+            res = subprocess.run(
+                [tesseract, "stdin", "stdout", "-l", lang, "--dpi", str(dpi), "tsv"],
+                input=png, capture_output=True, check=True,
+            )
+        page_dict = tsv_to_page_dict(res.stdout.decode("utf-8", errors="replace"), 72.0 / dpi)
+    flush_trace()
+    return page_dict
+
+
+def ocr_missing_pages(pdf_path, opts: "ExtractOptions", jobs=1, cache=None) -> dict[int, dict]:
+    """OCR only the pages without a text layer; returns {page index: page dict}.
+
+    Pages whose result is already in the page cache are not sent to OCR.
+    """
+    todo = []
+    with fitz.open(pdf_path) as doc:
+        for i in range(len(doc)):
+            page = doc.load_page(i)
+            if has_text_layer(page):
+                continue
+            if cache is not None and cache.has(cache.key(page)):
+                continue
+            todo.append(i)
+    if not todo:
+        return {}
+    print(f"OCR: {len(todo)} pages without a text layer")
+    if jobs <= 1 or len(todo) < 2:
+        return {i: ocr_page(str(pdf_path), i, opts.ocr_lang, opts.ocr_dpi, opts.tesseract) for i in todo}
+    with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as ex:
+        futures = {i: ex.submit(ocr_page, str(pdf_path), i, opts.ocr_lang, opts.ocr_dpi, opts.tesseract) for i in todo}
+        return {i: fut.result() for i, fut in futures.items()}
+
+
+class PageCache:
+    """On-disk cache of per-page extraction results.
+
+    The key is a hash of the page content streams, the streams of the image and
+    form XObjects they draw, page geometry and extraction parameters, so unchanged
+    pages are reused across runs and replaced pages miss. Scanned pages share one
+    content stream ("q … cm /Im0 Do Q") and differ only in the image bytes.
+    """
+
+    def __init__(self, cache_dir, params: dict):
+        self.root = Path(cache_dir)
+        self.params = json.dumps(params, sort_keys=True)
+        # Image blocks carry xrefs, which the content stream does not pin down
+        self.with_images = bool(params.get("images"))
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, page) -> str:
+        h = hashlib.sha256()
+        h.update(self.params.encode("utf-8"))
+        h.update(repr((tuple(page.rect), page.rotation)).encode("ascii"))
+        h.update(page.read_contents())
+        doc = page.parent
+        xrefs = {x for img in page.get_images(full=True) for x in img[:2] if x > 0}
+        xrefs.update(x[0] for x in page.get_xobjects() if x[0] > 0)
+        for digest in sorted(hashlib.sha256(doc.xref_stream_raw(x) or b"").digest() for x in xrefs):
+            h.update(digest)
+        if self.with_images:
+            h.update(repr(page.get_images(full=True)).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def has(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            blocks = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return blocks
+
+    def put(self, key: str, blocks):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(blocks, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def make_cache(opts: "ExtractOptions"):
+    return PageCache(opts.cache_dir, opts.cache_params()) if opts.cache_dir else None
+
+
+def page_output_blocks(page, page_no: int, opts: ExtractOptions, cache: PageCache | None = None, ocr_dict=None):
+    """Blocks of one page in the structured.json format (ocr_dict replaces the missing text layer)."""
+    with span("page", page=page_no):
+        key = None
+        blocks = None
+        if cache is not None:
+            key = cache.key(page)
+            blocks = cache.get(key)
+        if blocks is None:
+            blocks = [
+                {
+                    "role": b["role"],
+                    "text": b["text"],
+                    "wsize": b["wsize"],
+                    "bbox": b["bbox"],
+                    **({"xref": b["xref"]} if "xref" in b else {}),
+                }
+                for b in page_blocks_with_roles(
+                    page, heading_threshold=opts.heading_threshold, columns=opts.columns, images=opts.images, d=ocr_dict
+                )
+            ]
+            if cache is not None:
+                cache.put(key, blocks)
+        return [{"page": page_no, **b} for b in blocks]
+
+
+def extract_page_range(pdf_path, start: int, stop: int, opts: ExtractOptions, ocr_dicts=None):
+    """Extract pages [start, stop) with a document opened in this process (used by --jobs workers)."""
+    doc = fitz.open(pdf_path)
+    cache = make_cache(opts)
+    ocr_dicts = ocr_dicts or {}
+    try:
+        blocks = []
+        with span("pages", first=start + 1, last=stop):
+            for i in range(start, stop):
+                blocks.extend(page_output_blocks(doc.load_page(i), i + 1, opts, cache, ocr_dicts.get(i)))
+        return blocks
+    finally:
+        doc.close()
+        flush_trace()
+
+
+def recompress_image(data: bytes, out_path: str, fmt: str, max_side: int, quality: int) -> int:
+    """Downscale and re-encode one image (runs in a worker process); returns the file size."""
+    from io import BytesIO
+    with span("recompress image", file=os.path.basename(out_path)):
+        img = Image.open(BytesIO(data))
+        img.load()
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if fmt == "jpg":
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(out_path, format="JPEG", quality=quality, optimize=True)
+        else:
+            if img.mode not in ("RGB", "RGBA", "L", "LA", "1", "P"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            img.save(out_path, format="PNG", optimize=True)
+    flush_trace()
+    return os.path.getsize(out_path)
+
+
+class ImageExporter:
+    """Write illustrations to <outdir>/images, once per distinct image.
+
+    Images are deduplicated first by PDF xref (the same vignette object placed
+    on many pages) and then by a hash of the image bytes (identical images stored
+    as separate objects). Recompression runs in a process pool.
+    """
+
+    def __init__(self, pdf_path, outdir: Path, jobs=1, max_side=1600, quality=80):
+        self.doc = fitz.open(pdf_path)
+        self.dir = outdir / "images"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_side = max_side
+        self.quality = quality
+        self.by_xref: dict[int, str] = {}
+        self.by_hash: dict[str, str] = {}
+        self.pending = []
+        self.pool = ProcessPoolExecutor(max_workers=jobs) if HAS_PIL and jobs > 1 else None
+        self.placements = 0
+
+    def _export(self, xref: int) -> str:
+        info = self.doc.extract_image(xref)
+        smask = info.get("smask", 0)
+        if smask:
+            # Image with a soft mask: merge alpha with PyMuPDF, keep it as PNG
+            pix = fitz.Pixmap(fitz.Pixmap(self.doc, xref), fitz.Pixmap(self.doc, smask))
+            data, ext = pix.tobytes("png"), "png"
+        else:
+            data, ext = info["image"], info.get("ext", "png")
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        if digest in self.by_hash:
+            return self.by_hash[digest]
+        if HAS_PIL:
+            # Bilevel and masked images compress far better losslessly
+            fmt = "png" if smask or info.get("bpc") == 1 else "jpg"
+        else:
+            fmt = ext
+        name = f"img_{digest}.{fmt}"
+        out_path = self.dir / name
+        if not HAS_PIL:
+            out_path.write_bytes(data)
+        elif self.pool is not None:
+            self.pending.append(self.pool.submit(recompress_image, data, str(out_path), fmt, self.max_side, self.quality))
+        else:
+            recompress_image(data, str(out_path), fmt, self.max_side, self.quality)
+        src = f"images/{name}"
+        self.by_hash[digest] = src
+        return src
+
+    def resolve(self, blocks):
+        """Replace xrefs of image blocks with paths of the exported files."""
+        for b in blocks:
+            xref = b.pop("xref", None)
+            if xref is None:
+                continue
+            if xref not in self.by_xref:
+                self.by_xref[xref] = self._export(xref)
+            b["src"] = self.by_xref[xref]
+            self.placements += 1
+        return blocks
+
+    def close(self):
+        try:
+            for fut in self.pending:
+                fut.result()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.doc.close()
+
+
+def page_ranges(page_count: int, jobs: int, chunks_per_job: int = 4):
+    """Split pages into contiguous ranges; several ranges per worker keep the load balanced."""
+    n_chunks = max(1, min(page_count, jobs * chunks_per_job))
+    step, extra = divmod(page_count, n_chunks)
+    ranges = []
+    start = 0
+    for k in range(n_chunks):
+        stop = start + step + (1 if k < extra else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def font_histogram_range(pdf_path, start: int, stop: int) -> dict[int, int]:
+    hist: dict[int, int] = {}
+    with span("font histogram", first=start + 1, last=stop), fitz.open(pdf_path) as doc:
+        for i in range(start, stop):
+            for k, n in page_font_histogram(doc.load_page(i)).items():
+                hist[k] = hist.get(k, 0) + n
+    flush_trace()
+    return hist
+
+
+def document_heading_threshold(pdf_path, jobs=1) -> float | None:
+    """First pass for --font-stats document: font-size histogram of the whole book."""
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    if jobs <= 1 or page_count < 2:
+        return heading_threshold_from_histogram(font_histogram_range(str(pdf_path), 0, page_count))
+    hist: dict[int, int] = {}
+    ranges = page_ranges(page_count, jobs)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as ex:
+        for part in ex.map(font_histogram_range, [str(pdf_path)] * len(ranges), *zip(*ranges)):
+            for k, n in part.items():
+                hist[k] = hist.get(k, 0) + n
+    return heading_threshold_from_histogram(hist)
+
+
+def iter_page_blocks(pdf_path, opts: ExtractOptions, jobs=1, low_memory=False):
+    """Yield lists of blocks in page order.
+
+    With jobs > 1 pages are processed in worker processes; only a bounded number of
+    page ranges is in flight, so results do not pile up in memory. With low_memory,
+    the MuPDF resource store is emptied after every page.
+    """
+    ocr_dicts = ocr_missing_pages(pdf_path, opts, jobs=jobs, cache=make_cache(opts)) if opts.ocr_lang else {}
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+        if jobs <= 1 or page_count < 2:
+            cache = make_cache(opts)
+            with Progress("extract", page_count, "pages") as progress:
+                for i in range(page_count):
+                    page = doc.load_page(i)
+                    blocks = page_output_blocks(page, i + 1, opts, cache, ocr_dicts.get(i))
+                    del page
+                    if low_memory:
+                        fitz.TOOLS.store_shrink(100)
+                    progress.advance()
+                    yield blocks
+            return
+
+    chunks_per_job = 16 if low_memory else 4
+    ranges = page_ranges(page_count, jobs, chunks_per_job=chunks_per_job)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as ex, \
+            Progress("extract", page_count, "pages") as progress:
+        pending = []
+        todo = iter(ranges)
+        for start, stop in todo:
+            pending.append((ex.submit(extract_page_range, str(pdf_path), start, stop, opts,
+                                      {i: ocr_dicts[i] for i in range(start, stop) if i in ocr_dicts}), stop - start))
+            if len(pending) >= jobs * 2:
+                break
+        while pending:
+            future, pages = pending.pop(0)
+            blocks = future.result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append((ex.submit(extract_page_range, str(pdf_path), nxt[0], nxt[1], opts,
+                                          {i: ocr_dicts[i] for i in range(*nxt) if i in ocr_dicts}), nxt[1] - nxt[0]))
+            progress.advance(pages)
+            yield blocks
+
+
+def extract_blocks(pdf_path, opts: ExtractOptions | None = None, jobs=1, images: ImageExporter | None = None):
+    """Extract blocks of the whole document, optionally with a pool of worker processes.
+
+    Workers return blocks for their page ranges, which are merged in page order,
+    so the result is identical to the serial run.
+    """
+    all_blocks = []
+    for blocks in iter_page_blocks(pdf_path, opts or ExtractOptions(), jobs=jobs):
+        all_blocks.extend(images.resolve(blocks) if images is not None else blocks)
+    return all_blocks
+
+
+def write_streaming(pdf_path: Path, outdir: Path, opts: ExtractOptions, jobs=1, images: ImageExporter | None = None):
+    """Extract and write structured.* page by page; memory does not grow with page count."""
+    writer = StructuredWriter(outdir, pdf_path.name)
+    try:
+        for blocks in iter_page_blocks(pdf_path, opts, jobs=jobs, low_memory=True):
+            writer.write_blocks(images.resolve(blocks) if images is not None else blocks)
+    finally:
+        writer.close()
+    return writer.count
+
+
+def write_structured(struct, outdir: Path):
+    """Write structured.json/.html/.txt for a document returned by extract_document()."""
+    blocks = struct["blocks"]
+    (outdir / "structured.json").write_text(json.dumps(struct, ensure_ascii=False, indent=2), encoding="utf-8")
+    (outdir / "structured.html").write_text(to_html(blocks, struct["file"]), encoding="utf-8")
+    (outdir / "structured.txt").write_text("\n\n".join(b["text"] for b in blocks if b["role"] != "image"), encoding="utf-8")
+
+
+def extract_document(pdf_path: Path, outdir: Path, opts: ExtractOptions, jobs=1, image_max_side=1600, image_quality=80):
+    """Extract the whole document into a {"file", "blocks"} dict; illustrations go to <outdir>/images."""
+    images = ImageExporter(pdf_path, outdir, jobs=jobs, max_side=image_max_side,
+                           quality=image_quality) if opts.images else None
+    try:
+        blocks = extract_blocks(pdf_path, opts, jobs=jobs, images=images)
+    finally:
+        if images is not None:
+            images.close()
+            print(f"Images: {len(images.by_hash)} files for {images.placements} placements in {images.dir}")
+    return {"file": pdf_path.name, "blocks": blocks}
+
+
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(description="Extract structured text (paragraphs/headings) from PDF with embedded text.")
     ap.add_argument("--pdf", required=True, help="Input PDF path")
     ap.add_argument("--outdir", default="output_vol2", help="Output directory")
-    ap.add_argument("--two-columns", action="store_true", help="Process pages with two columns: left column first, then right column")
+    ap.add_argument("--columns", choices=["auto", "1", "2"], default="auto",
+                    help="Column layout: auto = detect 1..N columns per page, 1 = single column, 2 = split at the page center")
+    ap.add_argument("--two-columns", action="store_true", help="Same as --columns 2: left half of the page first, then right half")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes for page extraction (0 = number of CPUs)")
+    ap.add_argument("--font-stats", choices=["page", "document"], default="page",
+                    help="Heading threshold from the per-page median font size or from a document-wide histogram")
+    ap.add_argument("--images", action="store_true", help="Extract illustrations into <outdir>/images and add image blocks")
+    ap.add_argument("--image-max-side", type=int, default=1600, help="Downscale illustrations to this many pixels on the long side")
+    ap.add_argument("--image-quality", type=int, default=80, help="JPEG quality for recompressed illustrations")
+    ap.add_argument("--ocr", action="store_true", help="OCR pages without a text layer with a local Tesseract binary")
+    ap.add_argument("--ocr-lang", default="rus", help="Tesseract language(s) for --ocr, e.g. rus or rus+eng")
+    ap.add_argument("--ocr-dpi", type=int, default=300, help="Render resolution for --ocr")
+    ap.add_argument("--tesseract", default="tesseract", help="Path to the Tesseract binary")
+    ap.add_argument("--cache-dir", help="Directory for the per-page extraction cache (reused across runs)")
+    ap.add_argument("--stream", action="store_true", help="Write outputs page by page with bounded memory (for very large PDFs)")
+    add_profile_args(ap)
     args = ap.parse_args()
 
     pdf_path = Path(args.pdf)
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    doc = fitz.open(pdf_path)
-    all_blocks = []
-    for i in range(len(doc)):
-        page = doc.load_page(i)
-        p_blocks = page_blocks_with_roles(page, two_columns=args.two_columns)
-        for b in p_blocks:
-            all_blocks.append({
-                "page": i + 1,
-                "role": b["role"],
-                "text": b["text"],
-                "wsize": b["wsize"],
-                "bbox": b["bbox"],
-            })
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.ocr and not shutil.which(args.tesseract):
+        ap.error(f"--ocr: Tesseract not found: {args.tesseract}")
+    heading_threshold = None
+    if args.font_stats == "document":
+        heading_threshold = document_heading_threshold(pdf_path, jobs=jobs)
+        if heading_threshold is not None:
+            print(f"Document heading threshold: {heading_threshold:.2f}pt")
+    opts = ExtractOptions(columns="2" if args.two_columns else args.columns, heading_threshold=heading_threshold,
+                          images=args.images, ocr_lang=args.ocr_lang if args.ocr else None,
+                          ocr_dpi=args.ocr_dpi, tesseract=args.tesseract, cache_dir=args.cache_dir)
+    if args.stream:
+        images = ImageExporter(pdf_path, outdir, jobs=jobs, max_side=args.image_max_side,
+                               quality=args.image_quality) if args.images else None
+        try:
+            count = write_streaming(pdf_path, outdir, opts, jobs=jobs, images=images)
+        finally:
+            if images is not None:
+                images.close()
+                print(f"Images: {len(images.by_hash)} files for {images.placements} placements in {images.dir}")
+        for ext in ("json", "html", "txt"):
+            print(f"Saved: {outdir / f'structured.{ext}'}")
+        print(f"Blocks: {count}")
+        return
 
-    # Save JSON
-    struct = {"file": pdf_path.name, "blocks": all_blocks}
-    (outdir / "structured.json").write_text(json.dumps(struct, ensure_ascii=False, indent=2), encoding="utf-8")
-    # Save initial HTML/TXT
-    (outdir / "structured.html").write_text(to_html(all_blocks, pdf_path.name), encoding="utf-8")
-    (outdir / "structured.txt").write_text("\n\n".join(b["text"] for b in all_blocks), encoding="utf-8")
+    struct = extract_document(pdf_path, outdir, opts, jobs=jobs,
+                              image_max_side=args.image_max_side, image_quality=args.image_quality)
+    write_structured(struct, outdir)
     print(f"Saved: {outdir / 'structured.json'}")
     print(f"Saved: {outdir / 'structured.html'}")
     print(f"Saved: {outdir / 'structured.txt'}")
@@ -165,5 +983,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
@@ -10,6 +10,10 @@ from pathlib import Path
 from xml.etree import ElementTree as ET
 import zipfile
 
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+from trace_events import span
+
 try:
     from PIL import Image, ImageDraw, ImageFont
     HAS_PIL = True
@@ -189,6 +193,38 @@ def load_blocks_from_text(text: str):
     return paragraphs_to_blocks(paragraphs)
 
 
+def insert_image_blocks(blocks, source_blocks):
+    """Вставить блоки-иллюстрации из structured.json в блоки другого источника (TXT/HTML).
+
+    Позиция иллюстрации переносится по доле текста, предшествующего ей в исходных блоках.
+    """
+    total = sum(len(b.get("text") or "") for b in source_blocks if b.get("role") != "image")
+    if not total:
+        return blocks
+    anchors = []
+    seen = 0
+    for b in source_blocks:
+        if b.get("role") == "image":
+            if b.get("src"):
+                anchors.append((seen / total, b))
+        else:
+            seen += len(b.get("text") or "")
+    if not anchors:
+        return blocks
+    target_total = sum(len(b.get("text") or "") for b in blocks) or 1
+    result = []
+    seen = 0
+    k = 0
+    for b in blocks:
+        while k < len(anchors) and anchors[k][0] <= seen / target_total:
+            result.append({"role": "image", "text": "", "src": anchors[k][1]["src"]})
+            k += 1
+        result.append(b)
+        seen += len(b.get("text") or "")
+    result.extend({"role": "image", "text": "", "src": a[1]["src"]} for a in anchors[k:])
+    return result
+
+
 def split_into_chapters(blocks, max_size_kb=50):
     """Разбить блоки по главах (заголовки) и по размеру, если заголовков нет."""
     chapters = []
@@ -458,6 +494,11 @@ def create_xhtml_section(blocks, title, css_href="../Styles/Style0001.css"):
     """Создать XHTML файл для раздела"""
     body_parts = []
     for block in blocks:
+        if block.get("role") == "image":
+            name = Path(block.get("src", "")).name
+            if name:
+                body_parts.append(f'<p class="illustration"><img src="../Images/{hesc(name)}" alt=""/></p>')
+            continue
         text = hesc(block.get("text", ""))
         if block.get("role") == "heading":
             body_parts.append(f"<h2>{text}</h2>")
@@ -481,7 +522,15 @@ def create_xhtml_section(blocks, title, css_href="../Styles/Style0001.css"):
     return xhtml
 
 
-def update_content_opf(opf_content: str, section_files: list, title: str, author: str = "", has_cover: bool = False, sections: list = None):
+IMAGE_MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+}
+
+
+def update_content_opf(opf_content: str, section_files: list, title: str, author: str = "", has_cover: bool = False, sections: list = None, image_files: list = None):
     """Обновить content.opf с новыми разделами"""
     # Парсим XML
     root = ET.fromstring(opf_content)
@@ -594,9 +643,9 @@ def update_content_opf(opf_content: str, section_files: list, title: str, author
             break
     
     # Добавляем новые разделы в manifest и spine (в правильном порядке)
-        for i, section_file in enumerate(section_files, 1):
-            section_id = f"Chapter{i:04d}.xhtml"
-            item_id = f"Chapter{i:04d}"
+    for i, section_file in enumerate(section_files, 1):
+        section_id = f"Chapter{i:04d}.xhtml"
+        item_id = f"Chapter{i:04d}"
         href = f"Text/{section_id}"
         
         # Добавляем в manifest
@@ -610,6 +659,13 @@ def update_content_opf(opf_content: str, section_files: list, title: str, author
         itemref.set('idref', item_id)
         spine.insert(insert_pos + i - 1, itemref)
     
+    # Иллюстрации из PDF
+    for name in image_files or []:
+        item = ET.SubElement(manifest, f'{{{opf_ns}}}item')
+        item.set('id', f"illustration-{Path(name).stem}")
+        item.set('href', f"Images/{name}")
+        item.set('media-type', IMAGE_MEDIA_TYPES.get(Path(name).suffix.lower(), 'application/octet-stream'))
+    
     # Обновляем guide для обложки
     if has_cover:
         guide = root.find(f'.//{{{opf_ns}}}guide')
@@ -648,11 +704,16 @@ def generate_epub(
     author: str = "",
     cover_colors: list[str] | None = None,
     max_chapter_size_kb: int = 50,
+    image_root: Path | None = None,
 ):
-    """Генерировать EPUB на основе шаблона и блоков текста"""
+    """Генерировать EPUB на основе шаблона и блоков текста.
+
+    Пути блоков-иллюстраций (src) отсчитываются от image_root.
+    """
     
     # Разбиваем на разделы
-    sections = split_into_chapters(blocks, max_size_kb=max_chapter_size_kb)
+    with span("split into chapters", blocks=len(blocks)):
+        sections = split_into_chapters(blocks, max_size_kb=max_chapter_size_kb)
     print(f"Разбито на {len(sections)} глав (макс. {max_chapter_size_kb} KB)")
     
     # Создаем временную директорию
@@ -671,11 +732,12 @@ def generate_epub(
         has_cover_image = False
         if HAS_PIL:
             try:
-                cover_image_data = generate_cover_image(
-                    title,
-                    author=author,
-                    cover_colors=cover_colors,
-                )
+                with span("cover"):
+                    cover_image_data = generate_cover_image(
+                        title,
+                        author=author,
+                        cover_colors=cover_colors,
+                    )
                 cover_image_path = images_path / "cover.jpg"
                 cover_image_path.write_bytes(cover_image_data)
                 has_cover_image = True
@@ -712,6 +774,24 @@ def generate_epub(
         else:
             print("Предупреждение: Pillow не установлен, обложка не будет создана")
         
+        # Копируем иллюстрации
+        image_files = []
+        for block in blocks:
+            if block.get("role") != "image" or not block.get("src"):
+                continue
+            src_path = Path(image_root or ".") / block["src"]
+            name = src_path.name
+            if name in image_files:
+                continue
+            if not src_path.exists():
+                print(f"Предупреждение: иллюстрация не найдена: {src_path}")
+                continue
+            images_path.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src_path, images_path / name)
+            image_files.append(name)
+        if image_files:
+            print(f"Иллюстраций: {len(image_files)}")
+        
         # Удаляем старые Section файлы
         for old_section in text_path.glob("Section*.xhtml"):
             old_section.unlink()
@@ -722,14 +802,19 @@ def generate_epub(
         
         # Генерируем новые разделы
         section_files = []
+        progress = Progress("epub", len(sections), "chapters")
         for i, chapter in enumerate(sections, 1):
             section_blocks = chapter.get("blocks", [])
             section_id = f"Chapter{i:04d}.xhtml"
             section_title = chapter.get("title") or title
-            xhtml_content = create_xhtml_section(section_blocks, section_title)
-            section_file = text_path / section_id
-            section_file.write_text(xhtml_content, encoding="utf-8")
+            with span("chapter", file=section_id, blocks=len(section_blocks)):
+                xhtml_content = create_xhtml_section(section_blocks, section_title)
+                section_file = text_path / section_id
+                with span("write", cat="io", bytes=len(xhtml_content)):
+                    section_file.write_text(xhtml_content, encoding="utf-8")
             section_files.append(section_id)
+            progress.advance()
+        progress.close()
         
         # Обновляем титульную страницу
         titul_path = text_path / "Titul.xhtml"
@@ -789,11 +874,11 @@ def generate_epub(
             toc_path.write_text(toc_xml, encoding="utf-8")
         
         # Обновляем content.opf (с обложкой, если создана)
-        updated_opf = update_content_opf(opf_content, section_files, title, author, has_cover_image, sections)
+        updated_opf = update_content_opf(opf_content, section_files, title, author, has_cover_image, sections, image_files)
         opf_path.write_text(updated_opf, encoding="utf-8")
         
         # Собираем новый EPUB
-        with zipfile.ZipFile(output_epub, 'w', zipfile.ZIP_DEFLATED) as z:
+        with span("zip", cat="io"), zipfile.ZipFile(output_epub, 'w', zipfile.ZIP_DEFLATED) as z:
             # mimetype должен быть первым и без сжатия
             mimetype_path = tmp_path / "mimetype"
             if mimetype_path.exists():
@@ -809,6 +894,7 @@ def generate_epub(
         print(f"EPUB создан: {output_epub}")
 
 
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(
         description="Генерация EPUB на основе шаблона и текста из JSON, HTML или TXT"
@@ -824,6 +910,8 @@ def main():
         help="Пять HEX-цветов (полоска; верхний блок; заголовок; нижний градиент начало; конец)",
     )
     ap.add_argument("--max-chapter-size", type=int, default=50, help="Максимальный размер главы в KB (по умолчанию 50)")
+    ap.add_argument("--images-from", help="structured.json с блоками-иллюстрациями (для входа TXT/HTML)")
+    add_profile_args(ap)
     args = ap.parse_args()
     
     template_epub = Path(args.template)
@@ -856,6 +944,15 @@ def main():
         print("Ошибка: не найдено блоков текста")
         return 1
     
+    image_root = input_file.parent
+    if args.images_from and suffix != ".json":
+        images_json = Path(args.images_from)
+        if images_json.exists():
+            blocks = insert_image_blocks(blocks, load_blocks_from_json(images_json))
+            image_root = images_json.parent
+        else:
+            print(f"Предупреждение: файл с иллюстрациями не найден: {images_json}")
+    
     print(f"Загружено {len(blocks)} блоков")
     
     cover_colors = None
@@ -874,6 +971,7 @@ def main():
         args.author,
         cover_colors=cover_colors,
         max_chapter_size_kb=args.max_chapter_size,
+        image_root=image_root,
     )
     
     return 0
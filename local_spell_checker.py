@@ -4,10 +4,14 @@
 """
 import argparse
 import re
+import sys
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Dict, List, Optional
 
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+
 # Попытка импортировать различные библиотеки проверки орфографии
 SPELLCHECKER_AVAILABLE = False
 JAMSPELL_AVAILABLE = False
@@ -95,7 +99,9 @@ class LocalSpellChecker(SpellChecker):
     def check(self, text: str) -> List[Dict]:
         """Проверяет текст и возвращает список исправлений в формате для apply_matches"""
         matches = []
+        progress = Progress("local_spell", len(text), "chars")
         for match in WORD_RE.finditer(text):
+            progress.advance(match.end() - progress.done)
             word = match.group(0)
             correction = self.check_word(word.lower())
             if correction and correction.lower() != word.lower():
@@ -108,6 +114,8 @@ class LocalSpellChecker(SpellChecker):
                     'replacements': [{'value': correction}],
                     'rule': {'id': 'LOCAL_SPELL', 'description': f'{word} → {correction}'}
                 })
+        progress.advance(len(text) - progress.done)
+        progress.close()
         return matches
 
 
@@ -205,6 +213,24 @@ def create_spell_checker(checker_type: str = 'auto', **kwargs) -> LocalSpellChec
         raise ValueError(f"Неизвестный тип проверщика: {checker_type}")
 
 
+def checker_kwargs(checker_type: str, lang: str = 'ru', model_path: Optional[str] = None,
+                   dictionary_path: Optional[str] = None, distance: int = 2) -> Dict:
+    """Параметры create_spell_checker для выбранного типа проверщика"""
+    if checker_type == 'jamspell':
+        return {'lang': lang, 'model_path': model_path}
+    if checker_type == 'symspell':
+        kwargs = {'max_edit_distance': distance}
+        if dictionary_path:
+            kwargs['dictionary_path'] = dictionary_path
+        return kwargs
+    if checker_type == 'pyspellchecker':
+        return {'lang': lang, 'distance': distance}
+    kwargs = {'lang': lang}
+    if model_path:
+        kwargs['model_path'] = model_path
+    return kwargs
+
+
 def run_local_spell_check(text: str, checker: LocalSpellChecker, chunk_size: int = 10000) -> tuple[str, Dict]:
     """
     Применяет локальную проверку орфографии к тексту
@@ -223,6 +249,7 @@ def run_local_spell_check(text: str, checker: LocalSpellChecker, chunk_size: int
     return fixed_text, stats
 
 
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(
         description='Применить локальную проверку орфографии к тексту'
@@ -237,6 +264,7 @@ def main():
     ap.add_argument('--model-path', help='Путь к модели (для jamspell)')
     ap.add_argument('--dictionary-path', help='Путь к словарю (для symspell)')
     ap.add_argument('--distance', type=int, default=2, help='Максимальное расстояние редактирования')
+    add_profile_args(ap)
     args = ap.parse_args()
     
     inp = Path(args.inp)
@@ -244,31 +272,16 @@ def main():
     outdir.mkdir(parents=True, exist_ok=True)
     
     # Создаем проверщик
-    checker_kwargs = {'lang': args.lang}
-    if args.checker_type == 'jamspell':
-        if not args.model_path:
-            print("Ошибка: для jamspell требуется --model-path")
-            return
-        checker_kwargs['model_path'] = args.model_path
-    elif args.checker_type == 'symspell':
-        if args.dictionary_path:
-            checker_kwargs['dictionary_path'] = args.dictionary_path
-        checker_kwargs['max_edit_distance'] = args.distance
-    elif args.checker_type == 'pyspellchecker':
-        checker_kwargs['distance'] = args.distance
-    elif args.checker_type == 'auto' and args.model_path:
-        # Если указан model_path и auto, пробуем jamspell
-        try:
-            checker_kwargs['model_path'] = args.model_path
-            checker_kwargs['device'] = args.device
-        except:
-            pass
+    if args.checker_type == 'jamspell' and not args.model_path:
+        print("Ошибка: для jamspell требуется --model-path")
+        sys.exit(1)
+    kwargs = checker_kwargs(args.checker_type, args.lang, args.model_path, args.dictionary_path, args.distance)
     
     try:
-        checker = create_spell_checker(args.checker_type, **checker_kwargs)
+        checker = create_spell_checker(args.checker_type, **kwargs)
     except Exception as e:
         print(f"Ошибка создания проверщика: {e}")
-        return
+        sys.exit(1)
     
     # Читаем и обрабатываем текст
     text = inp.read_text(encoding='utf-8', errors='replace')
@@ -7,6 +7,11 @@ from pathlib import Path
 from typing import Dict, List
 from urllib import request, parse
 
+import pipeline_metrics
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+from trace_events import span
+
 
 SAFE_RULE_SUBSTR = (
     'MORFOLOGIK',   # spelling
@@ -71,6 +76,7 @@ class YandexSpellerChecker(SpellChecker):
 
     def check(self, text: str) -> List[Dict]:
         url = 'https://speller.yandex.net/services/spellservice.json/checkText'
+        pipeline_metrics.count('requests')
         data = parse.urlencode({
             'text': text,
             'lang': self.lang,
@@ -101,26 +107,33 @@ def run_spell_pipeline(text: str, checkers: List[SpellChecker], chunk_size: int,
     fixed_parts = []
     stats = {checker.name: 0 for checker in checkers}
 
-    for part in parts:
-        part_text = part
-        for checker in checkers:
-            try:
-                matches = checker.check(part_text)
-            except Exception as exc:
-                print(f"[{checker.name}] ошибка запроса: {exc}")
-                matches = []
-            if not matches:
-                continue
-            part_text = apply_matches(part_text, matches)
-            stats[checker.name] += len(matches)
-        fixed_parts.append(part_text)
-        time.sleep(sleep)
+    with Progress("lt_cloud", len(parts), "chunks") as progress:
+        for index, part in enumerate(parts):
+            with span("chunk", index=index, chars=len(part)):
+                part_text = part
+                for checker in checkers:
+                    try:
+                        with span(checker.name, cat="http"):
+                            matches = checker.check(part_text)
+                    except Exception as exc:
+                        print(f"[{checker.name}] ошибка запроса: {exc}")
+                        matches = []
+                    if not matches:
+                        continue
+                    with span("apply matches", matches=len(matches)):
+                        part_text = apply_matches(part_text, matches)
+                    stats[checker.name] += len(matches)
+                fixed_parts.append(part_text)
+                with span("sleep", cat="wait"):
+                    time.sleep(sleep)
+            progress.advance()
 
     return "".join(fixed_parts), stats
 
 
 def cloud_check(text: str, lang: str = 'ru-RU', timeout: int = 60):
     url = 'https://api.languagetool.org/v2/check'
+    pipeline_metrics.count('requests')
     data = parse.urlencode({'text': text, 'language': lang}).encode('utf-8')
     req = request.Request(url, data=data, headers={
         'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'
@@ -166,6 +179,7 @@ def to_html(text: str, title: str) -> str:
     )
 
 
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(description='Apply safe LanguageTool (cloud) fixes without extra deps.')
     ap.add_argument('--in', dest='inp', required=True, help='Входной TXT')
@@ -176,6 +190,7 @@ def main():
     ap.add_argument('--chunk-size', type=int, default=6000, help='Максимум символов для одного запроса')
     ap.add_argument('--with-yandex', action='store_true', help='После LanguageTool применить Yandex.Speller')
     ap.add_argument('--yandex-lang', default='ru', help='Язык для Yandex.Speller (по умолчанию ru)')
+    add_profile_args(ap)
     args = ap.parse_args()
 
     inp = Path(args.inp)
@@ -3,6 +3,9 @@ import json
 import re
 from pathlib import Path
 
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+
 
 LAT_TO_CYR = {
     "A": "А", "a": "а",
@@ -125,6 +128,12 @@ def merge_paragraph_blocks(blocks):
     buf = None
     for b in blocks:
         role = b.get("role")
+        if role == "image":
+            if buf is not None:
+                merged.append({"role": "paragraph", "text": buf})
+                buf = None
+            merged.append({"role": "image", "text": "", "src": b.get("src", "")})
+            continue
         text = normalize_linebreaks(b.get("text") or "")
         if role == "heading":
             if buf is not None:
@@ -158,25 +167,27 @@ def render_html(blocks, title: str):
     body = []
     for b in blocks:
         t = b["text"] or ""
-        if b["role"] == "heading":
+        if b["role"] == "image":
+            body.append(f"<p><img src=\"{esc(b.get('src', ''))}\" alt=\"\"/></p>")
+        elif b["role"] == "heading":
             body.append(f"<h2>{t}</h2>")
         else:
             body.append(f"<p>{t}</p>")
     return head + "\n".join(body) + "\n</body>\n</html>\n"
 
 
-def main():
-    ap = argparse.ArgumentParser(description="Modernize structured text; flag ambiguous letter changes; output HTML/TXT and flags.")
-    ap.add_argument("--in", dest="inp", default="output_vol2/structured_rules.json", help="Structured JSON after rules")
-    ap.add_argument("--outdir", default="output_vol2", help="Output directory")
-    ap.add_argument("--title", default="Книга (современная орфография)", help="HTML title")
-    args = ap.parse_args()
-
-    data = json.loads(Path(args.inp).read_text(encoding="utf-8"))
-    blocks = data.get("blocks", [])
+def modernize_blocks(blocks):
+    """Normalize, merge and flag structured blocks; returns (blocks, flags)."""
+    # Progress covers both passes: normalization of input blocks, then flagging of merged blocks.
+    # Merging never adds blocks, so 2 × input is an upper bound until the merged count is known
+    progress = Progress("modernize", 2 * len(blocks), "blocks")
     # 1) Normalize punctuation/linebreaks per block first (no flags yet)
     norm_blocks = []
     for b in blocks:
+        progress.advance()
+        if b.get("role") == "image":
+            norm_blocks.append({"role": "image", "text": "", "page": b.get("page"), "src": b.get("src", "")})
+            continue
         txt = b.get("text") or ""
         txt = normalize_linebreaks(txt)
         txt = normalize_punct(txt)
@@ -184,14 +195,40 @@ def main():
 
     # 2) Merge paragraph blocks to avoid mid‑sentence breaks
     merged_blocks = merge_paragraph_blocks(norm_blocks)
+    progress.total = len(blocks) + len(merged_blocks)
 
     # 3) Apply letter flags on merged blocks
     flags_all = []
     new_blocks = []
     for i, b in enumerate(merged_blocks):
+        progress.advance()
+        if b.get("role") == "image":
+            new_blocks.append(b)
+            continue
         txt_flagged, flags = apply_letter_flags(b.get("text") or "")
         flags_all.append({"block": i, "role": b.get("role"), "flags": flags})
         new_blocks.append({"role": b.get("role"), "text": txt_flagged})
+    progress.close()
+    return new_blocks, flags_all
+
+
+def plain_text(blocks) -> str:
+    """Plain TXT without tags: strip tags crudely."""
+    return "\n\n".join(re.sub(r"<[^>]+>", "", b["text"]) for b in blocks if b["role"] != "image")
+
+
+@profiled_main
+def main():
+    ap = argparse.ArgumentParser(description="Modernize structured text; flag ambiguous letter changes; output HTML/TXT and flags.")
+    ap.add_argument("--in", dest="inp", default="output_vol2/structured_rules.json", help="Structured JSON after rules")
+    ap.add_argument("--outdir", default="output_vol2", help="Output directory")
+    ap.add_argument("--title", default="Книга (современная орфография)", help="HTML title")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    data = json.loads(Path(args.inp).read_text(encoding="utf-8"))
+    blocks = data.get("blocks", [])
+    new_blocks, flags_all = modernize_blocks(blocks)
 
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
@@ -199,9 +236,7 @@ def main():
     # Write HTML and TXT
     html = render_html(new_blocks, args.title)
     Path(outdir / "final.html").write_text(html, encoding="utf-8")
-    # Plain TXT without tags: strip tags crudely
-    txt_plain = "\n\n".join(re.sub(r"<[^>]+>", "", b["text"]) for b in new_blocks)
-    Path(outdir / "final.txt").write_text(txt_plain, encoding="utf-8")
+    Path(outdir / "final.txt").write_text(plain_text(new_blocks), encoding="utf-8")
 
     # Flags
     Path(outdir / "flags.json").write_text(json.dumps(flags_all, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -1,4 +1,5 @@
 import argparse
+import re
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, List, Sequence, Tuple
@@ -13,6 +14,16 @@ from natasha import (
     Segmenter,
 )
 
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+from trace_events import span
+
+
+# Natasha разбирает текст кусками не меньше этого числа символов, разрезая их по концам предложений:
+# после каждого куска этап сообщает о ходе работы
+CHUNK_CHARS = 20_000
+SENTENCE_BREAK = re.compile(r"(?<=[.!?…])[ \t]*\n")
+
 
 @dataclass(frozen=True)
 class Mention:
@@ -21,6 +32,18 @@ class Mention:
     type: str
 
 
+def text_chunks(text: str, size: int = CHUNK_CHARS):
+    """Куски текста по size+ символов; граница — перевод строки после конца предложения."""
+    start = 0
+    while len(text) - start > size:
+        m = SENTENCE_BREAK.search(text, start + size)
+        if m is None:
+            break
+        yield text[start:m.end()]
+        start = m.end()
+    yield text[start:]
+
+
 def load_pdf_text(pdf_path: Path) -> str:
     doc = fitz.open(pdf_path)
     pages = [page.get_text("text") for page in doc]
@@ -35,21 +58,29 @@ class NatashaPipeline:
         self.ner_tagger = NewsNERTagger(self.embedding)
         self.morph_vocab = MorphVocab()
 
-    def extract(self, text: str, allowed_types: Sequence[str]) -> List[Mention]:
-        doc = Doc(text)
-        doc.segment(self.segmenter)
-        doc.tag_morph(self.morph_tagger)
-        doc.tag_ner(self.ner_tagger)
+    def extract(self, text: str, allowed_types: Sequence[str], progress: Progress | None = None) -> List[Mention]:
+        """Упоминания сущностей по кускам текста (text_chunks); progress продвигается на символы куска."""
         mentions = []
-        for span in doc.spans:
-            if span.type not in allowed_types:
-                continue
-            try:
-                span.normalize(self.morph_vocab)
-            except ValueError:
-                pass
-            normal = span.normal or span.text
-            mentions.append(Mention(text=span.text, normal=normal, type=span.type))
+        for chunk in text_chunks(text):
+            doc = Doc(chunk)
+            with span("segment", chars=len(chunk)):
+                doc.segment(self.segmenter)
+            with span("morph"):
+                doc.tag_morph(self.morph_tagger)
+            with span("ner"):
+                doc.tag_ner(self.ner_tagger)
+            with span("normalize"):
+                for entity in doc.spans:
+                    if entity.type not in allowed_types:
+                        continue
+                    try:
+                        entity.normalize(self.morph_vocab)
+                    except ValueError:
+                        pass
+                    normal = entity.normal or entity.text
+                    mentions.append(Mention(text=entity.text, normal=normal, type=entity.type))
+            if progress is not None:
+                progress.advance(len(chunk))
         return mentions
 
 
@@ -57,9 +88,23 @@ def parse_types(types: str) -> List[str]:
     return [tok.strip().upper() for tok in types.split(",") if tok.strip()]
 
 
-def collect_mentions(text: str, allowed_types: Sequence[str], deduplicate: bool = True) -> List[Mention]:
-    pipeline = NatashaPipeline()
-    mentions = pipeline.extract(text, allowed_types)
+def collect_mentions(
+    text: str,
+    allowed_types: Sequence[str],
+    deduplicate: bool = True,
+    pipeline: NatashaPipeline | None = None,
+    stage: str = "natasha_check",
+    progress: Progress | None = None,
+) -> List[Mention]:
+    """progress — общая шкала этапа в символах для всех проходов; без неё проход заводит свою."""
+    with span("load models"):
+        pipeline = pipeline or NatashaPipeline()
+    with span("natasha pass", chars=len(text)):
+        if progress is None:
+            with Progress(stage, len(text), "chars") as progress:
+                mentions = pipeline.extract(text, allowed_types, progress)
+        else:
+            mentions = pipeline.extract(text, allowed_types, progress)
     if deduplicate:
         return dedupe(mentions)
     return mentions
@@ -113,6 +158,7 @@ def format_report(
     return "\n".join(lines)
 
 
+@profiled_main
 def main():
     parser = argparse.ArgumentParser(description="Сравнивает именованные сущности PDF и final_clean.txt через Natasha.")
     parser.add_argument("--pdf", required=True, help="PDF с современным текстом (или близким к нему)")
@@ -120,6 +166,7 @@ def main():
     parser.add_argument("--out", default="natasha_diff.txt", help="Файл с отчётом")
     parser.add_argument("--types", default="PER,LOC", help="Типы сущностей для сравнения (PER, LOC, ORG)")
     parser.add_argument("--keep-order", action="store_true", help="Сохранять первый порядок появления в тексте")
+    add_profile_args(parser)
     args = parser.parse_args()
 
     pdf_path = Path(args.pdf)
@@ -135,8 +182,12 @@ def main():
     pdf_text = load_pdf_text(pdf_path)
     clean_text = clean_path.read_text(encoding="utf-8", errors="ignore")
 
-    pdf_mentions = collect_mentions(pdf_text, allowed, deduplicate=not args.keep_order)
-    clean_mentions = collect_mentions(clean_text, allowed, deduplicate=not args.keep_order)
+    pipeline = NatashaPipeline()
+    with Progress("natasha_check", len(pdf_text) + len(clean_text), "chars") as progress:
+        pdf_mentions = collect_mentions(pdf_text, allowed, deduplicate=not args.keep_order,
+                                        pipeline=pipeline, progress=progress)
+        clean_mentions = collect_mentions(clean_text, allowed, deduplicate=not args.keep_order,
+                                          pipeline=pipeline, progress=progress)
 
     pdf_missing, clean_missing = build_summary(pdf_mentions, clean_mentions)
     report = format_report(pdf_missing, clean_missing)
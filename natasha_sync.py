@@ -3,10 +3,13 @@ from pathlib import Path
 
 from natasha_entity_check import (
     Mention,
+    NatashaPipeline,
     collect_mentions,
     load_pdf_text,
     parse_types,
 )
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
 
 
 def build_replacements(
@@ -54,6 +57,7 @@ def format_sync_report(
     return "\n".join(lines)
 
 
+@profiled_main
 def main():
     parser = argparse.ArgumentParser(description="Гармонизирует final_clean.txt с упоминаниями из PDF.")
     parser.add_argument("--pdf", required=True, help="PDF с эталонными сущностями")
@@ -62,6 +66,7 @@ def main():
     parser.add_argument("--report", help="Файл для отчёта по заменам")
     parser.add_argument("--types", default="PER,LOC", help="Типы сущностей (PER, LOC, ORG)")
     parser.add_argument("--keep-order", action="store_true", help="Не удалять дубликаты сущностей")
+    add_profile_args(parser)
     args = parser.parse_args()
 
     pdf_path = Path(args.pdf)
@@ -76,8 +81,12 @@ def main():
     pdf_text = load_pdf_text(pdf_path)
     clean_text = clean_path.read_text(encoding="utf-8", errors="ignore")
 
-    pdf_mentions = collect_mentions(pdf_text, allowed, deduplicate=not args.keep_order)
-    clean_mentions = collect_mentions(clean_text, allowed, deduplicate=not args.keep_order)
+    pipeline = NatashaPipeline()
+    with Progress("natasha_sync", len(pdf_text) + len(clean_text), "chars") as progress:
+        pdf_mentions = collect_mentions(pdf_text, allowed, deduplicate=not args.keep_order,
+                                        pipeline=pipeline, progress=progress)
+        clean_mentions = collect_mentions(clean_text, allowed, deduplicate=not args.keep_order,
+                                          pipeline=pipeline, progress=progress)
 
     replacements = build_replacements(pdf_mentions, clean_mentions)
     new_text, applied = apply_replacements(clean_text, replacements)
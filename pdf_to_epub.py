@@ -6,10 +6,19 @@ import argparse
 import json
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
 from pathlib import Path
 
+import progress_events
+import trace_events
+from pipeline_metrics import file_sizes, read_report, write_metrics
+from stage_cache import StageCache
+from stage_graph import OUTPUT_LOCK, Stage, critical_path, print_report, run_graph
+
 # Устанавливаем UTF-8 кодировку для консоли (Windows)
 if sys.platform == 'win32':
     try:
@@ -22,19 +31,454 @@ if sys.platform == 'win32':
         pass
 
 
-def run_cmd(cmd, description=""):
-    """Запускает команду и выводит описание"""
-    if description:
-        print(f"\n{'='*80}")
-        print(f"{description}")
-        print(f"{'='*80}")
-    print(f"$ {' '.join(cmd)}")
-    try:
-        subprocess.check_call(cmd)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Ошибка: {e}")
+# Имена этапов для --force-stage
+STAGE_NAMES = ["extract", "oldspelling", "stanza", "modernize", "local_spell", "lt_cloud",
+               "context", "natasha_check", "natasha_sync", "epub"]
+
+
+def run_cmd(cmd, description="", prefix="", metrics=None, trace_malloc=False):
+    """Запускает команду и выводит описание.
+
+    С prefix вывод команды читается построчно и печатается с этим префиксом,
+    чтобы строки одновременно работающих этапов можно было различить.
+    С metrics Python-скрипт запускается через pipeline_metrics.py, и в metrics
+    добавляются его CPU-время, пиковая память и число HTTP-запросов.
+    """
+    if metrics is not None:
+        fd, metrics_out = tempfile.mkstemp(prefix="stage_metrics_", suffix=".json")
+        os.close(fd)
+        wrapper = [sys.executable, str(Path(__file__).parent / "pipeline_metrics.py"), "--out", metrics_out]
+        if trace_malloc:
+            wrapper.append("--tracemalloc")
+        try:
+            return run_cmd(wrapper + cmd[1:], description, prefix)
+        finally:
+            report = read_report(metrics_out)
+            os.remove(metrics_out)
+            metrics.update({k: report.get(k) for k in ("cpu_s", "peak_rss_mb", "tracemalloc_peak_mb")})
+            metrics["requests"] = (report.get("counters") or {}).get("requests", 0)
+    with OUTPUT_LOCK:
+        if description:
+            print(f"\n{'='*80}")
+            print(f"{prefix}{description}")
+            print(f"{'='*80}")
+        print(f"{prefix}$ {' '.join(cmd)}")
+    if not prefix:
+        try:
+            subprocess.check_call(cmd)
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"Ошибка: {e}")
+            return False
+    env = dict(os.environ, PYTHONIOENCODING='utf-8', PYTHONUNBUFFERED='1')
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+                          encoding='utf-8', errors='replace') as proc:
+        for line in proc.stdout:
+            with OUTPUT_LOCK:
+                print(f"{prefix}{line}", end="")
+    if proc.returncode:
+        with OUTPUT_LOCK:
+            print(f"{prefix}Ошибка: команда завершилась с кодом {proc.returncode}")
         return False
+    return True
+
+
+def print_summary(outdir: Path):
+    """Итоговое сообщение и список созданных файлов"""
+    print("\n" + "=" * 80)
+    print("✅ ОБРАБОТКА ЗАВЕРШЕНА")
+    print("=" * 80)
+    print(f"Результаты в папке: {outdir}")
+    
+    # Показываем созданные файлы
+    print("\nСозданные файлы:")
+    for pattern in ["*.txt", "*.html", "*.json", "*.epub"]:
+        files = list(outdir.glob(pattern))
+        if files:
+            print(f"\n{pattern}:")
+            for f in sorted(files):
+                print(f"  - {f.name}")
+
+
+def epub_path(outdir: Path, title: str) -> Path:
+    """Имя EPUB по названию книги"""
+    # Санитизируем имя файла для Windows (убираем недопустимые символы)
+    safe_title = re.sub(r'[<>:"/\\|?*]', '_', title)
+    safe_title = safe_title.replace(' ', '_')
+    return outdir / f"{safe_title}.epub"
+
+
+def resolve_template(epub_template: str, here: Path) -> Path:
+    """Путь к шаблону EPUB: относительный ищется рядом со скриптом, иначе берётся sample.epub"""
+    template_epub = Path(epub_template)
+    if not template_epub.is_absolute():
+        if (here / template_epub).exists():
+            template_epub = here / template_epub
+        elif (here / "sample.epub").exists():
+            template_epub = here / "sample.epub"
+    return template_epub
+
+
+# Источники для EPUB по приоритету из схемы
+EPUB_SOURCES = ["final_clean.txt", "final.txt", "structured_rules.json", "structured.json", "final_clean.html"]
+
+
+def run_epub_stage(args, here: Path, outdir: Path, prefix: str = "", metrics=None) -> bool:
+    """Этап 8: выбрать лучший источник (на момент запуска этапа) и собрать EPUB"""
+    output_epub = epub_path(outdir, args.title)
+    
+    # Определяем лучший источник для EPUB (по приоритету из схемы)
+    # Приоритет: TXT (чистый обработанный текст) > JSON (структурированные данные) > HTML (может содержать лишнюю разметку)
+    epub_sources = [outdir / name for name in EPUB_SOURCES]
+    
+    epub_source = None
+    for source in epub_sources:
+        if source.exists():
+            # Проверяем, что файл не пустой
+            try:
+                is_valid = False
+                if source.suffix.lower() == ".txt":
+                    # Для TXT файлов проверяем, что есть достаточно текста (не только пробелы и не только цифры)
+                    content = source.read_text(encoding="utf-8").strip()
+                    # Проверяем, что есть текст и он не слишком короткий (минимум 50 символов)
+                    # И что это не только цифры/пробелы
+                    if content and len(content) >= 50:
+                        # Проверяем, что есть буквы, а не только цифры
+                        has_letters = any(c.isalpha() for c in content)
+                        is_valid = has_letters
+                    else:
+                        is_valid = False
+                elif source.suffix.lower() == ".json":
+                    # Для JSON файлов проверяем, что есть блоки
+                    data = json.loads(source.read_text(encoding="utf-8"))
+                    blocks = data.get("blocks", [])
+                    is_valid = bool(blocks and any(b.get("text", "").strip() for b in blocks))
+                elif source.suffix.lower() in (".html", ".htm"):
+                    # Для HTML файлов проверяем, что есть контент (не только теги)
+                    content = source.read_text(encoding="utf-8")
+                    # Убираем все теги и проверяем наличие текста
+                    text_only = re.sub(r'<[^>]+>', '', content).strip()
+                    # Если HTML содержит только простой текст в <pre> (без структуры),
+                    # лучше использовать TXT файл, который будет проверен позже
+                    # Проверяем, что это не просто <pre> с текстом
+                    if re.search(r'<pre[^>]*>', content, re.IGNORECASE):
+                        # Если есть <pre>, проверяем, есть ли другие структурированные элементы
+                        has_structure = bool(re.search(r'<(h[1-6]|p|div|section|article|header|footer)[^>]*>', content, re.IGNORECASE))
+                        # Если нет структуры, лучше пропустить этот HTML в пользу TXT
+                        if not has_structure:
+                            is_valid = False  # Пропускаем простой HTML в пользу TXT
+                        else:
+                            is_valid = bool(text_only)
+                    else:
+                        is_valid = bool(text_only)
+                
+                if is_valid:
+                    epub_source = source
+                    break
+                else:
+                    # Определяем причину, почему файл был пропущен
+                    reason = "пустой"
+                    if source.suffix.lower() == ".txt":
+                        try:
+                            content = source.read_text(encoding="utf-8").strip()
+                            if not content:
+                                reason = "пустой"
+                            elif len(content) < 50:
+                                reason = f"слишком короткий ({len(content)} символов)"
+                            elif not any(c.isalpha() for c in content):
+                                reason = "содержит только цифры/символы"
+                        except:
+                            reason = "ошибка чтения"
+                    print(f"⚠️  Файл {source.name} существует, но {reason} - пропускаем")
+            except Exception as e:
+                print(f"⚠️  Предупреждение: ошибка при проверке {source.name}: {e}")
+                continue
+    
+    if not epub_source:
+        print(f"⚠️  Предупреждение: не найден подходящий файл для генерации EPUB")
+        print(f"   Проверенные файлы: {', '.join(str(s.name) for s in epub_sources)}")
+        # Показываем статус каждого файла
+        for source in epub_sources:
+            if source.exists():
+                try:
+                    size = source.stat().st_size
+                    print(f"   - {source.name}: существует ({size} байт)")
+                except:
+                    print(f"   - {source.name}: существует (размер неизвестен)")
+            else:
+                print(f"   - {source.name}: не найден")
+    else:
+        print(f"📄 Используется источник для EPUB: {epub_source.name}")
+        # Показываем краткую информацию о содержимом
+        try:
+            if epub_source.suffix.lower() == ".json":
+                import json
+                data = json.loads(epub_source.read_text(encoding="utf-8"))
+                blocks = data.get("blocks", [])
+                blocks_with_text = [b for b in blocks if b.get("text", "").strip()]
+                print(f"   Содержит {len(blocks)} блоков, из них {len(blocks_with_text)} с текстом")
+            elif epub_source.suffix.lower() == ".txt":
+                content = epub_source.read_text(encoding="utf-8")
+                lines = [l.strip() for l in content.splitlines() if l.strip()]
+                print(f"   Содержит {len(lines)} непустых строк, размер: {len(content)} символов")
+        except Exception as e:
+            print(f"   ⚠️  Не удалось проанализировать содержимое: {e}")
+        template_epub = resolve_template(args.epub_template, here)
+        if not template_epub.exists():
+            print(f"⚠️  Предупреждение: шаблон EPUB не найден: {template_epub}")
+        else:
+            epub_cmd = [
+                sys.executable,
+                str(here / "generate_epub.py"),
+                "--template", str(template_epub),
+                "--in", str(epub_source),
+                "--out", str(output_epub),
+                "--title", args.title,
+                "--max-chapter-size", str(args.epub_max_chapter_size),
+            ]
+            if args.author:
+                epub_cmd.extend(["--author", args.author])
+            if args.cover_colors:
+                epub_cmd.extend(["--cover-colors", args.cover_colors])
+            if args.epub_use_chapter_heads:
+                epub_cmd.append("--use-chapter-heads")
+            if args.images and epub_source.suffix.lower() != ".json":
+                epub_cmd.extend(["--images-from", str(outdir / "structured.json")])
+            epub_cmd.extend(profile_args(args, "epub"))
+            
+            if not run_cmd(epub_cmd, f"Этап 8: Генерация EPUB", prefix, metrics, args.tracemalloc):
+                return False
+            
+            # Проверяем, создался ли EPUB
+            if output_epub.exists():
+                print("\n" + "=" * 80)
+                print("✅ EPUB УСПЕШНО СОЗДАН!")
+                print("=" * 80)
+                print(f"  📚 {output_epub}")
+                print("=" * 80)
+    return True
+
+
+def profile_args(args, stage_name: str) -> list:
+    """Аргументы --profile для скрипта этапа: <папка --profile>/<этап>.pstats"""
+    if not args.profile:
+        return []
+    return ["--profile", str(Path(args.profile) / f"{stage_name}.pstats"), "--profile-top", str(args.profile_top)]
+
+
+def build_stages(args, here: Path, pdf_path: Path, outdir: Path) -> list[Stage]:
+    """Этапы пайплайна (подпроцессы) с объявленными входными и выходными файлами"""
+    stages = []
+    prefix_output = args.stage_workers > 1
+
+    def add(name, title, cmd, inputs, outputs, step=None, required=True, guard=None, pick_input=None):
+        """pick_input — функция, выбирающая значение --in в момент запуска этапа (и проверяемая как guard)."""
+        description = f"Этап {step}: {title}" if step else title
+        cmd = cmd + profile_args(args, name)
+        prefix = f"[{name}] " if prefix_output else ""
+
+        def run():
+            run_args, source = cmd, guard
+            if pick_input is not None:
+                source = pick_input()
+                i = cmd.index("--in") + 1
+                run_args = cmd[:i] + [str(source)] + cmd[i + 1:]
+            if source is not None and not source.exists():
+                with OUTPUT_LOCK:
+                    print(f"⚠️  Предупреждение: {source.name} не найден — этап {name} пропущен")
+                return True
+            return run_cmd(run_args, description, prefix, stage.metrics, args.tracemalloc)
+
+        stage = Stage(name, run, tuple(inputs), tuple(outputs), required=required, title=title,
+                      params=tuple(cmd[2:]), code=(cmd[1],), measure=file_sizes)
+        stages.append(stage)
+        return stage
+    
+    # Этап 1: Извлечение структуры (обязательно)
+    extract_cmd = [
+        sys.executable,
+        str(here / "extract_structured_text.py"),
+        "--pdf", str(pdf_path),
+        "--outdir", str(outdir)
+    ]
+    if args.two_columns:
+        extract_cmd.append("--two-columns")
+    elif args.columns != 'auto':
+        extract_cmd.extend(["--columns", args.columns])
+    if args.jobs != 1:
+        extract_cmd.extend(["--jobs", str(args.jobs)])
+    if args.stream_extract:
+        extract_cmd.append("--stream")
+    if args.extract_cache:
+        extract_cmd.extend(["--cache-dir", args.extract_cache])
+    if args.images:
+        extract_cmd.append("--images")
+    if args.ocr:
+        extract_cmd.extend(["--ocr", "--ocr-lang", args.ocr_lang])
+    if args.font_stats != 'page':
+        extract_cmd.extend(["--font-stats", args.font_stats])
+    structured_in = outdir / "structured.json"
+    extract_outputs = [structured_in, outdir / "structured.html", outdir / "structured.txt"]
+    if args.images:
+        extract_outputs.append(outdir / "images")
+    add("extract", "Извлечение структуры", extract_cmd, [pdf_path], extract_outputs, step=1)
+    
+    # Этап 2: Применение правил oldspelling (опционально)
+    if not args.no_oldspelling:
+        apply_cmd = [
+            sys.executable,
+            str(here / "apply_rules_structured.py"),
+            "--rules", str(here / "oldspelling.py"),
+            "--in", str(structured_in),
+            "--out", str(outdir / "structured_rules.json")
+        ]
+        rules_inputs = [structured_in, here / "oldspelling.py"]
+        rules_outputs = [outdir / "structured_rules.json"]
+        if args.oldspelling_lexicon:
+            apply_cmd.append("--lexicon")
+            rules_inputs.append(here / "oldspelling.lexicon.tsv")
+        if args.rule_report:
+            apply_cmd.append("--rule-report")
+            rules_outputs.append(outdir / "structured_rules.rule_report.json")
+        add("oldspelling", "Применение правил oldspelling", apply_cmd, rules_inputs, rules_outputs, step=2)
+        structured_in = outdir / "structured_rules.json"
+    
+    # Этап 3: Stanza токенизация (опционально)
+    if args.stanza_tokenize and args.stanza_model:
+        stanza_cmd = [
+            sys.executable,
+            str(here / "stanza_tokenizer.py"),
+            "--in", str(structured_in),
+            "--out", str(outdir / "structured_tokenized.json"),
+            "--model", args.stanza_model
+        ]
+        add("stanza", "Stanza токенизация", stanza_cmd, [structured_in, Path(args.stanza_model)], [outdir / "structured_tokenized.json"], step=3)
+        structured_in = outdir / "structured_tokenized.json"
+    
+    # Этап 4: Модернизация (всегда выполняется)
+    modernize_cmd = [
+        sys.executable,
+        str(here / "modernize_structured.py"),
+        "--in", str(structured_in),
+        "--outdir", str(outdir),
+        "--title", args.title
+    ]
+    add("modernize", "Модернизация орфографии", modernize_cmd, [structured_in],
+        [outdir / "final.html", outdir / "final.txt", outdir / "flags.json"], step=4)
+    
+    # Входной файл для проверок орфографии
+    spell_input = outdir / "final.txt"
+    
+    # Этап 5: Локальная проверка орфографии (опционально)
+    if args.local_spell:
+        local_spell_cmd = [
+            sys.executable,
+            str(here / "local_spell_checker.py"),
+            "--in", str(spell_input),
+            "--outdir", str(outdir),
+            "--title", args.title + " (Local Spell)",
+            "--checker-type", args.local_spell_type,
+            "--lang", args.local_spell_lang,
+        ]
+        if args.local_spell_model:
+            if args.local_spell_type == "jamspell":
+                local_spell_cmd.extend(["--model-path", args.local_spell_model])
+            elif args.local_spell_type == "symspell":
+                local_spell_cmd.extend(["--dictionary-path", args.local_spell_model])
+            elif args.local_spell_type == "auto":
+                local_spell_cmd.extend(["--model-path", args.local_spell_model])
+        # Ошибка проверщика (нет модели или библиотеки) не останавливает пайплайн: LanguageTool возьмёт final.txt
+        local_spell = add("local_spell", f"Локальная проверка орфографии ({args.local_spell_type})", local_spell_cmd,
+                          [spell_input], [outdir / "final_local_spell.txt", outdir / "final_local_spell.html"],
+                          guard=spell_input, required=False, step=5)
+    else:
+        local_spell = None
+
+    def lt_input() -> Path:
+        """Результат локальной проверки, если её этап завершился успешно в этом запуске (или взят из кэша).
+
+        Решает статус этапа, а не наличие файла: старый final_local_spell.txt от прошлого
+        запуска не должен попасть в LanguageTool.
+        """
+        local = outdir / "final_local_spell.txt"
+        if local_spell is not None and local_spell.ok and local.exists():
+            return local
+        return outdir / "final.txt"
+    
+    # Этап 6: LanguageTool (опционально)
+    if args.lt_cloud:
+        lt_cmd = [
+            sys.executable,
+            str(here / "lt_cloud.py"),
+            "--in", str(spell_input),
+            "--outdir", str(outdir),
+            "--title", args.title + " (LT)",
+            "--chunk-size", str(args.chunk_size),
+        ]
+        lt_inputs = [spell_input] + ([outdir / "final_local_spell.txt"] if args.local_spell else [])
+        add("lt_cloud", "LanguageTool проверка", lt_cmd,
+            lt_inputs, [outdir / "final_clean.txt", outdir / "final_clean.html"], pick_input=lt_input, step=6)
+    
+    clean_txt = outdir / "final_clean.txt"
+    
+    # Этап 7: Контекстная проверка (опционально)
+    if args.context_check:
+        context_cmd = [
+            sys.executable,
+            str(here / "context_checker.py"),
+            "--in", str(clean_txt),
+            "--out", str(outdir / args.context_out),
+            "--pronouns", args.context_pronouns
+        ]
+        add("context", "Контекстная проверка", context_cmd, [clean_txt], [outdir / args.context_out], guard=clean_txt, step=7)
+    
+    # Natasha проверки (после LanguageTool, параллельно с контекстной проверкой)
+    if args.natasha_check:
+        natasha_cmd = [
+            sys.executable,
+            str(here / "natasha_entity_check.py"),
+            "--pdf", str(pdf_path),
+            "--clean", str(clean_txt),
+            "--out", str(outdir / args.natasha_out),
+            "--types", args.natasha_types
+        ]
+        add("natasha_check", "Natasha проверка именованных сущностей", natasha_cmd,
+            [pdf_path, clean_txt], [outdir / args.natasha_out], required=False, guard=clean_txt)
+    
+    # Синхронизация переписывает final_clean.txt, поэтому ждёт всех, кто читает его прежнюю версию
+    if args.natasha_sync:
+        natasha_sync_cmd = [
+            sys.executable,
+            str(here / "natasha_sync.py"),
+            "--pdf", str(pdf_path),
+            "--clean", str(clean_txt),
+            "--types", args.natasha_types,
+            "--report", str(outdir / args.natasha_sync_report)
+        ]
+        add("natasha_sync", "Natasha синхронизация именованных сущностей", natasha_sync_cmd,
+            [pdf_path, clean_txt], [clean_txt, outdir / args.natasha_sync_report], required=False, guard=clean_txt)
+    
+    # Этап 8: Генерация EPUB (опционально)
+    if args.epub_template:
+        prefix = "[epub] " if prefix_output else ""
+        epub_inputs = [outdir / name for name in EPUB_SOURCES]
+        epub_inputs.append(resolve_template(args.epub_template, here))
+        if args.images:
+            epub_inputs.append(outdir / "images")
+        epub_stage = Stage(
+            "epub",
+            lambda: run_epub_stage(args, here, outdir, prefix, epub_stage.metrics),
+            tuple(epub_inputs),
+            (epub_path(outdir, args.title),),
+            title="Генерация EPUB",
+            params=(args.title, args.author, args.cover_colors, args.epub_max_chapter_size,
+                    args.epub_use_chapter_heads, args.images),
+            code=(here / "pdf_to_epub.py", here / "generate_epub.py"),
+            measure=file_sizes,
+        )
+        stages.append(epub_stage)
+    
+    return stages
 
 
 def main():
@@ -71,10 +515,26 @@ def main():
     parser.add_argument('--author', default='', help='Автор книги')
     
     # Этап 1: Извлечение структуры (обязательно)
-    parser.add_argument('--two-columns', action='store_true', help='PDF с двумя колонками на странице')
+    parser.add_argument('--columns', choices=['auto', '1', '2'], default='auto',
+                       help='Колонки: auto — определять 1..N колонок на каждой странице (по умолчанию), 1 — одна колонка, 2 — деление по центру страницы')
+    parser.add_argument('--two-columns', action='store_true', help='То же, что --columns 2 (деление каждой страницы по центру)')
+    parser.add_argument('--jobs', type=int, default=1, help='Число процессов для извлечения страниц (0 = по числу CPU, по умолчанию: 1)')
+    parser.add_argument('--font-stats', choices=['page', 'document'], default='page',
+                       help='Порог заголовков: по медиане шрифта страницы или по гистограмме всей книги (по умолчанию: page)')
+    parser.add_argument('--images', action='store_true', help='Извлекать иллюстрации из PDF и добавлять их в EPUB')
+    parser.add_argument('--ocr', action='store_true', help='Распознавать страницы без текстового слоя локальным Tesseract')
+    parser.add_argument('--ocr-lang', default='rus', help='Язык(и) Tesseract для --ocr (по умолчанию: rus)')
+    parser.add_argument('--extract-cache', default='', help='Папка постраничного кэша извлечения (неизменённые страницы не разбираются повторно)')
+    parser.add_argument('--stream-extract', action='store_true', help='Потоковое извлечение с ограниченной памятью (для очень больших PDF)')
     
     # Этап 2: Oldspelling (опционально)
     parser.add_argument('--no-oldspelling', action='store_true', help='Пропустить применение правил старой орфографии')
+    parser.add_argument('--oldspelling-lexicon', action='store_true',
+                        help='Применять правила oldspelling по словарю слов (oldspelling.lexicon.tsv и слова, '
+                             'выученные по ходу) вместо прохода плана по тексту')
+    parser.add_argument('--rule-report', action='store_true',
+                        help='Отчёт по каждому правилу oldspelling (замены, блоки, время, примеры) '
+                             'в structured_rules.rule_report.json')
     
     # Этап 3: Stanza токенизация (опционально)
     parser.add_argument('--stanza-tokenize', action='store_true', help='Улучшить разбиение на предложения через Stanza')
@@ -112,6 +572,30 @@ def main():
     parser.add_argument('--natasha-sync', action='store_true', help='Синхронизация именованных сущностей через Natasha')
     parser.add_argument('--natasha-sync-report', default='natasha_sync.txt', help='Файл отчета Natasha синхронизации')
     
+    # Режим выполнения
+    parser.add_argument('--in-process', action='store_true',
+                       help='Выполнять этапы в одном процессе, передавая документ в памяти (без повторного запуска Python и разбора промежуточных файлов)')
+    parser.add_argument('--stage-workers', type=int, default=3,
+                       help='Сколько независимых этапов (контекстная проверка, Natasha, EPUB) выполнять одновременно (по умолчанию: 3; 1 — строго по очереди)')
+    parser.add_argument('--no-stage-cache', action='store_true',
+                       help='Не использовать кэш этапов (<outdir>/.stage_cache): выполнять все этапы заново')
+    parser.add_argument('--force-stage', action='append', default=[], choices=STAGE_NAMES, metavar='STAGE',
+                       help=f'Выполнить этап заново, даже если его входы не изменились (можно повторять): {", ".join(STAGE_NAMES)}')
+    parser.add_argument('--tracemalloc', action='store_true',
+                       help='Записывать в pipeline_metrics.json пик памяти Python по tracemalloc (замедляет этапы)')
+    parser.add_argument('--profile', metavar='DIR', default='',
+                       help='Профилировать каждый этап через cProfile: <DIR>/<этап>.pstats и список самых затратных функций (кэш этапов при этом не используется)')
+    parser.add_argument('--profile-top', type=int, default=15, metavar='N',
+                       help='Сколько самых затратных функций печатать для каждого этапа с --profile (по умолчанию: 15)')
+    parser.add_argument('--trace', metavar='FILE', default='',
+                       help='Сохранить временную шкалу запуска (этапы, страницы, чанки, HTTP-запросы) в формате Chrome trace events')
+    parser.add_argument('--progress-file', metavar='FILE', default='',
+                       help='Куда этапы пишут события хода выполнения в формате JSON lines (по умолчанию: <outdir>/progress.jsonl)')
+    parser.add_argument('--progress-interval', type=float, default=5.0, metavar='SEC',
+                       help='Как часто печатать общий прогресс и оценку оставшегося времени (по умолчанию: 5; 0 — не печатать)')
+    parser.add_argument('--no-intermediate', action='store_true',
+                       help='С --in-process: не сохранять промежуточные файлы (structured*, structured_rules.json, flags.json, final_local_spell.*)')
+    
     args = parser.parse_args()
     
     here = Path(__file__).parent
@@ -132,344 +616,56 @@ def main():
     if args.author:
         print(f"Автор: {args.author}")
     print(f"Папка результатов: {outdir}")
-    print("\nЭтапы обработки:")
     
-    step_num = 1
+    if args.in_process:
+        from pipeline_inprocess import build_stages as build_inprocess_stages
+        stages = build_inprocess_stages(args, here, pdf_path, outdir)
+    else:
+        stages = build_stages(args, here, pdf_path, outdir)
     
-    # Этап 1: Извлечение структуры (обязательно)
-    print(f"  {step_num}. Извлечение структуры из PDF")
-    step_num += 1
-    
-    extract_cmd = [
-        sys.executable,
-        str(here / "extract_structured_text.py"),
-        "--pdf", str(pdf_path),
-        "--outdir", str(outdir)
-    ]
-    if args.two_columns:
-        extract_cmd.append("--two-columns")
-    
-    if not run_cmd(extract_cmd, f"Этап 1: Извлечение структуры"):
-        return 1
-    
-    # Определяем входной файл для следующих этапов
-    structured_in = outdir / "structured.json"
-    
-    # Этап 2: Применение правил oldspelling (опционально)
-    if not args.no_oldspelling:
-        print(f"  {step_num}. Применение правил старой орфографии")
-        step_num += 1
-        
-        apply_cmd = [
-            sys.executable,
-            str(here / "apply_rules_structured.py"),
-            "--rules", str(here / "oldspelling.py"),
-            "--in", str(structured_in),
-            "--out", str(outdir / "structured_rules.json")
-        ]
-        if not run_cmd(apply_cmd, f"Этап 2: Применение правил oldspelling"):
-            return 1
-        
-        structured_in = outdir / "structured_rules.json"
-    
-    # Этап 3: Stanza токенизация (опционально)
-    if args.stanza_tokenize and args.stanza_model:
-        print(f"  {step_num}. Stanza токенизация")
-        step_num += 1
-        
-        stanza_cmd = [
-            sys.executable,
-            str(here / "stanza_tokenizer.py"),
-            "--in", str(structured_in),
-            "--out", str(outdir / "structured_tokenized.json"),
-            "--model", args.stanza_model
-        ]
-        if not run_cmd(stanza_cmd, f"Этап 3: Stanza токенизация"):
-            return 1
-        
-        structured_in = outdir / "structured_tokenized.json"
-    
-    # Этап 4: Модернизация (всегда выполняется)
-    print(f"  {step_num}. Модернизация орфографии")
-    step_num += 1
-    
-    modernize_cmd = [
-        sys.executable,
-        str(here / "modernize_structured.py"),
-        "--in", str(structured_in),
-        "--outdir", str(outdir),
-        "--title", args.title
-    ]
-    if not run_cmd(modernize_cmd, f"Этап 4: Модернизация орфографии"):
+    print("\nЭтапы обработки:")
+    for step_num, stage in enumerate(stages, 1):
+        print(f"  {step_num}. {stage.title}")
+    
+    if args.trace:
+        trace_dir = Path(tempfile.mkdtemp(prefix=".trace_", dir=outdir))
+        trace_events.enable(trace_dir)
+    
+    progress_file = Path(args.progress_file) if args.progress_file else outdir / "progress.jsonl"
+    progress_file.write_text("", encoding="utf-8")
+    os.environ[progress_events.ENV_VAR] = str(progress_file)
+    monitor = None
+    if args.progress_interval > 0:
+        monitor = progress_events.ProgressMonitor(progress_file, stages, args.progress_interval, OUTPUT_LOCK)
+        monitor.start()
+    
+    started = time.perf_counter()
+    # Кэш этапов работает с файлами, поэтому только в режиме подпроцессов; с --profile этапы должны выполняться
+    use_cache = not (args.in_process or args.no_stage_cache or args.profile)
+    cache = StageCache(outdir / ".stage_cache") if use_cache else None
+    ok = run_graph(stages, workers=args.stage_workers, cache=cache, force=set(args.force_stage))
+    wall = time.perf_counter() - started
+    if monitor is not None:
+        monitor.stop()
+    print_report(stages, wall)
+    write_metrics(
+        outdir / "pipeline_metrics.json",
+        stages,
+        wall,
+        [s.name for s in critical_path(stages)[0]],
+        pdf=str(pdf_path),
+        mode="in-process" if args.in_process else "subprocess",
+        stage_workers=args.stage_workers,
+        tracemalloc=args.tracemalloc,
+    )
+    if args.trace:
+        count = trace_events.merge_trace(trace_dir, args.trace)
+        shutil.rmtree(trace_dir, ignore_errors=True)
+        print(f"Трасса ({count} интервалов) сохранена в {args.trace}: откройте в chrome://tracing или https://ui.perfetto.dev")
+    if not ok:
         return 1
     
-    # Определяем входной файл для проверок орфографии
-    spell_input = outdir / "final.txt"
-    
-    # Этап 5: Локальная проверка орфографии (опционально)
-    if args.local_spell:
-        print(f"  {step_num}. Локальная проверка орфографии ({args.local_spell_type})")
-        step_num += 1
-        
-        if not spell_input.exists():
-            print(f"⚠️  Предупреждение: {spell_input.name} не найден — локальная проверка пропущена")
-        else:
-            local_spell_cmd = [
-                sys.executable,
-                str(here / "local_spell_checker.py"),
-                "--in", str(spell_input),
-                "--outdir", str(outdir),
-                "--title", args.title + " (Local Spell)",
-                "--checker-type", args.local_spell_type,
-                "--lang", args.local_spell_lang,
-            ]
-            if args.local_spell_model:
-                if args.local_spell_type == "jamspell":
-                    local_spell_cmd.extend(["--model-path", args.local_spell_model])
-                elif args.local_spell_type == "symspell":
-                    local_spell_cmd.extend(["--dictionary-path", args.local_spell_model])
-                elif args.local_spell_type == "auto":
-                    local_spell_cmd.extend(["--model-path", args.local_spell_model])
-            
-            if not run_cmd(local_spell_cmd, f"Этап 5: Локальная проверка орфографии"):
-                return 1
-            
-            # Обновляем входной файл для следующего этапа
-            local_spell_output = outdir / "final_local_spell.txt"
-            if local_spell_output.exists():
-                spell_input = local_spell_output
-    
-    # Этап 6: LanguageTool (опционально)
-    if args.lt_cloud:
-        print(f"  {step_num}. LanguageTool проверка")
-        step_num += 1
-        
-        if not spell_input.exists():
-            print(f"⚠️  Предупреждение: {spell_input.name} не найден — LanguageTool пропущен")
-        else:
-            lt_cmd = [
-                sys.executable,
-                str(here / "lt_cloud.py"),
-                "--in", str(spell_input),
-                "--outdir", str(outdir),
-                "--title", args.title + " (LT)",
-                "--chunk-size", str(args.chunk_size),
-            ]
-            if not run_cmd(lt_cmd, f"Этап 6: LanguageTool проверка"):
-                return 1
-            
-            # Обновляем входной файл для следующего этапа
-            lt_output = outdir / "final_clean.txt"
-            if lt_output.exists():
-                spell_input = lt_output
-    
-    # Этап 7: Контекстная проверка (опционально)
-    if args.context_check:
-        print(f"  {step_num}. Контекстная проверка")
-        step_num += 1
-        
-        context_input = outdir / "final_clean.txt"
-        if not context_input.exists():
-            print(f"⚠️  Предупреждение: {context_input.name} не найден — контекстная проверка пропущена")
-        else:
-            context_cmd = [
-                sys.executable,
-                str(here / "context_checker.py"),
-                "--in", str(context_input),
-                "--out", str(outdir / args.context_out),
-                "--pronouns", args.context_pronouns
-            ]
-            if not run_cmd(context_cmd, f"Этап 7: Контекстная проверка"):
-                return 1
-    
-    # Natasha проверки (параллельно, после LanguageTool)
-    if args.natasha_check:
-        natasha_input = outdir / "final_clean.txt"
-        if natasha_input.exists():
-            natasha_cmd = [
-                sys.executable,
-                str(here / "natasha_entity_check.py"),
-                "--pdf", str(pdf_path),
-                "--clean", str(natasha_input),
-                "--out", str(outdir / args.natasha_out),
-                "--types", args.natasha_types
-            ]
-            run_cmd(natasha_cmd, "Natasha проверка именованных сущностей")
-    
-    if args.natasha_sync:
-        natasha_input = outdir / "final_clean.txt"
-        if natasha_input.exists():
-            natasha_sync_cmd = [
-                sys.executable,
-                str(here / "natasha_sync.py"),
-                "--pdf", str(pdf_path),
-                "--clean", str(natasha_input),
-                "--types", args.natasha_types,
-                "--report", str(outdir / args.natasha_sync_report)
-            ]
-            run_cmd(natasha_sync_cmd, "Natasha синхронизация именованных сущностей")
-    
-    # Этап 8: Генерация EPUB (опционально)
-    if args.epub_template:
-        print(f"  {step_num}. Генерация EPUB")
-        
-        # Определяем лучший источник для EPUB (по приоритету из схемы)
-        # Приоритет: TXT (чистый обработанный текст) > JSON (структурированные данные) > HTML (может содержать лишнюю разметку)
-        epub_sources = [
-            outdir / "final_clean.txt",  # Приоритет: обработанный текст выше JSON
-            outdir / "final.txt",
-            outdir / "structured_rules.json",
-            outdir / "structured.json",
-            outdir / "final_clean.html",
-        ]
-        
-        epub_source = None
-        for source in epub_sources:
-            if source.exists():
-                # Проверяем, что файл не пустой
-                try:
-                    is_valid = False
-                    if source.suffix.lower() == ".txt":
-                        # Для TXT файлов проверяем, что есть достаточно текста (не только пробелы и не только цифры)
-                        content = source.read_text(encoding="utf-8").strip()
-                        # Проверяем, что есть текст и он не слишком короткий (минимум 50 символов)
-                        # И что это не только цифры/пробелы
-                        if content and len(content) >= 50:
-                            # Проверяем, что есть буквы, а не только цифры
-                            has_letters = any(c.isalpha() for c in content)
-                            is_valid = has_letters
-                        else:
-                            is_valid = False
-                    elif source.suffix.lower() == ".json":
-                        # Для JSON файлов проверяем, что есть блоки
-                        data = json.loads(source.read_text(encoding="utf-8"))
-                        blocks = data.get("blocks", [])
-                        is_valid = bool(blocks and any(b.get("text", "").strip() for b in blocks))
-                    elif source.suffix.lower() in (".html", ".htm"):
-                        # Для HTML файлов проверяем, что есть контент (не только теги)
-                        content = source.read_text(encoding="utf-8")
-                        # Убираем все теги и проверяем наличие текста
-                        text_only = re.sub(r'<[^>]+>', '', content).strip()
-                        # Если HTML содержит только простой текст в <pre> (без структуры),
-                        # лучше использовать TXT файл, который будет проверен позже
-                        # Проверяем, что это не просто <pre> с текстом
-                        if re.search(r'<pre[^>]*>', content, re.IGNORECASE):
-                            # Если есть <pre>, проверяем, есть ли другие структурированные элементы
-                            has_structure = bool(re.search(r'<(h[1-6]|p|div|section|article|header|footer)[^>]*>', content, re.IGNORECASE))
-                            # Если нет структуры, лучше пропустить этот HTML в пользу TXT
-                            if not has_structure:
-                                is_valid = False  # Пропускаем простой HTML в пользу TXT
-                            else:
-                                is_valid = bool(text_only)
-                        else:
-                            is_valid = bool(text_only)
-                    
-                    if is_valid:
-                        epub_source = source
-                        break
-                    else:
-                        # Определяем причину, почему файл был пропущен
-                        reason = "пустой"
-                        if source.suffix.lower() == ".txt":
-                            try:
-                                content = source.read_text(encoding="utf-8").strip()
-                                if not content:
-                                    reason = "пустой"
-                                elif len(content) < 50:
-                                    reason = f"слишком короткий ({len(content)} символов)"
-                                elif not any(c.isalpha() for c in content):
-                                    reason = "содержит только цифры/символы"
-                            except:
-                                reason = "ошибка чтения"
-                        print(f"⚠️  Файл {source.name} существует, но {reason} - пропускаем")
-                except Exception as e:
-                    print(f"⚠️  Предупреждение: ошибка при проверке {source.name}: {e}")
-                    continue
-        
-        if not epub_source:
-            print(f"⚠️  Предупреждение: не найден подходящий файл для генерации EPUB")
-            print(f"   Проверенные файлы: {', '.join(str(s.name) for s in epub_sources)}")
-            # Показываем статус каждого файла
-            for source in epub_sources:
-                if source.exists():
-                    try:
-                        size = source.stat().st_size
-                        print(f"   - {source.name}: существует ({size} байт)")
-                    except:
-                        print(f"   - {source.name}: существует (размер неизвестен)")
-                else:
-                    print(f"   - {source.name}: не найден")
-        else:
-            print(f"📄 Используется источник для EPUB: {epub_source.name}")
-            # Показываем краткую информацию о содержимом
-            try:
-                if epub_source.suffix.lower() == ".json":
-                    import json
-                    data = json.loads(epub_source.read_text(encoding="utf-8"))
-                    blocks = data.get("blocks", [])
-                    blocks_with_text = [b for b in blocks if b.get("text", "").strip()]
-                    print(f"   Содержит {len(blocks)} блоков, из них {len(blocks_with_text)} с текстом")
-                elif epub_source.suffix.lower() == ".txt":
-                    content = epub_source.read_text(encoding="utf-8")
-                    lines = [l.strip() for l in content.splitlines() if l.strip()]
-                    print(f"   Содержит {len(lines)} непустых строк, размер: {len(content)} символов")
-            except Exception as e:
-                print(f"   ⚠️  Не удалось проанализировать содержимое: {e}")
-            template_epub = Path(args.epub_template)
-            if not template_epub.is_absolute():
-                if (here / template_epub).exists():
-                    template_epub = here / template_epub
-                elif (here / "sample.epub").exists():
-                    template_epub = here / "sample.epub"
-            
-            if not template_epub.exists():
-                print(f"⚠️  Предупреждение: шаблон EPUB не найден: {template_epub}")
-            else:
-                # Санитизируем имя файла для Windows (убираем недопустимые символы)
-                safe_title = re.sub(r'[<>:"/\\|?*]', '_', args.title)
-                safe_title = safe_title.replace(' ', '_')
-                output_epub = outdir / f"{safe_title}.epub"
-                epub_cmd = [
-                    sys.executable,
-                    str(here / "generate_epub.py"),
-                    "--template", str(template_epub),
-                    "--in", str(epub_source),
-                    "--out", str(output_epub),
-                    "--title", args.title,
-                    "--max-chapter-size", str(args.epub_max_chapter_size),
-                ]
-                if args.author:
-                    epub_cmd.extend(["--author", args.author])
-                if args.cover_colors:
-                    epub_cmd.extend(["--cover-colors", args.cover_colors])
-                if args.epub_use_chapter_heads:
-                    epub_cmd.append("--use-chapter-heads")
-                
-                if not run_cmd(epub_cmd, f"Этап 8: Генерация EPUB"):
-                    return 1
-                
-                # Проверяем, создался ли EPUB
-                if output_epub.exists():
-                    print("\n" + "=" * 80)
-                    print("✅ EPUB УСПЕШНО СОЗДАН!")
-                    print("=" * 80)
-                    print(f"  📚 {output_epub}")
-                    print("=" * 80)
-    
-    print("\n" + "=" * 80)
-    print("✅ ОБРАБОТКА ЗАВЕРШЕНА")
-    print("=" * 80)
-    print(f"Результаты в папке: {outdir}")
-    
-    # Показываем созданные файлы
-    print("\nСозданные файлы:")
-    for pattern in ["*.txt", "*.html", "*.json", "*.epub"]:
-        files = list(outdir.glob(pattern))
-        if files:
-            print(f"\n{pattern}:")
-            for f in sorted(files):
-                print(f"  - {f.name}")
-    
+    print_summary(outdir)
     return 0
 
 
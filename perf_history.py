@@ -0,0 +1,212 @@
+"""
+История производительности бенчмарка комбинаций (benchmark_combinations.py).
+
+После каждого прогона бенчмарк дописывает в docs/perf_history.jsonl запись с
+коммитом git, описанием машины, временем/CPU/пиковым RSS каждого этапа и
+качеством базовой и лучшей комбинации. Дашборд (docs/index.html) строит по этому
+файлу графики трендов.
+
+    python perf_history.py list
+    python perf_history.py compare                      # последний прогон против предыдущего
+    python perf_history.py compare --baseline 1a2b3c4 --threshold 15
+
+compare сравнивает записи одной машины и завершается с кодом 1, если время или
+пиковый RSS какого-либо этапа выросли больше чем на --threshold процентов.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_HISTORY = Path(__file__).parent / "docs" / "perf_history.jsonl"
+# Изменения меньше этих величин считаются шумом измерения
+MIN_TIME_DELTA_S = 0.05
+MIN_RSS_DELTA_MB = 5.0
+
+
+def git_commit(repo: Path) -> tuple[str | None, bool]:
+    """Текущий коммит и признак незакоммиченных изменений (None, если не git-репозиторий)."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def machine_info() -> dict:
+    info = {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+    ident = "|".join(str(info[k]) for k in ("hostname", "platform", "processor", "cpu_count"))
+    info["id"] = hashlib.sha256(ident.encode("utf-8")).hexdigest()[:12]
+    return info
+
+
+def summarize_stages(stage_runs) -> dict:
+    """Метрики этапов по выполнениям в прогоне: среднее время и CPU, максимальный пиковый RSS."""
+    by_name: dict[str, list] = {}
+    for run in stage_runs:
+        by_name.setdefault(run["stage"], []).append(run)
+    stages = {}
+    for name, runs in by_name.items():
+        rss = [r["peak_rss_mb"] for r in runs if r.get("peak_rss_mb") is not None]
+        cpu = [r["cpu_s"] for r in runs if r.get("cpu_s") is not None]
+        stages[name] = {
+            "wall_s": round(sum(r["wall_s"] for r in runs) / len(runs), 3),
+            "cpu_s": round(sum(cpu) / len(cpu), 3) if cpu else None,
+            "peak_rss_mb": max(rss) if rss else None,
+            "runs": len(runs),
+        }
+    return stages
+
+
+def make_record(repo: Path, stage_runs, base: dict | None, best: tuple | None, **meta) -> dict:
+    """Запись истории; best — (название комбинации, её метрики)."""
+    commit, dirty = git_commit(repo)
+    quality = {}
+    if base:
+        quality["base"] = {k: base[k] for k in ("similarity", "accuracy", "time")}
+    if best:
+        name, metrics = best
+        quality["best"] = {"combo": name, **{k: metrics[k] for k in ("similarity", "accuracy", "time")}}
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "dirty": dirty,
+        "machine": machine_info(),
+        **meta,
+        "stages": summarize_stages(stage_runs),
+        "quality": quality,
+    }
+
+
+def append_record(path: Path, record: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load_history(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    records = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def select(records: list[dict], ref: str, skip: dict | None = None) -> dict | None:
+    """Запись по ссылке: latest, previous (перед skip) или префикс коммита (последняя такая запись)."""
+    candidates = [r for r in records if r is not skip]
+    if ref in ("latest", "previous"):
+        if ref == "previous" and skip is not None:
+            candidates = candidates[:records.index(skip)]
+        return candidates[-1] if candidates else None
+    matching = [r for r in candidates if (r.get("commit") or "").startswith(ref)]
+    return matching[-1] if matching else None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[dict]:
+    """Строки сравнения этапов; regression=True, если рост больше threshold процентов и выше порога шума."""
+    rows = []
+    for name, cur in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            continue
+        for metric, noise in (("wall_s", MIN_TIME_DELTA_S), ("peak_rss_mb", MIN_RSS_DELTA_MB)):
+            old, new = base.get(metric), cur.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            rows.append({
+                "stage": name,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change_pct": change,
+                "regression": change > threshold and new - old > noise,
+            })
+    return rows
+
+
+def _label(record: dict) -> str:
+    commit = (record.get("commit") or "?")[:10] + ("+" if record.get("dirty") else "")
+    return f"{commit} {record['timestamp']}"
+
+
+def cmd_list(args) -> int:
+    records = load_history(args.history)
+    if not records:
+        print(f"История пуста: {args.history}")
+        return 0
+    for r in records:
+        base = r.get("quality", {}).get("base", {})
+        total = sum(s["wall_s"] for s in r["stages"].values())
+        print(f"{_label(r)}  машина {r['machine']['id']} ({r['machine']['hostname']})  этапы {total:.2f}s"
+              f"  схожесть {base.get('similarity', 0):.2f}%  точность {base.get('accuracy', 0):.2f}%")
+    return 0
+
+
+def cmd_compare(args) -> int:
+    records = load_history(args.history)
+    machine = args.machine or machine_info()["id"]
+    records = [r for r in records if r["machine"]["id"] == machine]
+    current = select(records, args.current)
+    baseline = select(records, args.baseline, skip=current) if current else None
+    if current is None or baseline is None:
+        print(f"Недостаточно записей для машины {machine} в {args.history}")
+        return 2
+    print(f"База:    {_label(baseline)}")
+    print(f"Текущий: {_label(current)}")
+    rows = compare(baseline, current, args.threshold)
+    print(f"\n{'этап':<16} {'метрика':<12} {'база':>10} {'текущий':>10} {'изменение':>10}")
+    for row in rows:
+        mark = "  ⚠️ регрессия" if row["regression"] else ""
+        print(f"{row['stage']:<16} {row['metric']:<12} {row['baseline']:>10.3f} {row['current']:>10.3f} "
+              f"{row['change_pct']:>+9.1f}%{mark}")
+    for key in ("similarity", "accuracy"):
+        old = baseline.get("quality", {}).get("base", {}).get(key)
+        new = current.get("quality", {}).get("base", {}).get(key)
+        if old is not None and new is not None:
+            print(f"{'качество':<16} {key:<12} {old:>10.2f} {new:>10.2f} {new - old:>+9.2f}п")
+    regressions = [r for r in rows if r["regression"]]
+    if regressions:
+        print(f"\nРегрессий: {len(regressions)} (порог {args.threshold:g}%)")
+        return 1
+    print(f"\nРегрессий нет (порог {args.threshold:g}%)")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="История производительности бенчмарка и поиск регрессий.")
+    ap.add_argument("--history", type=Path, default=DEFAULT_HISTORY, help="Файл истории (JSON lines)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Показать записи истории")
+    cmp = sub.add_parser("compare", help="Сравнить прогон с базовым и найти регрессии этапов")
+    cmp.add_argument("--baseline", default="previous", help="Базовый прогон: previous или префикс коммита")
+    cmp.add_argument("--current", default="latest", help="Сравниваемый прогон: latest или префикс коммита")
+    cmp.add_argument("--threshold", type=float, default=10.0, help="Допустимый рост времени и RSS этапа, %% (по умолчанию: 10)")
+    cmp.add_argument("--machine", default="", help="Идентификатор машины (по умолчанию: текущая)")
+    args = ap.parse_args()
+    return cmd_list(args) if args.command == "list" else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+"""
+Выполнение пайплайна PDF → EPUB в одном процессе.
+
+Вместо запуска каждого этапа отдельным интерпретатором функции этапов вызываются
+напрямую, а между ними передаётся один объект PipelineDocument в памяти:
+fitz, natasha и pymorphy2 импортируются один раз, промежуточный JSON/TXT
+не пишется и не читается заново (если не нужен для отладки).
+"""
+import json
+import re
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pipeline_metrics
+from pipeline_metrics import file_sizes, peak_rss_mb
+from progress_events import Progress
+from stage_graph import OUTPUT_LOCK, Stage
+from stage_profile import run_profiled
+
+
+@dataclass
+class PipelineDocument:
+    pdf_path: Path
+    title: str
+    # Структурированные блоки (structured.json → structured_rules.json → structured_tokenized.json)
+    structured: dict | None = None
+    # Блоки после модернизации (final.html) и флаги замен (flags.json)
+    final_blocks: list | None = None
+    flags: list | None = None
+    # Текст для проверок орфографии: final.txt → final_local_spell.txt → final_clean.txt
+    text: str | None = None
+    # final_clean.txt (после LanguageTool) — вход для контекстной проверки и Natasha
+    clean_text: str | None = None
+    # Упоминания Natasha: (источник, типы) → список Mention; общий кэш для проверки и синхронизации
+    mentions: dict = field(default_factory=dict)
+    natasha: object | None = None
+
+
+def _banner(description: str):
+    with OUTPUT_LOCK:
+        print(f"\n{'='*80}")
+        print(description)
+        print(f"{'='*80}")
+
+
+def _write_json(path: Path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def stage_extract(doc: PipelineDocument, args, outdir: Path, write_intermediate: bool):
+    import os
+    from extract_structured_text import (
+        ExtractOptions,
+        ImageExporter,
+        StructuredWriter,
+        document_heading_threshold,
+        extract_document,
+        iter_page_blocks,
+        write_structured,
+    )
+
+    _banner("Этап 1: Извлечение структуры")
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    heading_threshold = None
+    if args.font_stats == "document":
+        heading_threshold = document_heading_threshold(doc.pdf_path, jobs=jobs)
+    opts = ExtractOptions(
+        columns="2" if args.two_columns else args.columns,
+        heading_threshold=heading_threshold,
+        images=args.images,
+        ocr_lang=args.ocr_lang if args.ocr else None,
+        cache_dir=args.extract_cache or None,
+    )
+    if not args.stream_extract:
+        doc.structured = extract_document(doc.pdf_path, outdir, opts, jobs=jobs)
+        print(f"Блоков: {len(doc.structured['blocks'])}")
+        if write_intermediate:
+            write_structured(doc.structured, outdir)
+        return
+    # --stream-extract: страницы PyMuPDF освобождаются сразу, structured.* пишутся постранично.
+    # Блоки остаются в памяти — их получают следующие этапы
+    images = ImageExporter(doc.pdf_path, outdir, jobs=jobs) if opts.images else None
+    writer = StructuredWriter(outdir, doc.pdf_path.name) if write_intermediate else None
+    blocks = []
+    try:
+        for page_blocks in iter_page_blocks(doc.pdf_path, opts, jobs=jobs, low_memory=True):
+            if images is not None:
+                page_blocks = images.resolve(page_blocks)
+            if writer is not None:
+                writer.write_blocks(page_blocks)
+            blocks.extend(page_blocks)
+    finally:
+        if writer is not None:
+            writer.close()
+        if images is not None:
+            images.close()
+            print(f"Images: {len(images.by_hash)} files for {images.placements} placements in {images.dir}")
+    doc.structured = {"file": doc.pdf_path.name, "blocks": blocks}
+    print(f"Блоков: {len(blocks)}")
+
+
+def stage_oldspelling(doc: PipelineDocument, args, here: Path, outdir: Path, write_intermediate: bool):
+    from apply_rules_structured import apply_rules
+    from rule_compiler import load_bundle
+    from rule_lexicon import load_lexicon
+    from rule_profiler import print_summary, profile_rules, report_path
+
+    _banner("Этап 2: Применение правил oldspelling")
+    bundle = load_bundle(here / "oldspelling.py")
+    if args.rule_report:
+        applied, report = profile_rules(doc.structured["blocks"], bundle)
+        _write_json(report_path(outdir / "structured_rules.json"), report)
+        print_summary(report)
+    elif args.oldspelling_lexicon:
+        lexicon = load_lexicon(here / "oldspelling.py", bundle)
+        applied = apply_rules(doc.structured["blocks"], bundle.rules, lexicon=lexicon)
+        print(f"Словарь: {len(lexicon.words)} слов, блоков через план: {lexicon.fallbacks}")
+    else:
+        applied = apply_rules(doc.structured["blocks"], bundle.rules, plan=bundle.plan)
+    doc.structured["rules_applied"] = applied
+    print(f"Замен: {applied}")
+    if write_intermediate:
+        _write_json(outdir / "structured_rules.json", doc.structured)
+
+
+def stage_stanza(doc: PipelineDocument, args, outdir: Path, write_intermediate: bool):
+    from stanza_tokenizer import tokenize_blocks
+
+    _banner("Этап 3: Stanza токенизация")
+    doc.structured["blocks"] = tokenize_blocks(doc.structured["blocks"], args.stanza_model)
+    if write_intermediate:
+        _write_json(outdir / "structured_tokenized.json", doc.structured)
+
+
+def stage_modernize(doc: PipelineDocument, outdir: Path, write_intermediate: bool):
+    from modernize_structured import modernize_blocks, plain_text, render_html
+
+    _banner("Этап 4: Модернизация орфографии")
+    doc.final_blocks, doc.flags = modernize_blocks(doc.structured["blocks"])
+    doc.text = plain_text(doc.final_blocks)
+    (outdir / "final.html").write_text(render_html(doc.final_blocks, doc.title), encoding="utf-8")
+    (outdir / "final.txt").write_text(doc.text, encoding="utf-8")
+    if write_intermediate:
+        _write_json(outdir / "flags.json", doc.flags)
+    print(f"Saved: final.html, final.txt in {outdir}")
+
+
+def stage_local_spell(doc: PipelineDocument, args, outdir: Path, write_intermediate: bool):
+    from local_spell_checker import checker_kwargs, create_spell_checker, run_local_spell_check, to_html
+
+    _banner("Этап 5: Локальная проверка орфографии")
+    model = args.local_spell_model or None
+    if args.local_spell_type == "jamspell" and not model:
+        print("Ошибка: для jamspell требуется --local-spell-model")
+        return
+    kwargs = checker_kwargs(
+        args.local_spell_type,
+        lang=args.local_spell_lang,
+        model_path=model if args.local_spell_type in ("jamspell", "auto") else None,
+        dictionary_path=model if args.local_spell_type == "symspell" else None,
+    )
+    try:
+        checker = create_spell_checker(args.local_spell_type, **kwargs)
+    except Exception as e:
+        print(f"Ошибка создания проверщика: {e}")
+        return
+    doc.text, stats = run_local_spell_check(doc.text, checker)
+    print(f"Применено исправлений: {sum(stats.values())}")
+    if write_intermediate:
+        (outdir / "final_local_spell.txt").write_text(doc.text, encoding="utf-8")
+        (outdir / "final_local_spell.html").write_text(to_html(doc.text, args.title + " (Local Spell)"), encoding="utf-8")
+
+
+def stage_lt(doc: PipelineDocument, args, outdir: Path):
+    from lt_cloud import LanguageToolChecker, run_spell_pipeline, to_html
+
+    _banner("Этап 6: LanguageTool проверка")
+    doc.text, stats = run_spell_pipeline(
+        doc.text,
+        [LanguageToolChecker(lang="ru-RU", timeout=60)],
+        chunk_size=args.chunk_size,
+        sleep=0.5,
+    )
+    doc.clean_text = doc.text
+    (outdir / "final_clean.txt").write_text(doc.clean_text, encoding="utf-8")
+    (outdir / "final_clean.html").write_text(to_html(doc.clean_text, args.title + " (LT)"), encoding="utf-8")
+    print(f"Applied safe fixes: {sum(stats.values())}. Saved final_clean.txt/html in {outdir}")
+
+
+def _clean_text(doc: PipelineDocument, outdir: Path) -> str | None:
+    """final_clean.txt: из памяти, если LanguageTool выполнялся в этом запуске, иначе с диска."""
+    if doc.clean_text is None:
+        path = outdir / "final_clean.txt"
+        if path.exists():
+            doc.clean_text = path.read_text(encoding="utf-8", errors="ignore")
+    return doc.clean_text
+
+
+def stage_context(doc: PipelineDocument, args, outdir: Path):
+    from context_checker import analyze_text, write_warnings
+    from pymorphy2 import MorphAnalyzer
+
+    clean_text = _clean_text(doc, outdir)
+    if clean_text is None:
+        print("⚠️  Предупреждение: final_clean.txt не найден — контекстная проверка пропущена")
+        return
+    _banner("Этап 7: Контекстная проверка")
+    pronouns = set(tok.strip().lower() for tok in args.context_pronouns.split(",") if tok.strip())
+    write_warnings(analyze_text(clean_text, pronouns, MorphAnalyzer()), outdir / args.context_out)
+
+
+def _mentions(doc: PipelineDocument, allowed, stage: str):
+    """Упоминания сущностей в PDF и в чистом тексте с одним экземпляром Natasha на весь запуск.
+
+    Проходы, которых ещё нет в doc.mentions, идут под одной шкалой прогресса этапа (в символах).
+    """
+    from natasha_entity_check import NatashaPipeline, collect_mentions, load_pdf_text
+
+    keys = {source: (source, tuple(allowed)) for source in ("pdf", "clean")}
+    texts = {source: load_pdf_text(doc.pdf_path) if source == "pdf" else doc.clean_text
+             for source, key in keys.items() if key not in doc.mentions}
+    if texts:
+        if doc.natasha is None:
+            doc.natasha = NatashaPipeline()
+        with Progress(stage, sum(map(len, texts.values())), "chars") as progress:
+            for source, text in texts.items():
+                doc.mentions[keys[source]] = collect_mentions(text, allowed, pipeline=doc.natasha, progress=progress)
+    return doc.mentions[keys["pdf"]], doc.mentions[keys["clean"]]
+
+
+def stage_natasha_check(doc: PipelineDocument, args, outdir: Path):
+    from natasha_entity_check import build_summary, format_report, parse_types
+
+    if _clean_text(doc, outdir) is None:
+        return
+    _banner("Natasha проверка именованных сущностей")
+    allowed = parse_types(args.natasha_types)
+    pdf_missing, clean_missing = build_summary(*_mentions(doc, allowed, "natasha_check"))
+    (outdir / args.natasha_out).write_text(format_report(pdf_missing, clean_missing), encoding="utf-8")
+    print(f"Сравнение готово, {len(pdf_missing)} сущностей потеряно, {len(clean_missing)} добавлено.")
+
+
+def stage_natasha_sync(doc: PipelineDocument, args, outdir: Path):
+    from natasha_entity_check import parse_types
+    from natasha_sync import apply_replacements, build_replacements, format_sync_report
+
+    if _clean_text(doc, outdir) is None:
+        return
+    _banner("Natasha синхронизация именованных сущностей")
+    allowed = parse_types(args.natasha_types)
+    replacements = build_replacements(*_mentions(doc, allowed, "natasha_sync"))
+    doc.clean_text, applied = apply_replacements(doc.clean_text, replacements)
+    doc.text = doc.clean_text
+    (outdir / "final_clean.txt").write_text(doc.clean_text, encoding="utf-8")
+    (outdir / args.natasha_sync_report).write_text(format_sync_report(applied), encoding="utf-8")
+    print(f"Гармонизация выполнена, замен: {len(applied)}")
+
+
+def epub_path(outdir: Path, title: str) -> Path:
+    safe_title = re.sub(r'[<>:"/\\|?*]', '_', title).replace(' ', '_')
+    return outdir / f"{safe_title}.epub"
+
+
+def _valid_text(text: str | None) -> bool:
+    # Те же требования, что и к TXT-источнику в pdf_to_epub.py: не меньше 50 символов и есть буквы
+    content = (text or "").strip()
+    return len(content) >= 50 and any(c.isalpha() for c in content)
+
+
+def stage_epub(doc: PipelineDocument, args, here: Path, outdir: Path):
+    from generate_epub import generate_epub, insert_image_blocks, load_blocks_from_text, parse_cover_colors_arg
+    from modernize_structured import plain_text
+
+    # Приоритет источников как в pdf_to_epub.py: final_clean → final → структурированные блоки
+    blocks = None
+    final_text = plain_text(doc.final_blocks) if doc.final_blocks is not None else None
+    for text in (_clean_text(doc, outdir), final_text):
+        if _valid_text(text):
+            blocks = load_blocks_from_text(text)
+            if args.images and doc.structured:
+                blocks = insert_image_blocks(blocks, doc.structured["blocks"])
+            break
+    if blocks is None and doc.structured and any((b.get("text") or "").strip() for b in doc.structured["blocks"]):
+        blocks = doc.structured["blocks"]
+    if not blocks:
+        print("⚠️  Предупреждение: нет текста для генерации EPUB")
+        return None
+
+    template_epub = Path(args.epub_template)
+    if not template_epub.is_absolute():
+        if (here / template_epub).exists():
+            template_epub = here / template_epub
+        elif (here / "sample.epub").exists():
+            template_epub = here / "sample.epub"
+    if not template_epub.exists():
+        print(f"⚠️  Предупреждение: шаблон EPUB не найден: {template_epub}")
+        return None
+
+    _banner("Этап 8: Генерация EPUB")
+    output_epub = epub_path(outdir, args.title)
+    cover_colors = parse_cover_colors_arg(args.cover_colors) if args.cover_colors else None
+    generate_epub(
+        template_epub,
+        blocks,
+        output_epub,
+        args.title,
+        args.author,
+        cover_colors=cover_colors,
+        max_chapter_size_kb=args.epub_max_chapter_size,
+        image_root=outdir,
+    )
+    return output_epub
+
+
+def doc_sizes(doc: PipelineDocument, names) -> dict:
+    """Размеры входов/выходов этапа для pipeline_metrics.json: поля документа и файлы."""
+    result = {}
+    for name in names:
+        if isinstance(name, Path):
+            result.update(file_sizes([name]))
+            continue
+        value = getattr(doc, name[len("doc."):], None)
+        if isinstance(value, str):
+            result[name] = {"chars": len(value)}
+        elif value is not None:
+            blocks = value["blocks"] if isinstance(value, dict) else value
+            result[name] = {"blocks": len(blocks), "chars": sum(len(b.get("text") or "") for b in blocks)}
+    return result
+
+
+def _measured(stage: Stage, func, trace: bool) -> bool:
+    """Выполнить этап в текущем потоке и записать его CPU-время, память и счётчики.
+
+    Пиковый RSS и пик tracemalloc — общие для процесса: при одновременных этапах они
+    включают память соседних этапов.
+    """
+    counters = pipeline_metrics.begin_thread_counters()
+    cpu = time.thread_time()
+    if trace:
+        tracemalloc.reset_peak()
+    try:
+        func()
+    finally:
+        stage.metrics["cpu_s"] = round(time.thread_time() - cpu, 3)
+        stage.metrics["peak_rss_mb"] = peak_rss_mb()
+        stage.metrics["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3) if trace else None
+        stage.metrics["requests"] = counters.get("requests", 0)
+        pipeline_metrics.end_thread_counters()
+    return True
+
+
+def _epub_done(doc: PipelineDocument, args, here: Path, outdir: Path) -> bool:
+    output_epub = stage_epub(doc, args, here, outdir)
+    if output_epub is not None and output_epub.exists():
+        with OUTPUT_LOCK:
+            print("\n" + "=" * 80)
+            print("✅ EPUB УСПЕШНО СОЗДАН!")
+            print("=" * 80)
+            print(f"  📚 {output_epub}")
+            print("=" * 80)
+    return True
+
+
+def build_stages(args, here: Path, pdf_path: Path, outdir: Path) -> list[Stage]:
+    """Этапы для stage_graph.run_graph; входы и выходы — поля PipelineDocument и файлы."""
+    write_intermediate = not args.no_intermediate
+    doc = PipelineDocument(pdf_path=pdf_path, title=args.title)
+    stages = []
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    def add(name, title, func, inputs, outputs, required=True):
+        if args.profile:
+            profile_out = Path(args.profile) / f"{name}.pstats"
+            stage_func = lambda: run_profiled(func, profile_out, args.profile_top, name)
+        else:
+            stage_func = func
+        stage = Stage(name, lambda: _measured(stage, stage_func, args.tracemalloc), tuple(inputs), tuple(outputs),
+                      required=required, title=title, measure=lambda paths: doc_sizes(doc, paths))
+        stages.append(stage)
+
+    add("extract", "Извлечение структуры из PDF",
+        lambda: stage_extract(doc, args, outdir, write_intermediate), [pdf_path], ["doc.structured"])
+    if not args.no_oldspelling:
+        add("oldspelling", "Применение правил старой орфографии",
+            lambda: stage_oldspelling(doc, args, here, outdir, write_intermediate), ["doc.structured"],
+            ["doc.structured"] + ([outdir / "structured_rules.rule_report.json"] if args.rule_report else []))
+    if args.stanza_tokenize and args.stanza_model:
+        add("stanza", "Stanza токенизация",
+            lambda: stage_stanza(doc, args, outdir, write_intermediate), ["doc.structured"], ["doc.structured"])
+    add("modernize", "Модернизация орфографии",
+        lambda: stage_modernize(doc, outdir, write_intermediate), ["doc.structured"], ["doc.final_blocks", "doc.text"])
+    if args.local_spell:
+        add("local_spell", f"Локальная проверка орфографии ({args.local_spell_type})",
+            lambda: stage_local_spell(doc, args, outdir, write_intermediate), ["doc.text"], ["doc.text"])
+    if args.lt_cloud:
+        add("lt_cloud", "LanguageTool проверка",
+            lambda: stage_lt(doc, args, outdir), ["doc.text"], ["doc.text", "doc.clean_text"])
+    if args.context_check:
+        add("context", "Контекстная проверка",
+            lambda: stage_context(doc, args, outdir), ["doc.clean_text"], [outdir / args.context_out])
+    if args.natasha_check:
+        add("natasha_check", "Natasha проверка именованных сущностей",
+            lambda: stage_natasha_check(doc, args, outdir), [pdf_path, "doc.clean_text"],
+            [outdir / args.natasha_out], required=False)
+    if args.natasha_sync:
+        add("natasha_sync", "Natasha синхронизация именованных сущностей",
+            lambda: stage_natasha_sync(doc, args, outdir), [pdf_path, "doc.clean_text"],
+            ["doc.clean_text", outdir / args.natasha_sync_report], required=False)
+    if args.epub_template:
+        add("epub", "Генерация EPUB", lambda: _epub_done(doc, args, here, outdir),
+            ["doc.structured", "doc.final_blocks", "doc.clean_text"], [epub_path(outdir, args.title)])
+    return stages
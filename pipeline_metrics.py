@@ -0,0 +1,172 @@
+"""
+Метрики этапов пайплайна: время, CPU, пиковая память и размеры входов/выходов.
+
+pdf_to_epub.py запускает каждый скрипт этапа через этот модуль:
+
+    python pipeline_metrics.py --out metrics.json [--tracemalloc] script.py [args...]
+
+Скрипт выполняется в том же процессе (runpy), после чего в --out пишутся
+CPU-время и пиковый RSS (самого процесса и его дочерних процессов, например
+пула извлечения страниц), пик tracemalloc и счётчики, которые этап увеличивал
+через count() (например, число HTTP-запросов к LanguageTool).
+"""
+import argparse
+import json
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:  # Windows
+    HAS_RESOURCE = False
+
+_counters: dict[str, int] = {}
+_local = threading.local()
+
+
+def count(name: str, n: int = 1):
+    """Увеличить счётчик текущего этапа (в режиме --in-process — этапа текущего потока)."""
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _counters
+    counters[name] = counters.get(name, 0) + n
+
+
+def begin_thread_counters() -> dict:
+    """Отдельные счётчики для этапа, выполняемого в текущем потоке."""
+    _local.counters = {}
+    return _local.counters
+
+
+def end_thread_counters():
+    _local.counters = None
+
+
+def _maxrss_mb(usage) -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss * scale / (1024 * 1024), 1)
+
+
+def rusage_self_and_children() -> dict:
+    """CPU-время (user+sys) и пиковый RSS процесса вместе с завершёнными дочерними процессами."""
+    if not HAS_RESOURCE:
+        return {"cpu_s": round(time.process_time(), 3), "peak_rss_mb": None}
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_s": round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3),
+        "peak_rss_mb": max(_maxrss_mb(own), _maxrss_mb(children)),
+    }
+
+
+def peak_rss_mb() -> float | None:
+    """Пиковый RSS текущего процесса (максимум за всё время его работы)."""
+    if not HAS_RESOURCE:
+        return None
+    return _maxrss_mb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def _mb(n: int) -> float:
+    return round(n / (1024 * 1024), 3)
+
+
+# (путь, mtime_ns, размер) → размеры; выход одного этапа — вход следующего
+_size_cache: dict = {}
+
+
+def _file_size(f: Path) -> dict:
+    st = f.stat()
+    key = (str(f), st.st_mtime_ns, st.st_size)
+    if key not in _size_cache:
+        sizes = {"bytes": st.st_size}
+        if f.suffix == ".txt":
+            sizes["chars"] = len(f.read_text(encoding="utf-8", errors="replace"))
+        elif f.suffix == ".json":
+            try:
+                blocks = json.loads(f.read_text(encoding="utf-8")).get("blocks")
+            except (ValueError, AttributeError, UnicodeDecodeError):
+                blocks = None
+            if isinstance(blocks, list):
+                sizes["blocks"] = len(blocks)
+                sizes["chars"] = sum(len(b.get("text") or "") for b in blocks)
+        _size_cache[key] = sizes
+    return _size_cache[key]
+
+
+def file_sizes(paths) -> dict:
+    """Размеры по файлам: байты, для TXT — символы, для JSON с блоками — число блоков и символов.
+
+    Папка (например, images) описывается числом файлов и суммой байт.
+    """
+    result = {}
+    for path in map(Path, paths):
+        try:
+            if path.is_dir():
+                files = [f for f in path.rglob("*") if f.is_file()]
+                result[path.name] = {"files": len(files), "bytes": sum(f.stat().st_size for f in files)}
+            elif path.exists():
+                result[path.name] = _file_size(path)
+        except OSError:
+            continue
+    return result
+
+
+def run_script(script: str, argv: list[str], out: Path, trace: bool = False) -> int:
+    """Выполнить скрипт этапа как __main__ и записать его метрики в out."""
+    if trace:
+        tracemalloc.start()
+    sys.argv = [script] + argv
+    code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        report = rusage_self_and_children()
+        report["tracemalloc_peak_mb"] = _mb(tracemalloc.get_traced_memory()[1]) if trace else None
+        report["counters"] = dict(_counters)
+        Path(out).write_text(json.dumps(report, ensure_ascii=False), encoding="utf-8")
+    return code
+
+
+def read_report(path: Path) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_metrics(path: Path, stages, wall: float, critical: list[str], **meta):
+    """pipeline_metrics.json: общие сведения о запуске и метрики каждого выполненного этапа."""
+    data = dict(meta)
+    data["wall_s"] = round(wall, 3)
+    data["critical_path"] = critical
+    data["stages"] = [
+        {"name": s.name, "status": "cached" if s.cached else "ok" if s.ok else "error", **s.metrics}
+        for s in stages if s.start is not None
+    ]
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Запустить скрипт этапа и записать его метрики (CPU, память, счётчики).")
+    ap.add_argument("--out", required=True, help="JSON с метриками")
+    ap.add_argument("--tracemalloc", action="store_true", help="Измерять пик выделенной Python-памяти (замедляет этап)")
+    ap.add_argument("script", help="Скрипт этапа")
+    ap.add_argument("args", nargs=argparse.REMAINDER, help="Аргументы скрипта")
+    args = ap.parse_args()
+    argv = args.args[1:] if args.args[:1] == ["--"] else args.args
+    return run_script(args.script, argv, Path(args.out), trace=args.tracemalloc)
+
+
+if __name__ == "__main__":
+    # Счётчики, которые увеличивают скрипты этапов через `import pipeline_metrics`,
+    # живут в импортированном модуле, а не в __main__
+    import pipeline_metrics
+    sys.exit(pipeline_metrics.main())
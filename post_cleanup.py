@@ -3,6 +3,8 @@ import re
 from pathlib import Path
 from html import escape as hesc
 
+from stage_profile import add_profile_args, profiled_main
+
 
 LAT_TO_CYR = {
     "A": "А", "a": "а",
@@ -113,12 +115,14 @@ def to_html(text: str, title: str) -> str:
     )
 
 
+@profiled_main
 def main():
     ap = argparse.ArgumentParser(description="Post-cleanup: join spaced letters, fix intraword gaps, Latin→Cyr mix. Saves TXT/HTML.")
     ap.add_argument("--in", dest="inp", required=True, help="Входной TXT")
     ap.add_argument("--out", dest="out", required=True, help="Выходной TXT")
     ap.add_argument("--html", dest="html", help="Необязательный путь для HTML")
     ap.add_argument("--title", default="После доп. очистки", help="Заголовок HTML")
+    add_profile_args(ap)
     args = ap.parse_args()
 
     src = Path(args.inp)
@@ -0,0 +1,183 @@
+"""
+Поток событий о ходе выполнения этапов (JSON lines).
+
+Этап сообщает о ходе работы через Progress:
+
+    progress = Progress("extract", total=page_count, unit="pages")
+    for ...:
+        ...
+        progress.advance()
+    progress.close()
+
+Если переменная окружения PIPELINE_PROGRESS не задана, Progress ничего не делает.
+Иначе события дописываются строками JSON в файл (PIPELINE_PROGRESS=путь) или в
+открытый файловый дескриптор (PIPELINE_PROGRESS=fd:N). Событие:
+
+    {"ts": 1700000000.0, "pid": 123, "stage": "extract", "event": "progress",
+     "unit": "pages", "done": 40, "total": 300, "rate": 12.5, "elapsed_s": 3.2, "eta_s": 20.8}
+
+event — "start", "progress" (не чаще раза в MIN_INTERVAL секунд) или "end".
+pdf_to_epub.py пишет события всех этапов в <outdir>/progress.jsonl и печатает
+по ним общую сводку (ProgressMonitor).
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+ENV_VAR = "PIPELINE_PROGRESS"
+MIN_INTERVAL = 0.5
+
+_lock = threading.Lock()
+_files: dict[str, object] = {}
+
+
+def _emit(event: dict):
+    target = os.environ.get(ENV_VAR)
+    if not target:
+        return
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    with _lock:
+        if target.startswith("fd:"):
+            os.write(int(target[3:]), line.encode("utf-8"))
+            return
+        f = _files.get(target)
+        if f is None:
+            f = _files[target] = open(target, "a", encoding="utf-8")
+        f.write(line)
+        f.flush()
+
+
+class Progress:
+    """Счётчик выполненных единиц работы этапа с оценкой скорости и оставшегося времени."""
+
+    def __init__(self, stage: str, total: int | None, unit: str):
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = time.perf_counter()
+        self._last = 0.0
+        self._send("start")
+
+    def _send(self, event: str):
+        if not os.environ.get(ENV_VAR):
+            return
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if self.total is not None and rate > 0 else None
+        _emit({
+            "ts": round(time.time(), 3),
+            "pid": os.getpid(),
+            "stage": self.stage,
+            "event": event,
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "rate": round(rate, 3),
+            "elapsed_s": round(elapsed, 3),
+            "eta_s": round(eta, 1) if eta is not None else None,
+        })
+
+    def advance(self, n: int = 1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self._last >= MIN_INTERVAL or (self.total is not None and self.done >= self.total):
+            self._last = now
+            self._send("progress")
+
+    def close(self):
+        self._send("end")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}с"
+    if seconds < 3600:
+        return f"{seconds // 60}м{seconds % 60:02d}с"
+    return f"{seconds // 3600}ч{seconds % 3600 // 60:02d}м"
+
+
+class ProgressMonitor:
+    """Читает файл событий и периодически печатает общую сводку по всем этапам.
+
+    stages — список stage_graph.Stage: по нему считается доля завершённых этапов.
+    """
+
+    def __init__(self, path: Path, stages, interval: float = 5.0, lock=None):
+        self.path = Path(path)
+        self.stages = stages
+        self.interval = interval
+        self.lock = lock or threading.Lock()
+        self.latest: dict[str, dict] = {}
+        self._offset = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self.started = time.perf_counter()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _read(self) -> bool:
+        if not self.path.exists():
+            return False
+        changed = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.seek(self._offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break  # строка ещё дописывается
+                self._offset = f.tell()
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self.latest[event["stage"]] = event
+                changed = True
+        return changed
+
+    def summary(self) -> str:
+        parts = []
+        fraction = 0.0
+        for stage in self.stages:
+            if stage.end is not None:
+                fraction += 1
+                continue
+            if stage.start is None:
+                continue
+            event = self.latest.get(stage.name)
+            if event is None or event["event"] == "end":
+                parts.append(stage.name)
+                continue
+            total = event["total"]
+            if total:
+                fraction += min(event["done"] / total, 1.0)
+                parts.append(f"{stage.name} {event['done']}/{total} {event['unit']}"
+                             f" ({event['rate']:.1f}/с, ~{_duration(event['eta_s'])})")
+            else:
+                parts.append(f"{stage.name} {event['done']} {event['unit']}")
+        share = fraction / len(self.stages) if self.stages else 0.0
+        elapsed = time.perf_counter() - self.started
+        eta = elapsed * (1 - share) / share if share > 0 else None
+        return f"⏳ {share:.0%} ({_duration(elapsed)}, осталось ~{_duration(eta)}): " + " | ".join(parts)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._read():
+                with self.lock:
+                    print(self.summary(), flush=True)
@@ -0,0 +1,747 @@
+"""
+Компилятор правил oldspelling: последовательность re.sub-правил превращается в
+короткий план проходов с тем же результатом.
+
+Правила применяются по порядку, каждое — полным проходом по тексту. Компилятор:
+
+- выбрасывает мёртвые правила — их обязательный символ уже удалён предыдущим
+  однобуквенным правилом и с тех пор не мог появиться снова (например, 'ъ.'
+  после 'ъ' → '');
+- сливает однобуквенные правила ('ѣ' → 'е', 'ъ' → '') в один шаг замены символов;
+- объединяет независимые буквальные правила (допускается '.' как «любой символ»,
+  как и в исходном regex) в один проход по регулярному выражению-дереву
+  префиксов. Правило добавляется в группу, только если его вхождения могут
+  пересекаться с вхождениями правил группы лишь там, где те начинаются не правее,
+  а замены группы не создают его вхождений, — тогда один проход с выбором самого
+  левого вхождения даёт тот же текст, что и проходы по очереди. Правило может подняться к более
+  ранней группе, если оно перестановочно со всеми правилами между ними;
+- настоящие регулярные выражения (группы, классы, якоря) остаются отдельными
+  проходами на своих местах.
+
+Каждому проходу выводится триггер — подстроки (самые редкие тройки символов из
+обязательных литералов образцов) или символы, без которых ни одно его правило не
+сработает. Для блока текста триггеры находятся одним проходом, и запускаются
+только проходы, чей триггер в нём есть; на книгах в современной орфографии это
+обычно один-два прохода из семидесяти.
+
+Проверка эквивалентности сравнивает скомпилированный план с последовательным
+применением на корпусе: текстах из аргументов и синтетических строках из
+образцов и замен самих правил, где правила взаимодействуют чаще всего:
+
+    python rule_compiler.py --rules oldspelling.py docs/karp.txt out/structured.json
+"""
+import argparse
+import ast
+import json
+import os
+import pickle
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from stage_cache import file_digest
+
+try:
+    import re._parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+# Версия формата пакета правил; пакет также пересобирается при изменении кода компилятора
+BUNDLE_VERSION = 2
+# Символы русского текста от самых частых к редким (заглавные буквы считаются реже строчных);
+# по ним для каждого правила выбирается самый редкий обязательный символ — его триггер
+FREQUENT_CHARS = " ,.-оеаинтсрвлкмдпуяыьгзбчйхжшюцщэфъё"
+# Классы [...] шире этого числа символов в триггеры не идут
+MAX_CLASS_CHARS = 64
+# Длина подстрок-триггеров: все одной длины, чтобы один проход находил каждое их вхождение
+TRIGGER_LENGTH = 3
+# Символы, с которыми образец уже не буквальный ('.' обрабатывается отдельно как «любой символ»)
+REGEX_METACHARS = set("\\^$*+?{}[]|()")
+ANY = None  # позиция образца '.', совпадает с любым символом, кроме перевода строки
+_END = object()
+
+
+def pattern_tokens(pattern: str) -> list | None:
+    """Позиции буквального образца (символ или ANY); None — образец не буквальный."""
+    if not pattern or REGEX_METACHARS & set(pattern):
+        return None
+    return [ANY if ch == "." else ch for ch in pattern]
+
+
+def _char_class(items) -> frozenset | None:
+    """Символы класса [...]; None, если класс отрицательный, с категориями или слишком широкий."""
+    chars = set()
+    for op, arg in items:
+        if op is sre_parse.LITERAL:
+            chars.add(chr(arg))
+        elif op is sre_parse.RANGE and arg[1] - arg[0] < MAX_CLASS_CHARS:
+            chars.update(map(chr, range(arg[0], arg[1] + 1)))
+        else:
+            return None
+    return frozenset(chars) if len(chars) <= MAX_CLASS_CHARS else None
+
+
+def required_clauses(pattern: str) -> list[frozenset]:
+    """Условия на символы, без которых образец не может совпасть: в тексте есть хотя бы
+    один символ из каждого множества (литерал — множество из одного символа, класс [...]
+    — его символы, альтернатива — объединение условий ветвей).
+
+    Учитываются только обязательные части образца; для образцов без учёта регистра
+    условий нет.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+
+    def walk(items) -> list[frozenset]:
+        clauses = []
+        for op, arg in items:
+            if op is sre_parse.LITERAL:
+                clauses.append(frozenset(chr(arg)))
+            elif op is sre_parse.IN:
+                chars = _char_class(arg)
+                if chars is not None:
+                    clauses.append(chars)
+            elif op is sre_parse.SUBPATTERN:
+                if arg[1] & re.IGNORECASE:
+                    continue
+                clauses += walk(arg[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+                clauses += walk(arg[2])
+            elif op is sre_parse.BRANCH:
+                branches = [walk(branch) for branch in arg[1]]
+                if all(branches):
+                    clauses.append(frozenset().union(*(min(b, key=_clause_cost) for b in branches)))
+        return clauses
+
+    return walk(parsed)
+
+
+def required_chars(pattern: str) -> set[str]:
+    """Символы, без которых образец не может совпасть (литералы вне альтернатив и необязательных частей)."""
+    return {ch for clause in required_clauses(pattern) if len(clause) == 1 for ch in clause}
+
+
+def _char_cost(ch: str) -> int:
+    """Насколько часто символ встречается в русском тексте: чем меньше, тем реже."""
+    position = FREQUENT_CHARS.find(ch.lower())
+    if position < 0:
+        return 0
+    cost = len(FREQUENT_CHARS) - position
+    return cost if ch == ch.lower() else cost // 4
+
+
+def _clause_cost(clause: frozenset) -> int:
+    return sum(_char_cost(ch) for ch in clause)
+
+
+def required_literals(pattern: str) -> list[str]:
+    """Подстроки, которые входят в каждое совпадение образца (цепочки обязательных литералов)."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    if parsed.state.flags & re.IGNORECASE:
+        return []
+    runs = []
+
+    def walk(items):
+        run = ""
+        for op, arg in items:
+            if op is sre_parse.LITERAL:
+                run += chr(arg)
+                continue
+            if run:
+                runs.append(run)
+                run = ""
+            if op is sre_parse.SUBPATTERN and not arg[1] & re.IGNORECASE:
+                walk(arg[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+                walk(arg[2])
+        if run:
+            runs.append(run)
+
+    walk(parsed)
+    return runs
+
+
+def trigger_keys(runs: list[str], clauses: list[frozenset]) -> frozenset | None:
+    """Триггер правила: ключи, хотя бы один из которых должен быть в тексте, чтобы правило сработало.
+
+    Ключ — самая редкая подстрока длины TRIGGER_LENGTH из обязательных литералов, а
+    если их нет — самое избирательное условие на символы. None — триггера нет,
+    правило запускается всегда.
+    """
+    grams = [run[i:i + TRIGGER_LENGTH] for run in runs for i in range(len(run) - TRIGGER_LENGTH + 1)]
+    if grams:
+        return frozenset([min(grams, key=lambda gram: sum(map(_char_cost, gram)))])
+    return min(clauses, key=_clause_cost) if clauses else None
+
+
+def _compatible(a, b) -> bool:
+    if a is ANY and b is ANY:
+        return True
+    if a is ANY:
+        return b != "\n"
+    if b is ANY:
+        return a != "\n"
+    return a == b
+
+
+def overlaps(x: list, y: list, shifts: range | None = None) -> bool:
+    """Могут ли вхождения x и y в тексте пересекаться (включая вложение одного в другое).
+
+    shifts ограничивает, на сколько позиций начало y может отстоять от начала x
+    (по умолчанию — любое пересечение). Пустая строка (удаление) считается
+    пересекающейся со всем: удаление склеивает соседние символы и может создать
+    вхождение любого образца длиннее символа.
+    """
+    if not x or not y:
+        return True
+    for shift in shifts if shifts is not None else range(-(len(y) - 1), len(x)):
+        lo, hi = max(0, shift), min(len(x), shift + len(y))
+        if all(_compatible(x[i], y[i - shift]) for i in range(lo, hi)):
+            return True
+    return False
+
+
+@dataclass
+class LiteralRule:
+    index: int
+    pattern: str
+    repl: str
+    tokens: list
+
+    @property
+    def repl_tokens(self) -> list:
+        return list(self.repl)
+
+
+def _independent(first: LiteralRule, second: LiteralRule) -> bool:
+    """second можно применять в одном проходе с first (first по порядку раньше).
+
+    Проход берёт самое левое вхождение, а в одной позиции — правило, которое раньше
+    по порядку. Поэтому вхождения могут пересекаться, только если first начинается
+    не правее second: тогда и при проходах по очереди first срабатывает первым и
+    разрушает вхождение second. Замена first не должна создавать вхождений second.
+    """
+    return (not overlaps(second.tokens, first.tokens, range(1, len(second.tokens)))
+            and not overlaps(first.repl_tokens, second.tokens))
+
+
+def _commutes(earlier: LiteralRule, later: LiteralRule) -> bool:
+    """Порядок двух правил не влияет на результат."""
+    return (not overlaps(earlier.tokens, later.tokens) and not overlaps(earlier.repl_tokens, later.tokens)
+            and not overlaps(later.repl_tokens, earlier.tokens))
+
+
+@dataclass
+class TranslateStep:
+    """Однобуквенные правила, сведённые в одну таблицу замен символов.
+
+    Таблица — композиция правил (символ → итоговая строка), по ней план видит, каких
+    символов после шага заведомо нет. Применяется шаг цепочкой str.replace в порядке
+    правил: для кириллицы str.translate в CPython идёт по медленному пути и примерно
+    в 20 раз медленнее нескольких str.replace, а результат тот же.
+    """
+    table: dict[str, str] = field(default_factory=dict)
+    chain: list[tuple[str, str]] = field(default_factory=list)
+    rules: list[int] = field(default_factory=list)
+
+    def add(self, index: int, char: str, repl: str):
+        for key, value in self.table.items():
+            self.table[key] = value.replace(char, repl)
+        self.table.setdefault(char, repl)
+        self.chain.append((char, repl))
+        self.rules.append(index)
+
+    def commutes_with(self, rule: LiteralRule) -> bool:
+        # '.' совпадает с любым ключом и значением таблицы (перевод строки таблица и так исключает):
+        # текст может не измениться, но число замен по правилам — да
+        if ANY in rule.tokens:
+            return not self.table
+        return all(len(value) == 1 and "\n" not in (key, value) and key not in rule.tokens
+                   and value not in rule.tokens and key not in rule.repl
+                   for key, value in self.table.items())
+
+    def apply(self, text: str) -> tuple[str, int]:
+        total = 0
+        for char, repl in self.chain:
+            n = text.count(char)
+            if n:
+                text = text.replace(char, repl)
+                total += n
+        return text, total
+
+    def trigger(self) -> frozenset:
+        return frozenset(char for char, _ in self.chain)
+
+    def describe(self) -> str:
+        pairs = ", ".join(f"{k!r}→{v!r}" for k, v in self.table.items())
+        return f"translate ({len(self.rules)} правил): {pairs}"
+
+
+@dataclass
+class LiteralStep:
+    """Независимые буквальные правила одним проходом.
+
+    Образцы собираются в дерево префиксов, и регулярное выражение строится по нему:
+    общие префиксы дают движку re быстрый поиск литерала. Ветви узла идут в порядке
+    самого раннего правила в ветви, в конце каждого образца стоит пустая группа —
+    по её номеру находится замена.
+    """
+    members: list[LiteralRule] = field(default_factory=list)
+
+    def can_join(self, rule: LiteralRule) -> bool:
+        return all(_independent(m, rule) for m in self.members) and _trie_order_ok(self.members + [rule])
+
+    def commutes_with(self, rule: LiteralRule) -> bool:
+        return all(_commutes(m, rule) for m in self.members)
+
+    def compile(self):
+        order: list[LiteralRule] = []
+        self.regex = re.compile(_trie_regex(_build_trie(self.members), order))
+        self.repls = [m.repl for m in order]
+
+    def _replace(self, match: re.Match) -> str:
+        return self.repls[match.lastindex - 1]
+
+    def apply(self, text: str) -> tuple[str, int]:
+        return self.regex.subn(self._replace, text)
+
+    def trigger(self) -> frozenset | None:
+        keys = []
+        for m in self.members:
+            runs = "".join("\0" if tok is ANY else tok for tok in m.tokens).split("\0")
+            keys.append(trigger_keys(runs, [frozenset(tok) for tok in m.tokens if tok is not ANY]))
+        return None if None in keys else frozenset().union(*keys)
+
+    @property
+    def rules(self) -> list[int]:
+        return [m.index for m in self.members]
+
+    def describe(self) -> str:
+        return f"literal ({len(self.members)} правил): " + ", ".join(repr(m.pattern) for m in self.members[:6]) + (
+            ", …" if len(self.members) > 6 else "")
+
+
+def _build_trie(members: list[LiteralRule]) -> dict:
+    """Дерево префиксов: токен → поддерево, _END → правило, чей образец здесь кончается."""
+    trie: dict = {}
+    for m in members:
+        node = trie
+        for tok in m.tokens:
+            node = node.setdefault(tok, {})
+        node.setdefault(_END, m)  # повтор образца никогда не сработает: его вхождения берёт первое правило
+    return trie
+
+
+def _first_rule(node) -> int:
+    if isinstance(node, LiteralRule):
+        return node.index
+    return min(_first_rule(child) for child in node.values())
+
+
+def _trie_regex(node: dict, order: list) -> str:
+    """Регулярное выражение по дереву; order получает правила в порядке их пустых групп."""
+    alternatives = []
+    for tok, child in sorted(node.items(), key=lambda item: _first_rule(item[1])):
+        if tok is _END:
+            order.append(child)
+            alternatives.append("()")
+        else:
+            piece = "." if tok is ANY else re.escape(tok)
+            alternatives.append(piece + _trie_regex(child, order))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+def _trie_order_ok(members: list[LiteralRule]) -> bool:
+    """В каждой позиции выражение по дереву должно пробовать образцы в порядке правил.
+
+    Это важно только для образцов, которые могут совпасть в одной и той же позиции:
+    движок re выбирает первую подошедшую ветвь, а при проходах по очереди побеждает
+    более раннее правило.
+    """
+    order: list[LiteralRule] = []
+    _trie_regex(_build_trie(members), order)
+    position = {m.index: i for i, m in enumerate(order)}
+    for a in order:
+        for b in order:
+            if a.index < b.index and position[a.index] > position[b.index] and overlaps(a.tokens, b.tokens, range(0, 1)):
+                return False
+    return True
+
+
+def _words_regex(words: list[str]) -> str:
+    """Регулярное выражение-дерево префиксов для набора строк одной длины."""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+
+    def emit(node: dict) -> str:
+        alternatives = [re.escape(ch) + emit(child) for ch, child in sorted(node.items())]
+        if len(alternatives) <= 1:
+            return "".join(alternatives)
+        return "(?:" + "|".join(alternatives) + ")"
+
+    return emit(trie)
+
+
+@dataclass
+class RegexStep:
+    """Правило с настоящим регулярным выражением: отдельный проход на своём месте."""
+    index: int
+    pattern: str
+    repl: str
+
+    def compile(self):
+        self.regex = re.compile(self.pattern)
+
+    def apply(self, text: str) -> tuple[str, int]:
+        return self.regex.subn(self.repl, text)
+
+    def trigger(self) -> frozenset | None:
+        return trigger_keys(required_literals(self.pattern), required_clauses(self.pattern))
+
+    @property
+    def rules(self) -> list[int]:
+        return [self.index]
+
+    def describe(self) -> str:
+        return f"regex: {self.pattern!r} → {self.repl!r}"
+
+
+@dataclass
+class CompiledRules:
+    steps: list = field(default_factory=list)
+    dead: list[int] = field(default_factory=list)
+    invalid: list[tuple[int, str]] = field(default_factory=list)  # (номер правила, ошибка re)
+    source_count: int = 0
+    # Индекс триггеров: ключ (символ или подстрока) → битовая маска шагов, которым он нужен;
+    # always — шаги без триггера; scanner находит в тексте все подстроки-ключи одним проходом
+    key_index: dict[str, int] = field(default_factory=dict)
+    always: int = 0
+    char_keys: tuple[str, ...] = ()
+    scanner: re.Pattern | None = None
+
+    def build_index(self):
+        self.key_index, self.always = {}, 0
+        for k, step in enumerate(self.steps):
+            trigger = step.trigger()
+            if trigger is None:
+                self.always |= 1 << k
+            for key in trigger or ():
+                self.key_index[key] = self.key_index.get(key, 0) | 1 << k
+        self.char_keys = tuple(key for key in self.key_index if len(key) == 1)
+        grams = [key for key in self.key_index if len(key) > 1]
+        self.scanner = re.compile(f"(?=({_words_regex(grams)}))") if grams else None
+
+    def text_keys(self, text: str) -> set[str]:
+        """Ключи триггеров, которые есть в тексте."""
+        keys = {ch for ch in self.char_keys if ch in text}
+        if self.scanner is not None:
+            keys.update(self.scanner.findall(text))
+        return keys
+
+    def triggered(self, keys: set[str]) -> int:
+        """Битовая маска шагов, чей триггер есть среди ключей."""
+        mask = self.always
+        index = self.key_index
+        for key in index.keys() & keys:
+            mask |= index[key]
+        return mask
+
+    def apply(self, text: str, prefilter: bool = True) -> tuple[str, int]:
+        """Применить план к тексту; возвращает текст и число замен (как сумма re.subn по правилам).
+
+        С prefilter запускаются только шаги, чей триггер есть в тексте: ключи ищутся
+        один раз, а после шага, который что-то заменил, — заново (замена может создать
+        триггер следующих шагов), и к очереди добавляются только более поздние шаги.
+        """
+        total = 0
+        if not prefilter:
+            for step in self.steps:
+                text, n = step.apply(text)
+                total += n
+            return text, total
+        pending = self.triggered(self.text_keys(text))
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            text, n = self.steps[bit.bit_length() - 1].apply(text)
+            if n:
+                total += n
+                pending |= self.triggered(self.text_keys(text)) & -(bit << 1)  # -(bit << 1) — шаги после этого
+        return text, total
+
+    def describe(self) -> str:
+        lines = [f"{self.source_count} правил → {len(self.steps)} проходов "
+                 f"(мёртвых правил: {len(self.dead)}, некорректных: {len(self.invalid)})"]
+        lines += [f"  {i + 1}. {step.describe()}" for i, step in enumerate(self.steps)]
+        return "\n".join(lines)
+
+
+def _place_literal(steps: list, rule: LiteralRule):
+    """Добавить правило в самую позднюю группу, до которой оно может подняться, или новым проходом."""
+    for step in reversed(steps):
+        if not isinstance(step, LiteralStep):
+            break
+        if step.can_join(rule):
+            step.members.append(rule)
+            return
+        if not step.commutes_with(rule):
+            break
+    steps.append(LiteralStep([rule]))
+
+
+def _place_char(steps: list, rule: LiteralRule):
+    """Однобуквенное правило — в ближайшую таблицу translate, если можно подняться к ней через буквальные группы."""
+    char, repl = rule.pattern, rule.repl
+    single = TranslateStep()
+    single.table[char] = repl
+    for step in reversed(steps):
+        if isinstance(step, TranslateStep):
+            step.add(rule.index, char, repl)
+            return
+        if not (isinstance(step, LiteralStep) and all(single.commutes_with(m) for m in step.members)):
+            break
+    step = TranslateStep()
+    step.add(rule.index, char, repl)
+    steps.append(step)
+
+
+def compile_rules(rules: list[tuple[str, str]]) -> CompiledRules:
+    """План проходов для правил [(pattern, repl)] в порядке применения."""
+    compiled = CompiledRules(source_count=len(rules))
+    absent: set[str] = set()  # символы, которых в тексте заведомо уже нет
+    for index, (pattern, repl) in enumerate(rules):
+        tokens = pattern_tokens(pattern)
+        literal = tokens is not None and "\\" not in repl
+        if literal:
+            required = {t for t in tokens if t is not ANY}
+        else:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                compiled.invalid.append((index, str(e)))
+                continue
+            required = required_chars(pattern)
+        if required & absent:
+            compiled.dead.append(index)
+            continue
+        if "\\" in repl:
+            absent.clear()  # escape-последовательности шаблона замены могут породить любой символ
+        absent -= set(repl)
+
+        if not literal:
+            compiled.steps.append(RegexStep(index, pattern, repl))
+            continue
+        rule = LiteralRule(index, pattern, repl, tokens)
+        if len(tokens) == 1 and tokens[0] is not ANY:
+            _place_char(compiled.steps, rule)
+            if pattern not in repl:
+                absent.add(pattern)
+        else:
+            _place_literal(compiled.steps, rule)
+    for step in compiled.steps:
+        if not isinstance(step, TranslateStep):
+            step.compile()
+    compiled.build_index()
+    return compiled
+
+
+def load_rules_from_py(file_path: Path):
+    src = file_path.read_text(encoding="utf-8", errors="replace")
+    tree = ast.parse(src, str(file_path))
+    rules: list[tuple[str, str]] = []
+
+    class V(ast.NodeVisitor):
+        def visit_Assign(self, node: ast.Assign):
+            val = node.value
+            if not isinstance(val, ast.Call):
+                return
+            func = val.func
+            is_resub = (
+                isinstance(func, ast.Attribute)
+                and isinstance(func.value, ast.Name)
+                and func.value.id == "re"
+                and func.attr == "sub"
+            )
+            if not is_resub:
+                return
+            args = val.args
+            if len(args) >= 3:
+                pat, repl, sarg = args[0], args[1], args[2]
+                if isinstance(pat, (ast.Str, ast.Constant)) and isinstance(repl, (ast.Str, ast.Constant)):
+                    p = pat.s if isinstance(pat, ast.Str) else pat.value
+                    r = repl.s if isinstance(repl, ast.Str) else repl.value
+                    if isinstance(p, str) and isinstance(r, str):
+                        rules.append((p, r))
+            self.generic_visit(node)
+
+    V().visit(tree)
+    return rules
+
+
+def apply_sequential(text: str, rules: list[tuple[str, str]]) -> tuple[str, int]:
+    """Эталонная семантика: re.subn по каждому правилу по очереди, некорректные образцы пропускаются."""
+    total = 0
+    for pattern, repl in rules:
+        try:
+            text, n = re.subn(pattern, repl, text)
+        except re.error:
+            continue
+        total += n
+    return text, total
+
+
+@dataclass
+class RuleBundle:
+    """Правила и готовый план, сохраняемые рядом с файлом правил."""
+    source_hash: str
+    code_hash: str
+    rules: list[tuple[str, str]]
+    plan: CompiledRules
+    version: int = BUNDLE_VERSION
+
+
+def bundle_path(rules_path: Path) -> Path:
+    return rules_path.with_name(f"{rules_path.stem}.rules.pickle")
+
+
+def _code_hash() -> str:
+    """Версия компилятора: план и формат пакета целиком определяются этим файлом."""
+    return file_digest(Path(__file__))
+
+
+def build_bundle(rules_path: Path, source_hash: str, code_hash: str) -> RuleBundle:
+    """Разобрать файл правил и скомпилировать план; некорректные образцы печатаются здесь, один раз."""
+    rules = load_rules_from_py(rules_path)
+    plan = compile_rules(rules)
+    for index, error in plan.invalid:
+        print(f"⚠️ {rules_path.name}: правило {index + 1} ({rules[index][0]!r}) пропущено — некорректный образец: {error}")
+    return RuleBundle(source_hash, code_hash, rules, plan)
+
+
+def load_bundle(rules_path: Path, rebuild: bool = False) -> RuleBundle:
+    """Пакет правил для файла: из <имя>.rules.pickle рядом с ним, если он собран из того же
+    содержимого тем же кодом, иначе собирается заново и сохраняется."""
+    source_hash, code_hash = file_digest(rules_path), _code_hash()
+    path = bundle_path(rules_path)
+    if not rebuild and path.exists():
+        try:
+            with open(path, "rb") as f:
+                bundle = pickle.load(f)
+            if (isinstance(bundle, RuleBundle) and bundle.version == BUNDLE_VERSION
+                    and bundle.source_hash == source_hash and bundle.code_hash == code_hash):
+                return bundle
+        except (OSError, EOFError, AttributeError, TypeError, pickle.UnpicklingError):
+            pass
+    bundle = build_bundle(rules_path, source_hash, code_hash)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
+        print(f"⚠️ Не удалось сохранить пакет правил {path}: {e}")
+    return bundle
+
+
+def rule_corpus(rules: list[tuple[str, str]], lines: int = 2000, seed: int = 0) -> list[str]:
+    """Строки из образцов и замен правил вперемешку со словами и знаками — там правила взаимодействуют."""
+    rng = random.Random(seed)
+    pieces = []
+    for pattern, repl in rules:
+        if pattern_tokens(pattern) is not None:
+            pieces.append(pattern.replace(".", rng.choice(".,;! ая")))
+        if "\\" not in repl:
+            pieces.append(repl)
+    fillers = [" ", "  ", ", ", ". ", "\n", "ъ", "Ъ", "-", "а", "ее", "ия ", "ѣ"]
+    corpus = []
+    for _ in range(lines):
+        parts = [rng.choice(pieces if rng.random() < 0.6 else fillers) for _ in range(rng.randint(1, 12))]
+        corpus.append(("" if rng.random() < 0.5 else " ").join(parts))
+    return corpus
+
+
+def verify(compiled: CompiledRules, rules: list[tuple[str, str]], texts) -> list[dict]:
+    """Расхождения скомпилированного плана с последовательным применением (пустой список — эквивалентны).
+
+    План проверяется и с фильтром по триггерам, и без него.
+    """
+    mismatches = []
+    for i, text in enumerate(texts):
+        expected = apply_sequential(text, rules)
+        actual = compiled.apply(text)
+        if actual == expected:
+            actual = compiled.apply(text, prefilter=False)
+        if expected != actual:
+            mismatches.append({"index": i, "input": text, "expected": expected[0], "actual": actual[0],
+                               "expected_count": expected[1], "actual_count": actual[1]})
+    return mismatches
+
+
+def read_corpus(path: Path) -> list[str]:
+    """Тексты корпуса: блоки structured*.json или абзацы текстового файла."""
+    if path.suffix == ".json":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return [b.get("text") or "" for b in data.get("blocks", [])]
+    return [p for p in re.split(r"\n\s*\n", path.read_text(encoding="utf-8")) if p.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Скомпилировать правила oldspelling и проверить эквивалентность.")
+    ap.add_argument("corpus", nargs="*", help="Тексты (.txt) или structured*.json для проверки")
+    ap.add_argument("--rules", default="oldspelling.py", help="Файл правил")
+    ap.add_argument("--synthetic", type=int, default=2000, help="Синтетических строк из образцов правил (0 — не добавлять)")
+    ap.add_argument("--seed", type=int, default=0, help="Seed синтетического корпуса")
+    ap.add_argument("--plan", action="store_true", help="Напечатать все проходы плана")
+    args = ap.parse_args()
+
+    rules = load_rules_from_py(Path(args.rules))
+    compiled = compile_rules(rules)
+    print(compiled.describe() if args.plan else compiled.describe().splitlines()[0])
+
+    texts = [t for path in args.corpus for t in read_corpus(Path(path))]
+    if args.synthetic:
+        texts += rule_corpus(rules, args.synthetic, args.seed)
+    mismatches = verify(compiled, rules, texts)
+    if texts:
+        started = time.perf_counter()
+        for text in texts:
+            apply_sequential(text, rules)
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        for text in texts:
+            compiled.apply(text, prefilter=False)
+        fused = time.perf_counter() - started
+        started = time.perf_counter()
+        for text in texts:
+            compiled.apply(text)
+        filtered = time.perf_counter() - started
+        print(f"Корпус: {len(texts)} текстов, {sum(map(len, texts))} символов; по очереди {sequential:.3f}s, "
+              f"план {fused:.3f}s ({sequential / fused if fused else 0:.1f}x), "
+              f"план с триггерами {filtered:.3f}s ({sequential / filtered if filtered else 0:.1f}x)")
+    if mismatches:
+        print(f"❌ Расхождений: {len(mismatches)}")
+        for m in mismatches[:5]:
+            print(f"  вход {m['input']!r}\n    ожидалось {m['expected']!r}\n    получено  {m['actual']!r}")
+        return 1
+    print("✅ Результат плана совпадает с последовательным применением")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
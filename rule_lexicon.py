@@ -0,0 +1,335 @@
+"""
+Словарный режим oldspelling: блок разбивается на слова один раз, и каждое слово
+заменяется по словарю вместо прогона всей цепочки правил по тексту.
+
+Правила oldspelling почти все «словные»: окончание или целое слово плюс, самое
+большее, соседние разделители ('аго ' → 'ого ', ' оне, ' → ' они, '). Поэтому
+результат цепочки для слова зависит только от самого слова и от класса его
+контекста — какой из ведущих разделителей правил стоит перед ним и какой из
+замыкающих после. Словарь состоит из двух частей:
+
+- слова, которые во всех контекстах меняются одинаково (или не меняются), — одна
+  запись на слово; они берутся из файла словаря <правила>.lexicon.tsv и
+  пополняются во время работы;
+- слова, зависящие от контекста, — записи по ключу (класс слева, слово, класс
+  справа), которые вычисляются при первой встрече.
+
+Неизвестное слово прогоняется через скомпилированный план правил в коротком окне
+«разделители + слово + разделители», и результат запоминается, так что дальше
+каждое слово стоит одного поиска в словаре. Результат совпадает с применением
+цепочки к блоку целиком. Блок целиком идёт через план, если:
+
+- в нём есть триггер правила, которое захватывает несколько слов (' мало по малу ');
+- правило в окне изменило разделители вокруг слова;
+- одно и то же правило с разделителями с обеих сторон сработало на двух соседних
+  словах, разделённых коротким промежутком (при проходе по всему тексту второе
+  вхождение может не найтись).
+
+Файл словаря — строки «слово<TAB>замена<TAB>число замен». Вычисленные строки
+строятся командой --build по словарю корпуса (например, structured.json уже
+обработанных книг); при изменении правил они отбрасываются, пока словарь не
+пересобран. Строки из двух колонок («слово<TAB>замена») добавляются вручную: они
+применяются в любом контексте, даже если правила делают иначе, и при пересборке
+сохраняются.
+
+    python rule_lexicon.py --build oldspelling.lexicon.tsv docs/karp.txt out/structured.json
+    python rule_lexicon.py docs/karp.txt out/structured.json   # проверка и замер
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+from rule_compiler import (ANY, apply_sequential, load_bundle, pattern_tokens, read_corpus, required_clauses,
+                           required_literals, rule_corpus, sre_parse, trigger_keys)
+from stage_cache import file_digest
+
+# Слово: буквы и цифры, в том числе через дефис ('что-ж', 'как-будто')
+WORD_RE = re.compile(r"\w+(?:-\w+)*")
+_SPLIT_RE = re.compile(f"({WORD_RE.pattern})")
+_MISSING = object()
+
+
+def lexicon_path(rules_path: Path) -> Path:
+    return rules_path.with_name(f"{rules_path.stem}.lexicon.tsv")
+
+
+def _word_local(pattern: str) -> bool:
+    """Регулярное выражение, совпадения которого лежат внутри одного слова (только символы \\w и \\b)."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return False
+    if parsed.getwidth()[0] < 1:
+        return False
+
+    def word_only(items) -> bool:
+        for op, arg in items:
+            if op is sre_parse.LITERAL:
+                if not re.match(r"\w", chr(arg)):
+                    return False
+            elif op is sre_parse.IN:
+                for item_op, item_arg in arg:
+                    if item_op not in (sre_parse.LITERAL, sre_parse.RANGE):
+                        return False
+                    lo, hi = (item_arg, item_arg) if item_op is sre_parse.LITERAL else item_arg
+                    if not all(re.match(r"\w", chr(c)) for c in range(lo, hi + 1)):
+                        return False
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                if not word_only(arg[2]):
+                    return False
+            elif op is sre_parse.SUBPATTERN:
+                if not word_only(arg[-1]):
+                    return False
+            elif op is sre_parse.BRANCH:
+                if not all(word_only(branch) for branch in arg[1]):
+                    return False
+            elif op is sre_parse.AT:
+                if arg not in (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY):
+                    return False
+            else:
+                return False
+        return True
+
+    return word_only(parsed)
+
+
+def _context(tokens: list) -> tuple[list, list, str] | None:
+    """Разбить буквальный образец на (ведущий контекст, замыкающий контекст, ядро).
+
+    Ядро — слово (символы \\w и дефисы между ними), контекст — символы-разделители
+    и «любой символ» вплотную к ядру. None — образец может захватить соседнее слово.
+    """
+    word = [tok is not ANY and bool(re.match(r"\w", tok)) for tok in tokens]
+    if not any(word):
+        return None
+    first = word.index(True)
+    last = len(word) - 1 - word[::-1].index(True)
+    core = tokens[first:last + 1]
+    if any(tok is ANY or not (is_word or tok == "-") for tok, is_word in zip(core, word[first:last + 1])):
+        return None
+    lead, trail = tokens[:first], tokens[last + 1:]
+    if ANY in lead[:-1] or ANY in trail[1:]:
+        return None
+    return lead, trail, "".join(core)
+
+
+class Lexicon:
+    """Словарная замена слов с откатом на скомпилированный план правил."""
+
+    def __init__(self, rules: list[tuple[str, str]], plan, entries: dict | None = None):
+        self.plan = plan
+        skipped = set(plan.dead) | {index for index, _ in plan.invalid}
+        leads, trails = [], []
+        self.span = 0  # самый длинный контекст правил с разделителями с обеих сторон
+        self.bidir_cores: set[str] = set()  # ядра этих правил
+        self.global_triggers: list[frozenset] = []
+        self.always_fallback = False
+        for index, (pattern, _) in enumerate(rules):
+            if index in skipped:
+                continue
+            tokens = pattern_tokens(pattern)
+            context = _context(tokens) if tokens is not None else None
+            if context:
+                lead, trail, core = context
+                leads.append(lead)
+                trails.append(trail)
+                if lead and trail:
+                    self.span = max(self.span, len(lead) + len(trail))
+                    self.bidir_cores.add(core)
+            elif tokens is None and _word_local(pattern):
+                continue
+            else:
+                trigger = trigger_keys(required_literals(pattern), required_clauses(pattern))
+                if trigger is None:
+                    self.always_fallback = True
+                else:
+                    self.global_triggers.append(trigger)
+        self.max_lead = max(map(len, leads), default=0)
+        self.max_trail = max(map(len, trails), default=0)
+        # Контексты для проверки, что слово от контекста не зависит: по одному на класс
+        # (какие ведущие/замыкающие части правил совпадают). Это исчерпывающий набор,
+        # только если контекст правил — буквальная строка или один «любой символ».
+        self.exhaustive = all(all(tok is not ANY for tok in part) or part == [ANY] for part in leads + trails)
+        self.lead_probes = sorted({"", *("".join("\x01" if tok is ANY else tok for tok in lead) for lead in leads)})
+        self.trail_probes = sorted({"", *("".join("\x01" if tok is ANY else tok for tok in trail) for trail in trails)})
+        # слово → (замена, число замен) для слов, не зависящих от контекста
+        self.words: dict[str, tuple[str, int]] = dict(entries or {})
+        # слова, зависящие от контекста → могут ли на них сработать правила с контекстом с обеих сторон
+        self.dependent: dict[str, bool] = {}
+        # (разделители слева, слово, разделители справа) → (замена, число замен) или None, если окно меняет разделители
+        self.contextual: dict[tuple[str, str, str], tuple[str, int] | None] = {}
+        self.fallbacks = 0
+
+    def _window(self, lead: str, word: str, trail: str) -> tuple[str, int] | None:
+        out, n = self.plan.apply(lead + word + trail)
+        if not (len(out) >= len(lead) + len(trail) and out.startswith(lead) and out.endswith(trail)):
+            return None
+        return out[len(lead):len(out) - len(trail)], n
+
+    def learn(self, word: str) -> bool:
+        """Прогнать слово через план во всех классах контекста; True — результат от контекста не зависит."""
+        if word in self.words:
+            return True
+        if word not in self.dependent:
+            neutral = self._window("", word, "")
+            if self.exhaustive and neutral is not None and all(
+                    self._window(lead, word, trail) == neutral
+                    for lead in self.lead_probes for trail in self.trail_probes):
+                self.words[word] = neutral
+                return True
+            self.dependent[word] = any(core in word for core in self.bidir_cores)
+        return False
+
+    def _global_in(self, text: str) -> bool:
+        return any(key in text for trigger in self.global_triggers for key in trigger)
+
+    def _fallback(self, text: str) -> tuple[str, int]:
+        self.fallbacks += 1
+        return self.plan.apply(text)
+
+    def apply(self, text: str) -> tuple[str, int]:
+        """Применить правила к тексту по словарю; возвращает текст и число замен, как план."""
+        if self.always_fallback or self._global_in(text):
+            return self._fallback(text)
+        words, contextual = self.words, self.contextual
+        parts = _SPLIT_RE.split(text)  # разделитель, слово, разделитель, ..., разделитель
+        total = 0
+        previous_bidir = False
+        for i in range(1, len(parts), 2):
+            word = parts[i]
+            hit = words.get(word)
+            if hit is None:
+                before, after = parts[i - 1], parts[i + 1]
+                key = (before[len(before) - self.max_lead:] if self.max_lead else "", word, after[:self.max_trail])
+                hit = contextual.get(key, _MISSING)
+                if hit is _MISSING:
+                    hit = words[word] if self.learn(word) else contextual.setdefault(key, self._window(*key))
+                if hit is None:
+                    return self._fallback(text)
+                bidir = hit[1] > 0 and self.dependent.get(word, False)
+                if bidir and previous_bidir and len(before) < self.span:
+                    return self._fallback(text)
+                previous_bidir = bidir
+            else:
+                previous_bidir = False
+            parts[i] = hit[0]
+            total += hit[1]
+        result = "".join(parts)
+        if self.global_triggers and self._global_in(result):
+            return self._fallback(text)
+        return result, total
+
+
+def read_lexicon(path: Path, rules_hash: str) -> tuple[dict, dict]:
+    """(вычисленные записи, ручные записи) из файла словаря.
+
+    Вычисленные записи, собранные для другой версии правил, отбрасываются.
+    """
+    computed, manual = {}, {}
+    if not path.exists():
+        return computed, manual
+    lines = path.read_text(encoding="utf-8").splitlines()
+    fresh = bool(lines) and lines[0] == f"# rules: {rules_hash}"
+    stale = 0
+    for line in lines:
+        if not line.strip() or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) == 2:
+            manual[fields[0]] = (fields[1], int(fields[0] != fields[1]))
+        elif len(fields) == 3 and fresh:
+            computed[fields[0]] = (fields[1], int(fields[2]))
+        elif len(fields) == 3:
+            stale += 1
+    if stale:
+        print(f"⚠️ {path.name}: {stale} вычисленных записей собраны для другой версии правил и пропущены — "
+              f"пересоберите словарь: python rule_lexicon.py --build {path} <корпус>")
+    return computed, manual
+
+
+def write_lexicon(path: Path, rules_hash: str, computed: dict, manual: dict):
+    lines = [f"# rules: {rules_hash}",
+             "# слово<TAB>замена<TAB>число замен — вычислено по правилам (rule_lexicon.py --build)",
+             "# слово<TAB>замена — добавлено вручную, применяется в любом контексте"]
+    lines += [f"{word}\t{repl}" for word, (repl, _) in sorted(manual.items())]
+    lines += [f"{word}\t{repl}\t{n}" for word, (repl, n) in sorted(computed.items()) if word not in manual]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def load_lexicon(rules_path: Path, bundle=None) -> Lexicon:
+    """Словарь для файла правил: пакет правил плюс <правила>.lexicon.tsv, если он есть."""
+    bundle = bundle or load_bundle(rules_path)
+    computed, manual = read_lexicon(lexicon_path(rules_path), file_digest(rules_path))
+    return Lexicon(bundle.rules, bundle.plan, {**computed, **manual})
+
+
+def build_entries(lexicon: Lexicon, texts) -> dict:
+    """Записи словаря по словарю корпуса: все слова, которые правила меняют (или не меняют)
+    одинаково в любом контексте. Неизменные слова тоже записываются — иначе их пришлось
+    бы проверять во всех контекстах при каждом запуске."""
+    vocabulary = {word for text in texts for word in WORD_RE.findall(text)}
+    return {word: lexicon.words[word] for word in sorted(vocabulary) if lexicon.learn(word)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Словарный режим oldspelling: сборка словаря и проверка эквивалентности.")
+    ap.add_argument("corpus", nargs="*", help="Тексты (.txt) или structured*.json")
+    ap.add_argument("--rules", default="oldspelling.py", help="Файл правил")
+    ap.add_argument("--build", metavar="TSV",
+                    help="Пополнить словарь словами корпуса (прежние и ручные записи сохраняются)")
+    ap.add_argument("--synthetic", type=int, default=2000, help="Синтетических строк из образцов правил для проверки")
+    ap.add_argument("--seed", type=int, default=0, help="Seed синтетического корпуса")
+    args = ap.parse_args()
+
+    rules_path = Path(args.rules)
+    bundle = load_bundle(rules_path)
+    rules_hash = file_digest(rules_path)
+    texts = [t for path in args.corpus for t in read_corpus(Path(path))]
+
+    if args.build:
+        out = Path(args.build)
+        computed, manual = read_lexicon(out, rules_hash)
+        entries = {**computed, **build_entries(Lexicon(bundle.rules, bundle.plan), texts)}
+        write_lexicon(out, rules_hash, entries, manual)
+        print(f"Словарь: {out} ({len(entries)} вычисленных записей, {len(manual)} ручных)")
+        return 0
+
+    lexicon = load_lexicon(rules_path, bundle)
+    if lexicon.always_fallback:
+        print("⚠️ У правила, захватывающего несколько слов, нет триггера: словарный режим всегда откатывается на план")
+    if args.synthetic:
+        texts += rule_corpus(bundle.rules, args.synthetic, args.seed)
+    if not texts:
+        ap.error("нужен корпус для проверки")
+    print(f"Записей в словаре: {len(lexicon.words)}; контекст правил: до {lexicon.max_lead} символов слева, "
+          f"до {lexicon.max_trail} справа; правил на несколько слов: {len(lexicon.global_triggers)}")
+
+    mismatches = []
+    for text in texts:
+        expected = apply_sequential(text, bundle.rules)
+        actual = lexicon.apply(text)
+        if actual != expected:
+            mismatches.append((text, expected, actual))
+    fallbacks = lexicon.fallbacks
+    timings = {}
+    for name, apply in (("план", bundle.plan.apply), ("словарь (прогретый)", lexicon.apply)):
+        started = time.perf_counter()
+        for text in texts:
+            apply(text)
+        timings[name] = time.perf_counter() - started
+    print(f"Корпус: {len(texts)} текстов, {sum(map(len, texts))} символов; "
+          + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+          + f"; блоков через план: {fallbacks}")
+    if mismatches:
+        print(f"❌ Расхождений: {len(mismatches)} (ручные записи словаря тоже дают расхождения)")
+        for text, expected, actual in mismatches[:5]:
+            print(f"  вход {text!r}\n    ожидалось {expected!r}\n    получено  {actual!r}")
+        return 1
+    print("✅ Результат словарного режима совпадает с последовательным применением")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Профиль правил oldspelling: какие правила срабатывают на книге и сколько они стоят.
+
+Правила применяются по очереди (как в apply_sequential, с заранее
+скомпилированными образцами), и для каждого считаются число замен, число
+затронутых блоков, суммарное время re.subn и несколько примеров с контекстом.
+Результат тот же, что у скомпилированного плана, поэтому профиль можно снимать
+прямо в пайплайне: apply_rules_structured.py --rule-report пишет отчёт рядом с
+structured_rules.json.
+
+Статусы правил в отчёте: fired — сработало хотя бы раз; never_fired — ни разу
+на этой книге; dead — не может сработать ни на какой книге (обязательный символ
+удалён более ранним правилом), invalid — некорректный образец.
+"""
+import re
+import time
+from pathlib import Path
+
+from progress_events import Progress
+
+SAMPLES_PER_RULE = 3
+CONTEXT_CHARS = 30
+
+
+def report_path(out: Path) -> Path:
+    """Файл отчёта рядом с результатом этапа: structured_rules.json → structured_rules.rule_report.json."""
+    return out.with_name(f"{out.stem}.rule_report.json")
+
+
+def _sample(text: str, match: re.Match, repl: str, block: int) -> dict:
+    start, end = match.span()
+    try:
+        after = match.expand(repl)
+    except (re.error, IndexError):
+        after = repl
+    return {
+        "block": block,
+        "before": text[max(0, start - CONTEXT_CHARS):start],
+        "match": match.group(0),
+        "replacement": after,
+        "after": text[end:end + CONTEXT_CHARS],
+    }
+
+
+def profile_rules(blocks, bundle, samples: int = SAMPLES_PER_RULE) -> tuple[int, dict]:
+    """Применить правила пакета к блокам по очереди, замеряя каждое; возвращает (число замен, отчёт)."""
+    rules, plan = bundle.rules, bundle.plan
+    invalid = dict(plan.invalid)
+    dead = set(plan.dead)
+    step_of = {index: k for k, step in enumerate(plan.steps) for index in step.rules}
+    compiled = [None if i in invalid else re.compile(pattern) for i, (pattern, _) in enumerate(rules)]
+    stats = [{"hits": 0, "blocks": 0, "time_s": 0.0, "samples": []} for _ in rules]
+    perf = time.perf_counter
+    total_hits = 0
+    started = perf()
+    with Progress("oldspelling", len(blocks), "blocks") as progress:
+        for block_index, b in enumerate(blocks):
+            txt = b.get("text") or ""
+            for rx, (_, repl), st in zip(compiled, rules, stats):
+                if rx is None:
+                    continue
+                t0 = perf()
+                new_txt, n = rx.subn(repl, txt)
+                st["time_s"] += perf() - t0
+                if not n:
+                    continue
+                if len(st["samples"]) < samples:
+                    for m in rx.finditer(txt):
+                        st["samples"].append(_sample(txt, m, repl, block_index))
+                        if len(st["samples"]) >= samples:
+                            break
+                st["hits"] += n
+                st["blocks"] += 1
+                total_hits += n
+                txt = new_txt
+            b["text"] = txt
+            progress.advance()
+    wall = perf() - started
+    rules_time = sum(st["time_s"] for st in stats)
+
+    entries = []
+    for i, ((pattern, repl), st) in enumerate(zip(rules, stats)):
+        if i in invalid:
+            status = "invalid"
+        elif i in dead:
+            status = "dead"
+        else:
+            status = "fired" if st["hits"] else "never_fired"
+        entries.append({
+            "rule": i + 1,
+            "pattern": pattern,
+            "repl": repl,
+            "status": status,
+            "hits": st["hits"],
+            "blocks": st["blocks"],
+            "time_s": round(st["time_s"], 6),
+            "time_share": round(st["time_s"] / rules_time, 4) if rules_time else 0.0,
+            "plan_step": step_of.get(i),
+            "error": invalid.get(i),
+            "samples": st["samples"],
+        })
+    report = {
+        "blocks": len(blocks),
+        "chars": sum(len(b.get("text") or "") for b in blocks),
+        "rules": len(rules),
+        "plan_steps": len(plan.steps),
+        "total_hits": total_hits,
+        "total_time_s": round(rules_time, 6),
+        "wall_s": round(wall, 6),
+        "summary": {status: sum(1 for e in entries if e["status"] == status)
+                    for status in ("fired", "never_fired", "dead", "invalid")},
+        "rules_by_cost": [e["rule"] for e in sorted(entries, key=lambda e: -e["time_s"])],
+        "details": entries,
+    }
+    return total_hits, report
+
+
+def print_summary(report: dict, top: int = 5):
+    s = report["summary"]
+    print(f"Правила: сработало {s['fired']}, ни разу {s['never_fired']}, мёртвых {s['dead']}, "
+          f"некорректных {s['invalid']}; замен {report['total_hits']}, время правил {report['total_time_s']:.3f}s")
+    details = {e["rule"]: e for e in report["details"]}
+    for number in report["rules_by_cost"][:top]:
+        e = details[number]
+        print(f"  правило {number} {e['pattern']!r}: {e['time_s'] * 1000:.1f}ms ({e['time_share']:.0%}), замен {e['hits']}")
@@ -0,0 +1,132 @@
+"""
+Кэш результатов этапов пайплайна с адресацией по содержимому (в духе make).
+
+Ключ этапа — sha256 от имени этапа, версии кода (исходники скрипта этапа и
+локальных модулей, которые он импортирует), параметров и содержимого входных
+файлов. Выходные файлы этапа сохраняются в <outdir>/.stage_cache/objects под
+хэшем содержимого, а для ключа записывается список выходов. Если ключ уже
+встречался, этап не запускается: его выходы восстанавливаются из кэша.
+"""
+import ast
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+CACHE_VERSION = 1
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _local_imports(path: Path) -> list[Path]:
+    """Модули из той же папки, импортируемые файлом (import x / from x import y)."""
+    try:
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return []
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return [path.parent / f"{name}.py" for name in sorted(names) if (path.parent / f"{name}.py").exists()]
+
+
+def code_version(paths) -> str:
+    """Хэш исходников этапа вместе с локальными модулями, которые они импортируют."""
+    seen: dict[str, str] = {}
+    queue = [Path(p) for p in paths]
+    while queue:
+        path = queue.pop()
+        key = str(path.resolve())
+        if key in seen or not path.exists():
+            continue
+        seen[key] = file_digest(path)
+        if path.suffix == ".py":
+            queue.extend(_local_imports(path))
+    return hashlib.sha256(json.dumps(sorted(seen.values())).encode()).hexdigest()
+
+
+def _expand(paths) -> list[Path]:
+    """Файлы из списка путей; папки раскрываются в отсортированный список вложенных файлов."""
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(sorted(f for f in p.rglob("*") if f.is_file()))
+        elif p.exists():
+            files.append(p)
+    return files
+
+
+class StageCache:
+    def __init__(self, cache_dir: Path):
+        self.dir = Path(cache_dir)
+        self.objects = self.dir / "objects"
+        self.keys = self.dir / "stages"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.keys.mkdir(parents=True, exist_ok=True)
+
+    def key(self, stage) -> str:
+        inputs = {}
+        for p in map(Path, stage.inputs):
+            if p.is_dir():
+                inputs[str(p)] = {str(f): file_digest(f) for f in _expand([p])}
+            else:
+                inputs[str(p)] = file_digest(p) if p.exists() else None
+        payload = {
+            "cache": CACHE_VERSION,
+            "stage": stage.name,
+            "code": code_version(stage.code),
+            "params": [str(x) for x in stage.params],
+            "inputs": inputs,
+            "outputs": sorted(str(p) for p in stage.outputs),
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _record(self, key: str) -> Path:
+        return self.keys / f"{key}.json"
+
+    def restore(self, stage, key: str) -> bool:
+        """Восстановить выходы этапа по ключу. False, если ключа нет или объект потерян."""
+        record = self._record(key)
+        if not record.exists():
+            return False
+        try:
+            outputs = json.loads(record.read_text(encoding="utf-8"))["outputs"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if not all((self.objects / digest).exists() for digest in outputs.values()):
+            return False
+        for name, digest in outputs.items():
+            path = Path(name)
+            if path.exists() and file_digest(path) == digest:
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            shutil.copyfile(self.objects / digest, tmp)
+            os.replace(tmp, path)
+        return True
+
+    def store(self, stage, key: str):
+        outputs = {}
+        for path in _expand(stage.outputs):
+            digest = file_digest(path)
+            obj = self.objects / digest
+            if not obj.exists():
+                tmp = obj.with_name(digest + ".tmp")
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, obj)
+            outputs[str(path)] = digest
+        record = self._record(key)
+        tmp = record.with_name(record.name + ".tmp")
+        tmp.write_text(json.dumps({"stage": stage.name, "outputs": outputs}, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        os.replace(tmp, record)
@@ -0,0 +1,175 @@
+"""
+Планировщик этапов пайплайна по графу зависимостей.
+
+Каждый этап объявляет файлы, которые он читает (inputs) и пишет (outputs).
+Рёбра графа выводятся из этих объявлений в порядке объявления этапов:
+- чтение после записи — этап ждёт последнего писателя файла;
+- запись после записи — этап ждёт предыдущего писателя;
+- запись после чтения — этап, перезаписывающий файл, ждёт всех, кто читал его прежнюю версию.
+Независимые ветви выполняются одновременно (не больше workers этапов сразу),
+после выполнения печатается критический путь.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+from trace_events import span
+
+# Общая блокировка вывода: строки одновременно работающих этапов не перемешиваются
+OUTPUT_LOCK = threading.Lock()
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[], bool]
+    inputs: tuple = ()
+    outputs: tuple = ()
+    # Ошибка обязательного этапа останавливает пайплайн; необязательного — только печатается
+    required: bool = True
+    # Название для списка этапов
+    title: str = ""
+    # Для кэша этапов (stage_cache.py): параметры и исходники, от которых зависит результат
+    params: tuple = ()
+    code: tuple = ()
+    # Размеры входов и выходов для pipeline_metrics.json: measure(paths) → dict
+    measure: Callable | None = None
+    deps: set = field(default_factory=set)
+    start: float | None = None
+    end: float | None = None
+    ok: bool | None = None
+    cached: bool = False
+    metrics: dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+def link_stages(stages: list[Stage]) -> list[Stage]:
+    """Заполнить Stage.deps по объявленным inputs/outputs."""
+    last_writer: dict[str, str] = {}
+    readers: dict[str, set] = {}
+    for stage in stages:
+        for path in map(str, stage.inputs):
+            if path in last_writer:
+                stage.deps.add(last_writer[path])
+        for path in map(str, stage.outputs):
+            if path in last_writer:
+                stage.deps.add(last_writer[path])
+            stage.deps |= readers.get(path, set())
+        stage.deps.discard(stage.name)
+        for path in map(str, stage.inputs):
+            readers.setdefault(path, set()).add(stage.name)
+        for path in map(str, stage.outputs):
+            last_writer[path] = stage.name
+            readers[path] = set()
+    return stages
+
+
+def _timed(stage: Stage, cache=None) -> bool:
+    if stage.measure is not None:
+        stage.metrics["input"] = stage.measure(stage.inputs)
+    stage.start = time.perf_counter()
+    try:
+        with span(stage.name, cat="stage"):
+            key = cache.key(stage) if cache is not None else None
+            if key is not None:
+                stage.metrics["cache_key"] = key
+            if key is not None and cache.restore(stage, key):
+                stage.cached = True
+                with OUTPUT_LOCK:
+                    print(f"\n⏩ {stage.title or stage.name}: входы не изменились, результат взят из кэша")
+                return True
+            ok = bool(stage.run())
+            if ok and key is not None:
+                with span("store in cache", cat="io"):
+                    cache.store(stage, key)
+            return ok
+    except Exception as e:
+        with OUTPUT_LOCK:
+            print(f"Ошибка этапа {stage.name}: {e}")
+        return False
+    finally:
+        stage.end = time.perf_counter()
+        stage.metrics["wall_s"] = round(stage.duration, 3)
+        if stage.measure is not None:
+            stage.metrics["output"] = stage.measure(stage.outputs)
+
+
+def run_graph(stages: list[Stage], workers: int = 1, cache=None, force=()) -> bool:
+    """Выполнить этапы с учётом зависимостей. Возвращает False, если упал обязательный этап.
+
+    При workers=1 этапы идут строго в порядке объявления. С cache (stage_cache.StageCache)
+    этапы с неизменённым ключом не запускаются; этапы из force запускаются всегда.
+    """
+    link_stages(stages)
+    by_name = {s.name: s for s in stages}
+    pending = list(stages)
+    done: set = set()
+    running = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stage") as ex:
+        while pending or running:
+            if not failed:
+                for stage in list(pending):
+                    if len(running) >= max(1, workers):
+                        break
+                    if stage.deps <= done:
+                        pending.remove(stage)
+                        stage_cache = None if stage.name in force else cache
+                        running[ex.submit(_timed, stage, stage_cache)] = stage
+                    elif workers <= 1:
+                        break
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage = running.pop(fut)
+                stage.ok = fut.result()
+                done.add(stage.name)
+                if not stage.ok and by_name[stage.name].required:
+                    failed = True
+    return not failed
+
+
+def critical_path(stages: list[Stage]) -> tuple[list[Stage], float]:
+    """Самая длинная по фактическому времени цепочка зависимых этапов."""
+    by_name = {s.name: s for s in stages}
+    length: dict[str, float] = {}
+    prev: dict[str, str | None] = {}
+    for stage in stages:  # порядок объявления топологический
+        if stage.start is None:
+            continue
+        best = max((d for d in stage.deps if d in length), key=length.get, default=None)
+        length[stage.name] = stage.duration + (length[best] if best else 0.0)
+        prev[stage.name] = best
+    if not length:
+        return [], 0.0
+    name = max(length, key=length.get)
+    total = length[name]
+    path = []
+    while name:
+        path.append(by_name[name])
+        name = prev[name]
+    return path[::-1], total
+
+
+def print_report(stages: list[Stage], wall: float):
+    """Таблица времени этапов и критический путь."""
+    ran = [s for s in stages if s.start is not None]
+    if not ran:
+        return
+    origin = min(s.start for s in ran)
+    print("\nВремя этапов:")
+    for s in ran:
+        status = "кэш" if s.cached else "ok" if s.ok else "ошибка"
+        print(f"  {s.name:<20} {s.start - origin:8.2f}s → {s.end - origin:8.2f}s  ({s.duration:.2f}s, {status})")
+    path, total = critical_path(stages)
+    busy = sum(s.duration for s in ran)
+    print(f"Критический путь ({total:.2f}s): {' → '.join(s.name for s in path)}")
+    print(f"Общее время: {wall:.2f}s, суммарное время этапов: {busy:.2f}s")
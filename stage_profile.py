@@ -0,0 +1,68 @@
+"""
+Общая опция --profile для скриптов этапов.
+
+Скрипт этапа добавляет опции в свой парсер и оборачивает main():
+
+    @profiled_main
+    def main():
+        ap = argparse.ArgumentParser(...)
+        add_profile_args(ap)
+        ...
+
+С --profile stage.pstats этап выполняется под cProfile, статистика сохраняется
+в файл (смотреть: python -m pstats stage.pstats, snakeviz, gprof2dot), а после
+этапа печатаются --profile-top функций с наибольшим собственным временем.
+"""
+import argparse
+import cProfile
+import functools
+import pstats
+import sys
+from pathlib import Path
+
+
+def add_profile_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--profile", metavar="PSTATS",
+                    help="Профилировать этап через cProfile и сохранить статистику в этот .pstats файл")
+    ap.add_argument("--profile-top", type=int, default=15, metavar="N",
+                    help="Сколько самых затратных функций напечатать после --profile (по умолчанию: 15)")
+
+
+def format_top(stats: pstats.Stats, top: int) -> str:
+    """Таблица самых затратных функций по собственному времени (tottime)."""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    lines = [f"{'tottime':>9} {'cumtime':>9} {'calls':>9}  функция"]
+    for (filename, lineno, func), (_, calls, tottime, cumtime, _) in rows:
+        where = f" ({Path(filename).name}:{lineno})" if filename != "~" else ""  # "~" — встроенные функции
+        lines.append(f"{tottime:9.3f} {cumtime:9.3f} {calls:9d}  {func}{where}")
+    return "\n".join(lines)
+
+
+def run_profiled(func, out: str | Path, top: int = 15, label: str = ""):
+    """Выполнить func() под cProfile, сохранить .pstats и напечатать top-N функций."""
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(str(out))
+        stats = pstats.Stats(profiler)
+        title = f"Профиль {label}" if label else "Профиль"
+        print(f"\n{title}: {stats.total_tt:.3f}s, статистика сохранена в {out}")
+        if top > 0:
+            print(format_top(stats, top))
+
+
+def profiled_main(main):
+    """Декоратор main() скрипта этапа: --profile/--profile-top обрабатываются до argparse скрипта."""
+    @functools.wraps(main)
+    def wrapper():
+        pre = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+        add_profile_args(pre)
+        opts, rest = pre.parse_known_args(sys.argv[1:])
+        if not opts.profile:
+            return main()
+        sys.argv = sys.argv[:1] + rest
+        return run_profiled(main, opts.profile, opts.profile_top, Path(sys.argv[0]).stem)
+    return wrapper
@@ -7,6 +7,10 @@ import json
 from pathlib import Path
 from typing import List, Dict
 
+from progress_events import Progress
+from stage_profile import add_profile_args, profiled_main
+from trace_events import span
+
 try:
     import stanza
 except ImportError:
@@ -109,6 +113,54 @@ def process_text_file(input_file: Path, output_file: Path, model_path: str, use_
     return result_text
 
 
+def _tokenize_block(pipeline, block, idx: int, total_blocks: int):
+    """Переразбивает предложения одного блока; заголовки и пустые блоки возвращаются как есть."""
+    # Проверяем, что block - это словарь
+    if not isinstance(block, dict):
+        print(f"⚠️  Пропущен блок {idx}/{total_blocks} неверного формата: {type(block)}")
+        return block
+        
+    if block.get('role') == 'heading':
+        # Заголовки не трогаем
+        return block
+    
+    text = block.get('text', '')
+    if not text.strip():
+        return block
+    
+    try:
+        # Используем уже загруженный pipeline
+        with span("block", index=idx, chars=len(text)):
+            doc = pipeline(text)
+        sentences = [sentence.text for sentence in doc.sentences]
+        block['text'] = ' '.join(sentences)
+    except Exception as e:
+        print(f"Ошибка при обработке блока {idx}/{total_blocks}: {e}")
+    return block
+
+
+def tokenize_blocks(blocks: list, model_path: str, use_gpu: bool = False) -> list:
+    """
+    Улучшает разбиение предложений в каждом блоке (заголовки не трогаются).
+    """
+    # Загружаем pipeline один раз для всех блоков
+    print(f"Загрузка модели Stanza: {model_path}")
+    with span("load model"):
+        pipeline = get_stanza_pipeline(model_path, use_gpu)
+    print("Модель загружена, начинаю обработку блоков...")
+    
+    processed_blocks = []
+    total_blocks = len(blocks)
+    
+    with Progress("stanza", total_blocks, "blocks") as progress:
+        for idx, block in enumerate(blocks, 1):
+            processed_blocks.append(_tokenize_block(pipeline, block, idx, total_blocks))
+            progress.advance()
+    
+    print(f"Обработка завершена: {len(processed_blocks)} блоков")
+    return processed_blocks
+
+
 def process_json_file(input_file: Path, output_file: Path, model_path: str, use_gpu: bool = False):
     """
     Обрабатывает JSON файл со структурированными блоками: улучшает разбиение предложений в каждом блоке.
@@ -123,45 +175,7 @@ def process_json_file(input_file: Path, output_file: Path, model_path: str, use_
     else:
         raise ValueError(f"Неожиданный формат JSON: ожидается dict или list, получен {type(data)}")
     
-    # Загружаем pipeline один раз для всех блоков
-    print(f"Загрузка модели Stanza: {model_path}")
-    pipeline = get_stanza_pipeline(model_path, use_gpu)
-    print("Модель загружена, начинаю обработку блоков...")
-    
-    processed_blocks = []
-    total_blocks = len(blocks)
-    
-    for idx, block in enumerate(blocks, 1):
-        # Проверяем, что block - это словарь
-        if not isinstance(block, dict):
-            print(f"⚠️  Пропущен блок {idx}/{total_blocks} неверного формата: {type(block)}")
-            processed_blocks.append(block)
-            continue
-            
-        if block.get('role') == 'heading':
-            # Заголовки не трогаем
-            processed_blocks.append(block)
-            continue
-        
-        text = block.get('text', '')
-        if not text.strip():
-            processed_blocks.append(block)
-            continue
-        
-        try:
-            # Используем уже загруженный pipeline
-            doc = pipeline(text)
-            sentences = [sentence.text for sentence in doc.sentences]
-            block['text'] = ' '.join(sentences)
-            processed_blocks.append(block)
-            
-            if idx % 10 == 0:
-                print(f"Обработано блоков: {idx}/{total_blocks}")
-        except Exception as e:
-            print(f"Ошибка при обработке блока {idx}/{total_blocks}: {e}")
-            processed_blocks.append(block)
-    
-    print(f"Обработка завершена: {len(processed_blocks)} блоков")
+    processed_blocks = tokenize_blocks(blocks, model_path, use_gpu)
     
     # Сохраняем в том же формате, что и входной файл
     if isinstance(data, dict):
@@ -176,6 +190,7 @@ def process_json_file(input_file: Path, output_file: Path, model_path: str, use_
     return processed_blocks
 
 
+@profiled_main
 def main():
     parser = argparse.ArgumentParser(
         description="Улучшенная токенизация текста с помощью модели Stanza НКРЯ"
@@ -189,6 +204,7 @@ def main():
     )
     parser.add_argument("--gpu", action="store_true", help="Использовать GPU (если доступен)")
     
+    add_profile_args(parser)
     args = parser.parse_args()
     
     input_path = Path(args.input_file)
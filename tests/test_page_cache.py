@@ -0,0 +1,27 @@
+import fitz
+
+from extract_structured_text import ExtractOptions, PageCache
+
+
+def _scanned_pdf(path, colors):
+    """PDF of image-only pages: the same content stream, different image bytes."""
+    doc = fitz.open()
+    for color in colors:
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+        pix.set_rect(pix.irect, color)
+        page = doc.new_page(width=200, height=200)
+        page.insert_image(page.rect, pixmap=pix)
+    doc.save(path)
+    doc.close()
+
+
+def test_image_only_pages_with_different_images_get_different_keys(tmp_path):
+    pdf = tmp_path / "scan.pdf"
+    _scanned_pdf(pdf, [(255, 0, 0), (0, 0, 255), (255, 0, 0)])
+    cache = PageCache(tmp_path / "cache", ExtractOptions(ocr_lang="rus").cache_params())
+    with fitz.open(pdf) as doc:
+        pages = [doc.load_page(i) for i in range(len(doc))]
+        assert pages[0].read_contents() == pages[1].read_contents()
+        keys = [cache.key(page) for page in pages]
+    assert keys[0] != keys[1]
+    assert keys[0] == keys[2]
@@ -0,0 +1,393 @@
+"""
+Сравнение результата пайплайна с эталонным текстом: схожесть, точность слов и
+символов, атрибуция ошибок по этапам.
+
+Тексты сравниваются как последовательности слов (токены между пробельными
+символами). Выравнивание — якорный diff в духе patience diff: якорями служат
+редкие слова, которые встречаются в обоих окнах одинаковое число раз (i-е
+вхождение в эталоне сопоставляется i-му в результате), а в длинных окнах, где
+текст повторяется и редких слов нет, — слова, единственные в соседних участках
+эталона и результата. Из якорей берётся наибольшая возрастающая
+подпоследовательность, и промежутки между ними выравниваются так же рекурсивно. difflib применяется только к маленьким окнам
+без якорей, поэтому книга в 1 МБ сравнивается за секунды, а повторяющиеся
+фрагменты текста не сбивают выравнивание. Внутри расхождений считается
+посимвольное расстояние Левенштейна.
+
+С --outdir текст каждого этапа (structured.json, structured_rules.json, final.txt,
+final_local_spell.txt, final_clean.txt) выравнивается с эталоном отдельно, и
+каждая оставшаяся ошибка приписывается этапу, после которого слово эталона
+стало неверным и больше не было исправлено (для ошибок извлечения — extract).
+
+    python text_scorer.py --reference docs/karp.txt --result out/final_clean.txt
+    python text_scorer.py --reference docs/karp.txt --outdir out --json score.json
+"""
+import argparse
+import difflib
+import json
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+# Слова, которые встречаются в окне чаще, не становятся якорями (служебные слова)
+MAX_ANCHOR_COUNT = 8
+# Размер блока и запас поиска (в словах) для якорей в длинных окнах с повторяющимся текстом
+LOCAL_BLOCK = 500
+LOCAL_SLACK = 500
+# Окна без якорей не больше этого (слов × слов) выравниваются difflib, большие считаются заменой целиком
+DIFFLIB_CELLS = 250_000
+# Посимвольное расстояние считается для расхождений не больше этого (символов × символов)
+CHAR_CELLS = 1_000_000
+# Сколько примеров оставшихся ошибок сохранять для каждого этапа
+EXAMPLES_PER_STAGE = 5
+
+# Этап → файл с его результатом, в порядке пайплайна. natasha_sync переписывает
+# final_clean.txt после lt_cloud, поэтому при обоих этапах снимок один.
+STAGE_TEXTS = [
+    ("extract", "structured.json"),
+    ("oldspelling", "structured_rules.json"),
+    ("stanza", "structured_tokenized.json"),
+    ("modernize", "final.txt"),
+    ("local_spell", "final_local_spell.txt"),
+    ("lt_cloud", "final_clean.txt"),
+    ("natasha_sync", "final_clean.txt"),
+]
+
+
+def tokenize(text: str) -> list[str]:
+    return text.split()
+
+
+def _lis(pairs: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Наибольшая подпоследовательность пар (i, j), возрастающая по j (пары уже упорядочены по i)."""
+    tails, tail_idx, prev = [], [], [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+        prev[k] = tail_idx[pos - 1] if pos else -1
+    chain, k = [], tail_idx[-1] if tail_idx else -1
+    while k >= 0:
+        chain.append(pairs[k])
+        k = prev[k]
+    chain.reverse()
+    return chain
+
+
+def _anchors(a, b, alo, ahi, blo, bhi) -> list[tuple[int, int]]:
+    """Якоря окна: редкие слова с одинаковым числом вхождений в обоих окнах, сопоставленные по порядку."""
+    counts_a = Counter(a[alo:ahi])
+    counts_b = Counter(b[blo:bhi])
+    positions: dict[str, list[int]] = {}
+    for j in range(blo, bhi):
+        word = b[j]
+        count = counts_b[word]
+        if count <= MAX_ANCHOR_COUNT and counts_a.get(word) == count:
+            positions.setdefault(word, []).append(j)
+    pairs, seen = [], Counter()
+    for i in range(alo, ahi):
+        js = positions.get(a[i])
+        if js:
+            pairs.append((i, js[seen[a[i]]]))
+            seen[a[i]] += 1
+    return _lis(pairs)
+
+
+def _local_anchors(a, b, alo, ahi, blo, bhi) -> list[tuple[int, int]]:
+    """Якоря для длинных окон с повторяющимся текстом, где нет редких во всём окне слов.
+
+    Эталон идёт блоками по LOCAL_BLOCK слов; для блока берётся участок результата
+    на ±LOCAL_SLACK слов вокруг ожидаемого места (по сдвигу последнего найденного
+    якоря), и якорями становятся слова, единственные и в блоке, и в участке.
+    """
+    pairs = []
+    offset = blo - alo
+    for start in range(alo, ahi, LOCAL_BLOCK):
+        end = min(start + LOCAL_BLOCK, ahi)
+        counts_a = Counter(a[start:end])
+        found = []
+        for slack in (LOCAL_SLACK, LOCAL_SLACK * 4):
+            jlo = max(blo, start + offset - slack)
+            jhi = min(bhi, end + offset + slack)
+            if jlo >= jhi:
+                break
+            counts_b = Counter(b[jlo:jhi])
+            where = {b[j]: j for j in range(jlo, jhi) if counts_b[b[j]] == 1}
+            found = [(i, where[a[i]]) for i in range(start, end) if counts_a[a[i]] == 1 and a[i] in where]
+            if found:
+                break
+        if found:
+            pairs.extend(found)
+            i, j = found[-1]
+            offset = j - i
+    return _lis(pairs)
+
+
+def _match(a, b, alo, ahi, blo, bhi, out: list):
+    """Дописать в out совпадающие пары (i, j) окна в порядке возрастания."""
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        out.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+    if alo < ahi and blo < bhi:
+        anchors = _anchors(a, b, alo, ahi, blo, bhi)
+        if not anchors and (ahi - alo) * (bhi - blo) > DIFFLIB_CELLS:
+            anchors = _local_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            i0, j0 = alo, blo
+            for i, j in anchors:
+                _match(a, b, i0, i, j0, j, out)
+                out.append((i, j))
+                i0, j0 = i + 1, j + 1
+            _match(a, b, i0, ahi, j0, bhi, out)
+        elif (ahi - alo) * (bhi - blo) <= DIFFLIB_CELLS:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for block in matcher.get_matching_blocks():
+                out.extend((alo + block.a + k, blo + block.b + k) for k in range(block.size))
+    out.extend(reversed(suffix))
+
+
+def align(a: list[str], b: list[str]) -> list[tuple[str, int, int, int, int]]:
+    """Операции выравнивания двух списков слов в формате difflib.get_opcodes()."""
+    matches: list[tuple[int, int]] = []
+    _match(a, b, 0, len(a), 0, len(b), matches)
+    ops, i0, j0 = [], 0, 0
+    for i, j in matches + [(len(a), len(b))]:
+        if i > i0 or j > j0:
+            tag = "replace" if i > i0 and j > j0 else "delete" if i > i0 else "insert"
+            ops.append((tag, i0, i, j0, j))
+        if i < len(a):
+            if ops and ops[-1][0] == "equal" and ops[-1][2] == i:
+                ops[-1] = ("equal", ops[-1][1], i + 1, ops[-1][3], j + 1)
+            else:
+                ops.append(("equal", i, i + 1, j, j + 1))
+        i0, j0 = i + 1, j + 1
+    return ops
+
+
+def char_distance(x: str, y: str) -> int:
+    """Расстояние Левенштейна; для слишком длинных строк — оценка сверху max(len)."""
+    if len(x) * len(y) > CHAR_CELLS:
+        return max(len(x), len(y))
+    if len(x) < len(y):
+        x, y = y, x
+    row = list(range(len(y) + 1))
+    for i, cx in enumerate(x, 1):
+        prev, row[0] = row[0], i
+        for j, cy in enumerate(y, 1):
+            cur = row[j]
+            row[j] = min(cur + 1, row[j - 1] + 1, prev + (cx != cy))
+            prev = cur
+    return row[-1]
+
+
+def char_matches(x: str, y: str) -> int:
+    """Число совпадающих символов (как в difflib.SequenceMatcher.ratio).
+
+    Расхождения больше CHAR_CELLS считаются приближённо: символы совпавших слов
+    (SequenceMatcher по словам), а если и слов слишком много — оценка сверху
+    по quick_ratio (общие символы без учёта порядка).
+    """
+    if len(x) * len(y) <= CHAR_CELLS:
+        return sum(block.size for block in difflib.SequenceMatcher(None, x, y, autojunk=False).get_matching_blocks())
+    xw, yw = x.split(" "), y.split(" ")
+    if len(xw) * len(yw) <= CHAR_CELLS:
+        blocks = difflib.SequenceMatcher(None, xw, yw, autojunk=False).get_matching_blocks()
+        return sum(len(" ".join(xw[block.a:block.a + block.size])) for block in blocks)
+    ratio = difflib.SequenceMatcher(None, x, y, autojunk=False).quick_ratio()
+    return round(ratio * (len(x) + len(y)) / 2)
+
+
+def score_tokens(ref: list[str], res: list[str], ops=None) -> dict:
+    """Метрики по готовым спискам слов (ops — уже посчитанное выравнивание)."""
+    ops = align(ref, res) if ops is None else ops
+    matched = substitutions = deletions = insertions = 0
+    char_edits = matched_chars = 0
+    for tag, i1, i2, j1, j2 in ops:
+        if tag == "equal":
+            matched += i2 - i1
+            matched_chars += len(" ".join(ref[i1:i2]))
+            continue
+        substitutions += min(i2 - i1, j2 - j1)
+        deletions += max(0, (i2 - i1) - (j2 - j1))
+        insertions += max(0, (j2 - j1) - (i2 - i1))
+        x, y = " ".join(ref[i1:i2]), " ".join(res[j1:j2])
+        char_edits += char_distance(x, y)
+        matched_chars += char_matches(x, y)
+    ref_chars, res_chars = len(" ".join(ref)), len(" ".join(res))
+    n = len(ref)
+    return {
+        "similarity": 2 * matched_chars / (ref_chars + res_chars) * 100 if ref_chars + res_chars else 100.0,
+        "accuracy": matched / n * 100 if n else 0.0,
+        "char_accuracy": max(0.0, 1 - char_edits / ref_chars) * 100 if ref_chars else 0.0,
+        "word_error_rate": (substitutions + deletions + insertions) / n * 100 if n else 0.0,
+        "words": {"reference": n, "result": len(res), "matched": matched, "substitutions": substitutions,
+                  "deletions": deletions, "insertions": insertions},
+        "chars": {"reference": ref_chars, "result": res_chars, "edits": char_edits},
+    }
+
+
+def score(result: str, reference: str) -> dict:
+    """Схожесть (посимвольно), точность слов (доля слов эталона на своих местах), точность символов
+    (1 − расстояние Левенштейна / длина эталона) и доля ошибок слов, в процентах."""
+    return score_tokens(tokenize(reference), tokenize(result))
+
+
+def read_stage_text(path: Path) -> str:
+    """Текст результата этапа: .txt как есть, structured*.json — тексты блоков через пустую строку."""
+    if path.suffix == ".json":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return "\n\n".join(b.get("text") or "" for b in data.get("blocks", []))
+    return path.read_text(encoding="utf-8")
+
+
+def stage_snapshots(outdir: Path) -> list[tuple[str, Path]]:
+    """(этап, файл) для этапов, выполненных в outdir; этапы с общим файлом объединяются в один снимок."""
+    ran = None
+    metrics = outdir / "pipeline_metrics.json"
+    if metrics.exists():
+        data = json.loads(metrics.read_text(encoding="utf-8"))
+        ran = {s["name"] for s in data.get("stages", []) if s.get("status") in ("ok", "cached")}
+    snapshots: list[tuple[str, Path]] = []
+    for stage, name in STAGE_TEXTS:
+        path = outdir / name
+        if not path.exists() or (ran is not None and stage not in ran):
+            continue
+        if snapshots and snapshots[-1][1] == path:
+            snapshots[-1] = (f"{snapshots[-1][0]}+{stage}", path)
+        else:
+            snapshots.append((stage, path))
+    return snapshots
+
+
+def attribute_errors(reference: str, snapshots: list[tuple[str, str]]) -> dict:
+    """Атрибуция ошибок по снимкам текста [(этап, текст)] в порядке пайплайна.
+
+    Слово эталона верно в снимке, если выравнивание сопоставило его с тем же словом.
+    Оставшаяся ошибка (слово неверно в последнем снимке) приписывается этапу, после
+    которого слово стало неверным в последний раз; ошибки, которые были с самого
+    начала и не исправлены, — первому этапу.
+    """
+    ref = tokenize(reference)
+    statuses, stages = [], []
+    for stage, text in snapshots:
+        res = tokenize(text)
+        ops = align(ref, res)
+        correct = bytearray(len(ref))
+        for tag, i1, i2, _, _ in ops:
+            if tag == "equal":
+                correct[i1:i2] = b"\x01" * (i2 - i1)
+        statuses.append(correct)
+        stages.append({"stage": stage, **score_tokens(ref, res, ops), "fixed": 0, "broken": 0,
+                       "remaining": 0, "examples": []})
+        if len(statuses) > 1:
+            before = statuses[-2]
+            stages[-1]["fixed"] = sum(1 for p, c in zip(before, correct) if c and not p)
+            stages[-1]["broken"] = sum(1 for p, c in zip(before, correct) if p and not c)
+    if not statuses:
+        return {"stages": [], "remaining_errors": 0}
+
+    final_res = tokenize(snapshots[-1][1])
+    final_ops = align(ref, final_res)
+    where = {}  # индекс слова эталона → соответствующий фрагмент результата
+    for tag, i1, i2, j1, j2 in final_ops:
+        if tag in ("replace", "delete"):
+            for i in range(i1, i2):
+                where[i] = (i1, i2, j1, j2)
+    for i, ok in enumerate(statuses[-1]):
+        if ok:
+            continue
+        k = len(statuses) - 1
+        while k > 0 and not statuses[k - 1][i]:
+            k -= 1
+        # k — первый снимок непрерывной серии ошибок; если до него слово было верным, ошибку внёс этап k
+        entry = stages[k]
+        entry["remaining"] += 1
+        if len(entry["examples"]) < EXAMPLES_PER_STAGE and i in where:
+            i1, i2, j1, j2 = where[i]
+            example = {"reference": " ".join(ref[i1:i2]), "result": " ".join(final_res[j1:j2])}
+            if example not in entry["examples"]:
+                entry["examples"].append(example)
+    return {"stages": stages, "remaining_errors": sum(s["remaining"] for s in stages)}
+
+
+def attribute_outdir(reference: str, outdir: Path) -> dict:
+    snapshots = stage_snapshots(outdir)
+    result = attribute_errors(reference, [(stage, read_stage_text(path)) for stage, path in snapshots])
+    for entry, (_, path) in zip(result["stages"], snapshots):
+        entry["file"] = path.name
+    return result
+
+
+def print_score(metrics: dict):
+    w = metrics["words"]
+    print(f"Схожесть {metrics['similarity']:.2f}%, точность слов {metrics['accuracy']:.2f}%, "
+          f"точность символов {metrics['char_accuracy']:.2f}%, WER {metrics['word_error_rate']:.2f}%")
+    print(f"Слов в эталоне {w['reference']}, в результате {w['result']}: совпало {w['matched']}, "
+          f"замен {w['substitutions']}, пропусков {w['deletions']}, вставок {w['insertions']}")
+
+
+def print_attribution(attribution: dict):
+    print(f"\n{'этап':<24} {'точность':>9} {'символы':>9} {'исправил':>9} {'испортил':>9} {'осталось':>9}")
+    for s in attribution["stages"]:
+        print(f"{s['stage']:<24} {s['accuracy']:>8.2f}% {s['char_accuracy']:>8.2f}% {s['fixed']:>9} "
+              f"{s['broken']:>9} {s['remaining']:>9}")
+    print(f"Осталось ошибок в словах эталона: {attribution['remaining_errors']} "
+          "(«осталось» — ошибки, внесённые этапом или не исправленные после него)")
+    for s in attribution["stages"]:
+        for ex in s["examples"]:
+            print(f"  [{s['stage']}] «{ex['reference']}» → «{ex['result']}»")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Сравнить результат пайплайна с эталоном и приписать ошибки этапам.")
+    ap.add_argument("--reference", required=True, help="Эталонный текст")
+    ap.add_argument("--result", help="Текст для оценки (по умолчанию — итоговый текст из --outdir)")
+    ap.add_argument("--outdir", help="Папка запуска pdf_to_epub.py: атрибуция ошибок по этапам")
+    ap.add_argument("--json", help="Сохранить метрики в JSON")
+    args = ap.parse_args()
+    if not args.result and not args.outdir:
+        ap.error("нужен --result или --outdir")
+
+    reference = Path(args.reference).read_text(encoding="utf-8")
+    started = time.perf_counter()
+    data = {}
+    if args.outdir:
+        attribution = attribute_outdir(reference, Path(args.outdir))
+        if not attribution["stages"]:
+            print(f"В {args.outdir} нет результатов этапов")
+            return 1
+        data["attribution"] = attribution
+    if args.result:
+        result_path = Path(args.result)
+        data.update(score(result_path.read_text(encoding="utf-8"), reference))
+    else:
+        final = data["attribution"]["stages"][-1]
+        result_path = Path(args.outdir) / final["file"]
+        data.update({k: v for k, v in final.items() if k not in ("stage", "fixed", "broken", "remaining", "examples")})
+    data["result"] = str(result_path)
+    elapsed = time.perf_counter() - started
+
+    print(f"Результат: {result_path}")
+    print_score(data)
+    if "attribution" in data:
+        print_attribution(data["attribution"])
+    print(f"\nСравнение заняло {elapsed:.2f}s")
+    if args.json:
+        Path(args.json).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Метрики сохранены в {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
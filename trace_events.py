@@ -0,0 +1,123 @@
+"""
+Запись временной шкалы пайплайна в формате Chrome trace events.
+
+Этапы размечают работу вложенными интервалами:
+
+    with span("chunk", index=i):
+        with span("LanguageTool", cat="http"):
+            ...
+
+Если трассировка не включена, span() ничего не делает. Трассировку включает
+pdf_to_epub.py --trace: переменная окружения PIPELINE_TRACE указывает папку,
+куда каждый процесс (скрипт этапа и его рабочие процессы) дописывает свои
+события в <pid>.jsonl. В конце запуска merge_trace() собирает их в один JSON,
+который открывается в chrome://tracing и https://ui.perfetto.dev.
+
+Категории: "stage" — этап целиком, "compute" — вычисления, "http" — ожидание
+ответа сетевого сервиса, "wait" — паузы между запросами, "io" — запись файлов.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ENV_VAR = "PIPELINE_TRACE"
+
+_dir: Path | None = Path(os.environ[ENV_VAR]) if os.environ.get(ENV_VAR) else None
+_events: list[dict] = []
+_lock = threading.Lock()
+_threads: dict[int, str] = {}
+
+
+def enabled() -> bool:
+    return _dir is not None
+
+
+def enable(trace_dir: str | Path):
+    """Включить трассировку в текущем процессе (и в дочерних — через окружение)."""
+    global _dir
+    _dir = Path(trace_dir)
+    _dir.mkdir(parents=True, exist_ok=True)
+    os.environ[ENV_VAR] = str(_dir)
+
+
+def _now_us() -> float:
+    return time.time_ns() / 1000
+
+
+@contextmanager
+def span(name: str, cat: str = "compute", **args):
+    """Интервал на временной шкале текущего потока; вложенные интервалы рисуются под ним."""
+    if _dir is None:
+        yield
+        return
+    start = _now_us()
+    t0 = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        dur = (time.perf_counter_ns() - t0) / 1000
+        tid = threading.get_ident()
+        event = {"name": name, "cat": cat, "ph": "X", "ts": start, "dur": dur, "pid": os.getpid(), "tid": tid}
+        if args:
+            event["args"] = args
+        with _lock:
+            _events.append(event)
+            _threads.setdefault(tid, threading.current_thread().name)
+
+
+def _process_name() -> str:
+    name = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else "python"
+    if multiprocessing.parent_process() is not None:
+        name += " (worker)"
+    return name
+
+
+def flush():
+    """Дописать накопленные события процесса в <папка трассировки>/<pid>.jsonl."""
+    if _dir is None:
+        return
+    with _lock:
+        events, threads = list(_events), dict(_threads)
+        _events.clear()
+    if not events:
+        return
+    pid = os.getpid()
+    meta = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": _process_name()}}]
+    meta += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+             for tid, name in threads.items()]
+    with open(_dir / f"{pid}.jsonl", "a", encoding="utf-8") as f:
+        for event in meta + events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+atexit.register(flush)
+if hasattr(os, "register_at_fork"):
+    # Рабочий процесс, созданный через fork, не должен повторно записать события родителя
+    os.register_at_fork(after_in_child=_events.clear)
+
+
+def merge_trace(trace_dir: str | Path, out: str | Path) -> int:
+    """Собрать события всех процессов в один trace JSON. Возвращает число событий."""
+    flush()
+    events = []
+    seen_meta = set()
+    for path in sorted(Path(trace_dir).glob("*.jsonl")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["ph"] == "M":
+                key = (event["name"], event["pid"], event.get("tid"))
+                if key in seen_meta:
+                    continue
+                seen_meta.add(key)
+            events.append(event)
+    Path(out).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False),
+                         encoding="utf-8")
+    return sum(1 for e in events if e["ph"] == "X")